@@ -0,0 +1,94 @@
+"""
+Проверка бэкапа на локальной mongoDB: бот пишет в свою БД, dump_mongo.py делает полный дамп, бот продолжает работать
+(новые вопросы, ответы, оценки, смена почты, рассылки), затем инкрементальный дамп. restore_mongo.py восстанавливает
+полный дамп и изменения в другую БД, а restore_mongo.verify сравнивает ее с исходной.\n
+Нужны локальная mongoDB и mongodump/mongorestore в PATH. Скрипт пересоздает свои БД, дампы пишет во временную папку.
+Завершается с кодом 1, если восстановленная БД отличается от исходной: документы requests, mailing, users,
+статистика или следующий id обращения.\n
+Пример: python bench/backup_roundtrip.py --mongo-url mongodb://localhost:27017/ --users 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import harness
+from db import Storage
+from dump_mongo import backup_mongo
+from models import Answer, Mailing, Question
+from restore_mongo import restore, verify
+
+DB_NAME = f"{harness.DB_NAME}_backup"
+TARGET_DB = f"{DB_NAME}_restored"
+
+parser = argparse.ArgumentParser(description="Полный и инкрементальный дамп, восстановление и сравнение с исходной БД")
+parser.add_argument("--mongo-url", default="mongodb://localhost:27017/", help="Локальная mongoDB")
+parser.add_argument("--users", type=int, default=200, help="Сколько пользователей пишут в поддержку до и после полного дампа")
+
+
+def activity(storage: Storage, users: range, tag: str) -> None:
+    """Пользователи пишут вопросы, админ отвечает на половину из них, а пользователи оценивают ответы"""
+    for user in users:
+        storage.update_user(user, user_name=f"user{user}", first_name="Bench", email=f"{tag}{user}@example.com", last_category="другое")
+        question_id = storage.save_new_question(Question(
+            Id=0, UserId=user, UserName=f"user{user}", FirstName="Bench", Question=f"Вопрос {tag} от {user}",
+            Category="другое", Email=f"{tag}{user}@example.com", Date=datetime.now()
+        ))
+        if user % 2:
+            storage.save_answer(Answer(Id=question_id, UserId=user, AdminId=harness.ADMINS[0], AdminName="admin",
+                                       UserName=f"user{user}", Text=f"Ответ {tag}", Question=""))
+            storage.mark_answer_as_correct(question_id, liked=user % 4 == 1)
+
+
+def mailing(storage: Storage, text: str) -> str:
+    return storage.create_mailing_job(Mailing(AdminId=harness.ADMINS[0], AdminUser="admin", Text=text,
+                                              Date=datetime.now(), Views=0, Picture=""))
+
+
+def main(args: argparse.Namespace) -> int:
+    source = Storage(connect_url=args.mongo_url, db_name=DB_NAME, users_cache_size=0)
+    source.client.drop_database(DB_NAME)
+    source.client.drop_database(TARGET_DB)
+    source.prepare()
+    os.chdir(tempfile.mkdtemp(prefix="backup_roundtrip_")) # dump_mongo пишет дампы в data/dumps рабочей папки
+    os.makedirs("data/dumps")
+
+    first = range(harness.USERS_FROM, harness.USERS_FROM + args.users)
+    activity(source, first, "old")
+    job_id = mailing(source, "Рассылка до полного дампа")
+    if len(asyncio.run(backup_mongo([DB_NAME], args.mongo_url, 1))) != 1:
+        return 1
+
+    # После полного дампа: новые пользователи, старые меняют почту и пишут снова, старую рассылку отменяют
+    activity(source, range(first.start, first.stop + args.users), "new")
+    source.set_mailing_job_status(job_id, "cancelled", ("pending",))
+    mailing(source, "Рассылка после полного дампа")
+    if len(asyncio.run(backup_mongo([DB_NAME], args.mongo_url, 1, incremental=True))) != 1:
+        return 1
+
+    restored = restore(DB_NAME, TARGET_DB, args.mongo_url, None)
+    problems = verify(source, restored)
+    if restored.get_rollup_statistics() != source.get_rollup_statistics():
+        problems.append("статистика восстановленной БД отличается от исходной")
+    problems += restored.check_rollups()
+    source_next, restored_next = source.next_id("requests"), restored.next_id("requests")
+    if restored_next != source_next:
+        problems.append(f"следующий id обращения {restored_next}, а в исходной БД {source_next}")
+
+    print(f"Обращений: {source.questions_cl.count_documents({})}, пользователей: {source.count_users()}, "
+          f"рассылок: {source.mailing_cl.count_documents({})}")
+    for problem in problems:
+        print(f"ПРОВАЛ: {problem}")
+    if not problems:
+        print("Восстановленная БД совпадает с исходной")
+    source.client.drop_database(DB_NAME)
+    source.client.drop_database(TARGET_DB)
+    source.client.close()
+    restored.client.close()
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,81 @@
+"""
+Бенчмарк движка рассылок: Broadcaster рассылает сообщение через FakeTelegram, который отвечает 429 Too Many Requests
+на заданную долю отправок.\n
+Каждый получатель стоит в списке --per-chat раз подряд, так параллельные воркеры берут сообщения в один чат одновременно.\n
+Печатает время рассылки, фактическую скорость, количество повторов, максимум сообщений за любую секунду
+и минимальный интервал между сообщениями в один чат. Завершается с кодом 1, если сообщений за секунду больше
+--max-per-second (лимит Telegram ~30 на бота) или в один чат сообщения ушли чаще PER_CHAT_INTERVAL.\n
+Пример: python bench/broadcast_429.py --recipients 2000 --flood-rate 0.02
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+
+from aiogram import Bot
+from aiogram.bot.api import TelegramAPIServer
+
+from harness import TOKEN, USERS_FROM, FakeTelegram
+from broadcast import Broadcaster, GLOBAL_RATE, PER_CHAT_INTERVAL
+
+parser = argparse.ArgumentParser(description="Рассылка через фейковый Bot API с ошибками 429")
+parser.add_argument("--recipients", type=int, default=1000, help="Сколько получателей")
+parser.add_argument("--per-chat", type=int, default=2, help="Сколько сообщений получает каждый получатель")
+parser.add_argument("--flood-rate", type=float, default=0.02, help="Доля отправок, на которые API ответит 429")
+parser.add_argument("--retry-after", type=int, default=1, help="Сколько секунд просит подождать API в ответе 429")
+parser.add_argument("--rate", type=float, default=GLOBAL_RATE, help="Ограничение скорости Broadcaster, сообщений в секунду")
+parser.add_argument("--concurrency", type=int, default=20)
+parser.add_argument("--api-latency-ms", type=float, default=30, help="Задержка ответа фейкового Bot API")
+parser.add_argument("--max-per-second", type=int, default=30, help="Упасть, если за какую-то секунду ушло больше сообщений")
+# Время отправки FakeTelegram отмечает при получении запроса, а запросы идут параллельно и могут немного обгонять друг друга
+JITTER = 0.05
+
+
+def min_chat_interval(sent: list[tuple[float, int]]) -> float | None:
+    """Минимальный интервал между сообщениями в один и тот же чат, секунды. None, если в каждый чат ушло одно сообщение"""
+    by_chat: dict[int, list[float]] = defaultdict(list)
+    for sent_at, chat_id in sent:
+        by_chat[chat_id].append(sent_at)
+    gaps = [later - earlier for times in by_chat.values() for earlier, later in zip(sorted(times), sorted(times)[1:])]
+    return min(gaps) if gaps else None
+
+
+async def run(args: argparse.Namespace) -> int:
+    telegram = await FakeTelegram(latency=args.api_latency_ms / 1000, flood_rate=args.flood_rate, retry_after=args.retry_after).start()
+    bot = Bot(TOKEN, server=TelegramAPIServer.from_base(telegram.url))
+    broadcaster = Broadcaster(rate=args.rate, concurrency=args.concurrency)
+    try:
+        started_at = time.perf_counter()
+        result = await broadcaster.broadcast(
+            [chat_id for chat_id in range(USERS_FROM, USERS_FROM + args.recipients) for _ in range(args.per_chat)],
+            lambda chat_id: bot.send_message(chat_id=chat_id, text="Бенчмарк рассылки")
+        )
+        elapsed = time.perf_counter() - started_at
+    finally:
+        await (await bot.get_session()).close()
+        await telegram.close()
+
+    print(f"Получателей: {args.recipients} по {args.per_chat} сообщения, ответов 429: {telegram.flooded} ({args.flood_rate:.0%} отправок)")
+    print(f"Доставлено: {result.Delivered}, не доставлено: {result.Failed}, повторов: {result.Retries}")
+    print(f"Время: {elapsed:.1f} с, скорость: {result.Delivered / elapsed:.1f} сообщ./с (лимит {args.rate})")
+    per_second, chat_interval = telegram.max_per_second(), min_chat_interval(telegram.sent)
+    print(f"Максимум сообщений за секунду: {per_second}")
+    if chat_interval is not None:
+        print(f"Минимальный интервал между сообщениями в один чат: {chat_interval:.3f} с (нужно {PER_CHAT_INTERVAL} с)")
+    if result.Errors:
+        print(f"Ошибки: {dict(list(result.Errors.items())[:10])}")
+
+    failed = []
+    if per_second > args.max_per_second:
+        failed.append(f"за секунду ушло {per_second} сообщений, больше {args.max_per_second}")
+    if chat_interval is not None and chat_interval < PER_CHAT_INTERVAL - JITTER:
+        failed.append(f"в один чат сообщения ушли через {chat_interval:.3f} с")
+    if result.Failed:
+        failed.append(f"не доставлено {result.Failed} сообщений")
+    if failed:
+        print("ПРОВАЛ: " + "; ".join(failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(run(parser.parse_args())))
@@ -0,0 +1,90 @@
+"""
+Проверка LRUCache под нагрузкой: через кэш проходит много уникальных пользователей, а его размер и занятая им память
+не должны расти вместе с их количеством. Память считается через tracemalloc в начале прогона (когда кэш заполнился)
+и в конце. Потом проверяется TTL: просроченные записи не возвращаются и вытесняются при следующих записях.\n
+Печатает скорость операций, счетчики кэша и память. Завершается с кодом 1, если кэш вырос больше maxsize,
+память в конце больше памяти в начале более чем на --max-growth или TTL не работает.\n
+Пример: python bench/cache_soak.py --keys 1000000 --maxsize 1000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+import harness # noqa: F401 - добавляет src в sys.path
+from cache import LRUCache
+
+parser = argparse.ArgumentParser(description="Нагрузочная проверка LRUCache")
+parser.add_argument("--keys", type=int, default=1_000_000, help="Сколько уникальных пользователей пройдет через кэш")
+parser.add_argument("--maxsize", type=int, default=1000)
+parser.add_argument("--ttl", type=float, default=600)
+parser.add_argument("--hot", type=float, default=0.8, help="Доля чтений, которые приходятся на недавних пользователей")
+parser.add_argument("--max-growth", type=float, default=0.2, help="Насколько может вырасти память кэша к концу прогона")
+parser.add_argument("--seed", type=int, default=0)
+
+
+def soak(args: argparse.Namespace) -> list[str]:
+    rnd = random.Random(args.seed)
+    cache = LRUCache(args.maxsize, args.ttl)
+    max_size = 0
+    # Первый замер - после того, как через кэш прошло 10 его размеров: он уже полон и дальше расти не должен
+    checkpoint = min(args.keys - 1, args.maxsize * 10)
+    memory_at_checkpoint = 0
+
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    for key in range(args.keys):
+        # Чаще всего пишут те, кто писал недавно: они должны оставаться в кэше
+        reader = max(0, key - rnd.randrange(args.maxsize)) if rnd.random() < args.hot else rnd.randrange(key + 1)
+        if cache.get(reader) is None:
+            cache.set(reader, {"email": f"user{reader}@example.com"})
+        cache.set(key, {"email": f"user{key}@example.com"})
+        max_size = max(max_size, len(cache))
+        if key == checkpoint:
+            memory_at_checkpoint = tracemalloc.get_traced_memory()[0]
+    elapsed = time.perf_counter() - started_at
+    memory, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = cache.stats()
+    hit_rate = stats.Hits / max(1, stats.Hits + stats.Misses)
+    print(f"Операций: {args.keys * 2} за {elapsed:.2f} с - {args.keys * 2 / elapsed:,.0f} операций/с (с tracemalloc)")
+    print(f"Размер: {len(cache)}, максимальный за прогон: {max_size} (maxsize {args.maxsize})")
+    print(f"Попаданий: {stats.Hits}, промахов: {stats.Misses} ({hit_rate:.0%} попаданий), вытеснено: {stats.Evictions}")
+    print(f"Память: {memory_at_checkpoint / 2**20:.2f} МБ после {checkpoint + 1} пользователей, "
+          f"{memory / 2**20:.2f} МБ в конце, пик {peak / 2**20:.2f} МБ")
+
+    problems = []
+    if max_size > args.maxsize:
+        problems.append("кэш вырос больше maxsize")
+    if memory > memory_at_checkpoint * (1 + args.max_growth):
+        problems.append(f"память выросла с {memory_at_checkpoint / 2**20:.2f} до {memory / 2**20:.2f} МБ")
+    return problems
+
+
+def check_ttl(maxsize: int, ttl: float = 0.05) -> list[str]:
+    """Записи старше ttl не возвращаются, а при следующих записях вытесняются, даже если кэш не переполнен"""
+    cache = LRUCache(maxsize, ttl)
+    for key in range(maxsize // 2):
+        cache.set(key, key)
+    time.sleep(ttl * 2)
+    problems = []
+    returned = sum(cache.get(key) is not None for key in range(maxsize // 4))
+    if returned:
+        problems.append(f"TTL: кэш вернул {returned} просроченных записей")
+    cache.set("fresh", 1)
+    if len(cache) != 1:
+        problems.append(f"TTL: после записи в кэше осталось {len(cache) - 1} просроченных записей")
+    print(f"TTL {ttl} с: просроченных записей вернулось {returned}, осталось после записи {len(cache) - 1}")
+    return problems
+
+
+def main(args: argparse.Namespace) -> int:
+    problems = soak(args) + check_ttl(args.maxsize)
+    for problem in problems:
+        print(f"ПРОВАЛ: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(parser.parse_args()))
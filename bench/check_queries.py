@@ -0,0 +1,141 @@
+"""
+Проверка запросов к mongoDB, которые бот реально выполняет: load.py прогоняет смешанную нагрузку на локальной mongoDB,
+а command monitoring pymongo записывает каждый фильтр (find, findAndModify, update, delete, distinct, $match агрегаций).
+Для каждой формы запроса (фильтр без конкретных значений плюс сортировка) печатается план выполнения.\n
+Завершается с кодом 1, если какой-то запрос выполняется полным сканированием коллекции (COLLSCAN)
+или его формы нет в db.QUERIES - тогда check_indexes.py не проверяет его на рабочей БД.\n
+Пример: python bench/check_queries.py --mongo-url mongodb://localhost:27017/ --scenarios 500
+"""
+import argparse
+import asyncio
+import json
+import random
+from collections import Counter
+
+from pymongo import monitoring
+
+from db import QUERIES, has_plan_stage
+from harness import DB_NAME, USERS_FROM, BenchBot, FakeTelegram
+from load import MIXES, Scenarios
+
+parser = argparse.ArgumentParser(description="Планы выполнения запросов, которые бот выполняет под нагрузкой")
+parser.add_argument("--mongo-url", default="mongodb://localhost:27017/", help="Локальная mongoDB")
+parser.add_argument("--scenarios", type=int, default=500, help="Сколько сценариев load.py выполнить")
+parser.add_argument("--concurrency", type=int, default=20)
+parser.add_argument("--seed", type=int, default=0)
+
+# Коллекции, которые бот намеренно читает целиком (запросом без фильтра): подготовленные вопросы (get_questions) -
+# их несколько десятков, и статистика за все время (get_rollup_statistics) - по несколько документов на день
+FULL_READS = {"prepared_questions_cl", "stats_cl"}
+
+
+def shape(value):
+    """Форма фильтра: ключи и операторы остаются, конкретные значения заменяются их типом"""
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return sorted({json.dumps(shape(item), sort_keys=True) for item in value})
+    return type(value).__name__
+
+
+def shape_key(collection: str, filter: dict, distinct_key: str | None, sort) -> str:
+    sort = [list(item) for item in (sort.items() if isinstance(sort, dict) else sort or [])]
+    return json.dumps([collection, shape(filter), distinct_key, sort], sort_keys=True, default=str)
+
+
+class QueryRecorder(monitoring.CommandListener):
+    """Запоминает по одному примеру каждой формы запроса к БД бенчмарка: (коллекция, фильтр, поле distinct, сортировка)"""
+    def __init__(self):
+        self.enabled = False
+        self.queries: dict[str, tuple[str, str, dict, str | None, list | None]] = {}
+        self.counts: Counter[str] = Counter()
+
+    def add(self, database: str, collection: str, filter: dict | None, distinct_key: str | None = None, sort=None) -> None:
+        filter = filter or {}
+        sort = list(sort.items()) if isinstance(sort, dict) else sort
+        key = shape_key(collection, filter, distinct_key, sort)
+        self.counts[key] += 1
+        self.queries.setdefault(key, (database, collection, filter, distinct_key, sort))
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if not self.enabled or event.database_name not in (DB_NAME, "support_admins"):
+            return
+        command, name, db = event.command, event.command_name, event.database_name
+        if name == "find":
+            self.add(db, command["find"], command.get("filter"), sort=command.get("sort"))
+        elif name == "findAndModify":
+            self.add(db, command["findAndModify"], command.get("query"), sort=command.get("sort"))
+        elif name == "update":
+            for update in command.get("updates", []):
+                self.add(db, command["update"], update["q"])
+        elif name == "delete":
+            for delete in command.get("deletes", []):
+                self.add(db, command["delete"], delete["q"])
+        elif name == "distinct":
+            self.add(db, command["distinct"], command.get("query"), command["key"])
+        elif name == "aggregate":
+            pipeline = command.get("pipeline", [])
+            if pipeline and "$match" in pipeline[0]:
+                self.add(db, command["aggregate"], pipeline[0]["$match"])
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        pass
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        pass
+
+
+def by_id(filter: dict) -> bool:
+    """Запрос по конкретному _id всегда идет по индексу _id, его в QUERIES не перечисляем"""
+    return "_id" in filter and not (isinstance(filter["_id"], dict) and any(key.startswith("$") for key in filter["_id"]))
+
+
+async def main(args: argparse.Namespace) -> int:
+    recorder = QueryRecorder()
+    monitoring.register(recorder) # Действует на клиентов, созданных после регистрации
+    rnd = random.Random(args.seed)
+    mix = MIXES["mixed"]
+    plan = iter(rnd.choices(list(mix), weights=list(mix.values()), k=args.scenarios))
+
+    telegram = await FakeTelegram().start()
+    try:
+        async with BenchBot(telegram, args.mongo_url) as bench:
+            storage = bench.app.storage.sync
+            names = {attr: getattr(storage, attr).name for attr in vars(storage) if attr.endswith("_cl")}
+            listed = {shape_key(names[attr], filter, distinct_key, sort) for attr, filter, distinct_key, sort in QUERIES}
+            full_reads = {names[attr] for attr in FULL_READS}
+
+            scenarios = Scenarios(bench, rnd)
+            recorder.enabled = True
+            for user in range(USERS_FROM, USERS_FROM + 20):
+                await scenarios.ticket(user)
+
+            async def worker(number: int):
+                for name in plan:
+                    await scenarios.run(name, number, args.concurrency, args.concurrency * 10)
+
+            await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+            await bench.app.admin_notifier.drain() # Уведомления админам тоже ходят в БД
+            recorder.enabled = False
+
+            problems = []
+            for key, (database, collection, filter, distinct_key, sort) in sorted(recorder.queries.items()):
+                winning = storage.explain_query(bench.client[database][collection], filter, distinct_key, sort)
+                collscan = has_plan_stage(winning, "COLLSCAN") and not (collection in full_reads and not filter)
+                unlisted = key not in listed and not by_id(filter) and not (collection in full_reads and not filter)
+                marks = [mark for mark, bad in (("COLLSCAN", collscan), ("нет в QUERIES", unlisted)) if bad]
+                query = f"distinct({distinct_key!r}, {shape(filter)})" if distinct_key else f"find({shape(filter)}).sort({sort})"
+                print(f"{'ПРОВАЛ' if marks else 'ok':6} {recorder.counts[key]:6} x {collection}.{query} {', '.join(marks)}")
+                if marks:
+                    problems.append(key)
+            if bench.errors:
+                print(f"Ошибки при обработке обновлений: {dict(bench.errors)}")
+    finally:
+        await telegram.close()
+
+    print(f"Форм запросов: {len(recorder.queries)}, с проблемами: {len(problems)}")
+    return 1 if problems or bench.errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
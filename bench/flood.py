@@ -0,0 +1,123 @@
+"""
+Флуд: несколько пользователей без остановки отправляют боту обращения, часть из них - одинаковые.
+Прогон делается дважды: без ограничения частоты и с ним. Печатает, сколько обращений создано, сколько обновлений отброшено
+и сколько сообщений админам на самом деле отправил FakeTelegram после того, как очередь уведомлений опустела.\n
+С ограничением число обращений от одного пользователя не должно превышать то, что пропускает лимит за время прогона.
+Каждое обращение должно либо дойти до каждого админа, либо попасть в число пропущенных уведомлений,
+о которых админам приходит отдельное сообщение.\n
+Пример: python bench/flood.py --flooders 20 --messages 200
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import harness
+from broadcast import NOTIFY_QUEUE_SIZE
+from harness import ADMINS, USERS_FROM, BenchBot, FakeTelegram, counter_total
+from metrics import ADMIN_NOTIFICATIONS, DUPLICATE_QUESTIONS, THROTTLED
+from throttle import CHAT_LIMIT, THROTTLE_WINDOW, USER_LIMIT
+
+parser = argparse.ArgumentParser(description="Флуд обращениями с ограничением частоты и без")
+parser.add_argument("--flooders", type=int, default=20, help="Сколько пользователей флудят одновременно")
+parser.add_argument("--messages", type=int, default=200, help="Сколько обращений пытается отправить каждый")
+parser.add_argument("--duplicates", type=float, default=0.5, help="Доля обращений, которые повторяют предыдущее слово в слово")
+parser.add_argument("--user-limit", type=int, default=USER_LIMIT)
+parser.add_argument("--chat-limit", type=int, default=CHAT_LIMIT)
+parser.add_argument("--seed", type=int, default=0)
+# В боте очередь на NOTIFY_QUEUE_SIZE уведомлений, и ее переполняет только долгий флуд. Здесь она меньше,
+# чтобы короткий прогон дошел до отбрасывания уведомлений и не ждал отправки тысячи уведомлений по одному в секунду
+parser.add_argument("--notify-queue", type=int, default=50, help=f"Размер очереди уведомлений админам (в боте {NOTIFY_QUEUE_SIZE})")
+
+SUMMARY = "⚠️ Пропущено уведомлений" # Начало сообщения AdminNotifier о пропущенных уведомлениях
+
+
+async def flood(bench: BenchBot, user: int, messages: int, duplicates: float, rnd: random.Random):
+    """Пользователь вводит почту и раз за разом отправляет "Другое" и текст проблемы"""
+    await bench.feed(bench.updates.message(user, "Другое"))
+    await bench.feed(bench.updates.message(user, f"user{user}@example.com"))
+    # Текст не похож ни на один подготовленный вопрос, чтобы бот создавал обращение, а не предлагал готовый ответ
+    text = f"Тестовое сообщение флуд {user}"
+    for number in range(messages):
+        if rnd.random() >= duplicates:
+            text = f"Тестовое сообщение флуд {user} номер {number}"
+        await bench.feed(bench.updates.message(user, "Другое"))
+        await bench.feed(bench.updates.message(user, text))
+
+
+async def run(args: argparse.Namespace, user_limit: int, chat_limit: int) -> dict:
+    rnd = random.Random(args.seed)
+    telegram = await FakeTelegram().start()
+    try:
+        async with BenchBot(telegram, user_limit=user_limit, chat_limit=chat_limit, notify_queue_size=args.notify_queue) as bench:
+            storage_before = harness.storage_calls()
+            throttled_before, duplicates_before = counter_total(THROTTLED), counter_total(DUPLICATE_QUESTIONS)
+            dropped_before = counter_total(ADMIN_NOTIFICATIONS, result="dropped")
+            sent_before = len(telegram.texts)
+            flooders = range(USERS_FROM, USERS_FROM + args.flooders)
+
+            started_at = time.perf_counter()
+            await asyncio.gather(*(flood(bench, user, args.messages, args.duplicates, rnd) for user in flooders))
+            elapsed = time.perf_counter() - started_at
+
+            # Уведомления админам отправляются в фоне, а их очередь ограничена, поэтому дождаться ее можно всегда
+            await bench.app.admin_notifier.drain()
+            tickets = (harness.storage_calls() - storage_before)["save_new_question"]
+            to_admins = [text for chat_id, text in telegram.texts[sent_before:] if chat_id in ADMINS]
+            summaries = sum(text.startswith(SUMMARY) for text in to_admins)
+            return {
+                "updates": len(bench.latencies),
+                "errors": dict(bench.errors),
+                "seconds": elapsed,
+                "tickets": int(tickets),
+                "notifications": len(to_admins) - summaries,
+                "summaries": summaries,
+                "dropped": int(counter_total(ADMIN_NOTIFICATIONS, result="dropped") - dropped_before),
+                "throttled": int(counter_total(THROTTLED) - throttled_before),
+                "duplicates": int(counter_total(DUPLICATE_QUESTIONS) - duplicates_before),
+                "latency": harness.percentiles(bench.latencies),
+            }
+    finally:
+        await telegram.close()
+
+
+def report(title: str, result: dict) -> None:
+    print(title)
+    print(f"  Обновлений: {result['updates']} за {result['seconds']:.2f} с, задержка, мс: {harness.format_ms(result['latency'])}")
+    print(f"  Отброшено лимитом: {result['throttled']}, повторных обращений: {result['duplicates']}")
+    print(f"  Создано обращений: {result['tickets']}, отправлено админам уведомлений: {result['notifications']}, "
+          f"пропущено: {result['dropped']}, сообщений о пропущенных: {result['summaries']}")
+    if result["errors"]:
+        print(f"  Ошибки: {result['errors']}")
+
+
+async def main(args: argparse.Namespace) -> int:
+    unlimited = await run(args, user_limit=0, chat_limit=0)
+    report("Без ограничения частоты", unlimited)
+    limited = await run(args, user_limit=args.user_limit, chat_limit=args.chat_limit)
+    report(f"С ограничением {args.user_limit} обновлений от пользователя за {THROTTLE_WINDOW} с", limited)
+
+    # На обращение уходит два обновления ("Другое" и текст), а скользящее окно за время прогона пропускает
+    # не больше лимита на каждое начатое окно и еще одного лимита на границе окон
+    allowed = args.user_limit * (limited["seconds"] // THROTTLE_WINDOW + 2)
+    bound = args.flooders * allowed // 2
+    print(f"Граница для обращений с ограничением: {bound}")
+    problems = []
+    if limited["tickets"] > bound:
+        problems.append("обращений больше границы")
+    for name, result in (("без ограничения", unlimited), ("с ограничением", limited)):
+        # Уведомление о каждом обращении либо ушло всем админам, либо отброшено и учтено в сообщении о пропущенных
+        expected = (result["tickets"] - result["dropped"]) * len(ADMINS)
+        if result["notifications"] != expected:
+            problems.append(f"{name}: админам ушло {result['notifications']} уведомлений вместо {expected}")
+        if result["dropped"] and not result["summaries"]:
+            problems.append(f"{name}: админам не пришло сообщение о {result['dropped']} пропущенных уведомлениях")
+        if result["errors"]:
+            problems.append(f"{name}: ошибки при обработке обновлений")
+    for problem in problems:
+        print(f"ПРОВАЛ: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,374 @@
+"""
+Общие части бенчмарков: фейковый Telegram Bot API, mongoDB в памяти (mongomock) или локальная mongoDB,
+и SupportBot из main.py, подключенный к ним.\n
+Скрипты запускаются из корня репозитория, например: python bench/load.py --mix mixed
+"""
+import asyncio
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Executor, ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+sys.path.insert(0, SRC)
+CWD = os.getcwd() # Папка, из которой запустили бенчмарк: относительные пути из аргументов считаются от нее
+# Storage читает data/questions.json относительно рабочей папки, как и при обычном запуске бота из src
+os.chdir(SRC)
+
+import pymongo
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.storage import BaseStorage
+from pymongo import monitoring
+
+import tools
+from broadcast import NOTIFY_QUEUE_SIZE
+from main import SupportBot
+from throttle import CHAT_LIMIT, USER_LIMIT
+from metrics import BOT_API_SECONDS, HANDLER_ERRORS, HANDLER_SECONDS, STORAGE_SECONDS
+
+TOKEN = "123456:BENCH"
+BOT_NAME = "bench"
+DB_NAME = "bench_support_bot"
+ADMINS = (1, 2, 3, 4, 5) # Админы из support_admins, которые получают уведомления о новых вопросах
+USERS_FROM = 1_000_000 # id пользователей начинаются отсюда, чтобы не пересекаться с админами
+
+# Методы Bot API, которые отправляют сообщения. Только на них FakeTelegram отвечает 429
+SEND_METHODS = {"sendMessage", "sendPhoto"}
+MESSAGE_METHODS = SEND_METHODS | {"editMessageText", "editMessageReplyMarkup"}
+
+
+class FakeTelegram:
+    """
+    Фейковый Telegram Bot API на aiohttp. Отвечает как настоящий API на методы, которые использует бот,
+    считает вызовы по методам и запоминает, когда и в какой чат ушло каждое сообщение.\n
+    latency - сколько секунд "думает" API на каждый запрос, flood_rate - доля отправок, на которые API ответит 429 Too Many Requests
+    """
+    def __init__(self, latency: float = 0.0, flood_rate: float = 0.0, retry_after: int = 1, seed: int = 0):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.calls: Counter[str] = Counter()
+        self.flooded = 0
+        self.sent: list[tuple[float, int]] = [] # (time.monotonic(), chat_id) каждого доставленного сообщения
+        self.texts: list[tuple[int, str]] = [] # (chat_id, текст) каждого доставленного сообщения
+        self.url = ""
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1)
+        self._runner: web.AppRunner | None = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> "FakeTelegram":
+        server = web.Application()
+        server.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(server)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return self
+
+    async def close(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method in SEND_METHODS and self.flood_rate and self._random.random() < self.flood_rate:
+            self.flooded += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}
+            }, status=429)
+        return web.json_response({"ok": True, "result": self.result(method, data)})
+
+    def result(self, method: str, data: dict):
+        if method in MESSAGE_METHODS:
+            chat_id = int(data.get("chat_id", 0))
+            if method in SEND_METHODS:
+                self.sent.append((time.monotonic(), chat_id))
+                self.texts.append((chat_id, data.get("text") or data.get("caption") or ""))
+            return {
+                "message_id": int(data.get("message_id", 0)) or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": data.get("text") or data.get("caption") or "",
+            }
+        if method == "getMe":
+            return {"id": int(TOKEN.split(":")[0]), "is_bot": True, "first_name": BOT_NAME, "username": f"{BOT_NAME}_bot"}
+        if method == "getUpdates":
+            return []
+        return True
+
+    def max_per_second(self) -> int:
+        """Максимальное количество сообщений, отправленных за любое окно в 1 секунду"""
+        times = sorted(sent for sent, _ in self.sent)
+        best, start = 0, 0
+        for end, sent in enumerate(times):
+            while sent - times[start] >= 1:
+                start += 1
+            best = max(best, end - start + 1)
+        return best
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Считает команды, которые pymongo отправил в mongoDB (служебные проверки соединения не считаются)"""
+    IGNORED = {"hello", "ismaster", "isMaster", "ping", "endSessions", "buildInfo"}
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if event.command_name not in self.IGNORED:
+            self.count += 1
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        pass
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        pass
+
+
+class Updates:
+    """Фабрика обновлений Telegram в том виде, в котором их присылает API"""
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    @staticmethod
+    def user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def _message(self, user_id: int, text: str, reply_to_text: str | None = None) -> dict:
+        message = {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self.user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        if reply_to_text is not None:
+            message["reply_to_message"] = {
+                "message_id": next(self._ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": reply_to_text,
+            }
+        return message
+
+    def message(self, user_id: int, text: str, reply_to_text: str | None = None) -> dict:
+        return {"update_id": next(self._ids), "message": self._message(user_id, text, reply_to_text)}
+
+    def callback(self, user_id: int, data: str, message_text: str = "") -> dict:
+        return {"update_id": next(self._ids), "callback_query": {
+            "id": str(next(self._ids)),
+            "from": self.user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": self._message(user_id, message_text),
+        }}
+
+
+class SlowMongo:
+    """
+    mongomock, который отвечает не мгновенно, а через latency секунд, как mongoDB по сети или под нагрузкой.\n
+    mongomock не рассчитан на многопоточность, поэтому сами операции выполняются под общей блокировкой,
+    а задержка - вне ее: несколько потоков AsyncStorage ждут "ответа БД" одновременно, как с настоящей mongoDB.
+    Курсоры find читаются целиком при итерации, тоже под блокировкой
+    """
+    def __init__(self, target, latency: float = 0.0, lock: "threading.RLock | None" = None):
+        self._target = target
+        self._latency = latency
+        self._lock = lock or threading.RLock()
+
+    def __getitem__(self, name: str) -> "SlowMongo":
+        # client[db] и db[collection]
+        return SlowMongo(self._target[name], self._latency, self._lock)
+
+    def __getattr__(self, name: str):
+        import mongomock
+        attr = getattr(self._target, name)
+        if isinstance(attr, (mongomock.Database, mongomock.Collection)): # collection.database
+            return SlowMongo(attr, self._latency, self._lock)
+        if not callable(attr) or isinstance(self._target, mongomock.MongoClient):
+            return attr
+
+        def call(*args, **kwargs):
+            if self._latency and not isinstance(self._target, mongomock.collection.Cursor):
+                time.sleep(self._latency)
+            with self._lock:
+                result = attr(*args, **kwargs)
+                if isinstance(result, mongomock.collection.Cursor): # find(...).sort(...).limit(...)
+                    return SlowMongo(result, self._latency, self._lock)
+                if isinstance(result, mongomock.command_cursor.CommandCursor): # aggregate
+                    return iter(list(result))
+                return result
+        return call
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._target))
+
+
+def mongo_client(mongo_url: str | None, latency: float = 0.0) -> tuple[pymongo.MongoClient, CommandCounter | None]:
+    """
+    Клиент mongoDB для бенчмарка. Без mongo_url - mongomock в памяти с задержкой latency на каждую операцию
+    (тогда команды mongoDB не считаются), иначе - настоящая mongoDB со счетчиком команд.
+    Используйте только локальную mongoDB: бенчмарк пересоздает свою БД и добавляет тестовых админов в support_admins
+    """
+    if not mongo_url:
+        import mongomock
+        return SlowMongo(mongomock.MongoClient(), latency), None
+    counter = CommandCounter()
+    return pymongo.MongoClient(mongo_url, event_listeners=[counter]), counter
+
+
+class BenchBot:
+    """
+    SupportBot из main.py, подключенный к FakeTelegram и mongomock (SlowMongo) или локальной mongoDB.
+    Обновления передаются прямо в Dispatcher.process_update, так замеряется работа самого бота без сети Telegram.\n
+    mongo_latency - задержка каждой операции mongomock. executor заменяет пул потоков AsyncStorage.
+    state, fsm_storage и notify_queue_size передаются в SupportBot. С client бот работает с БД другого BenchBot, как вторая реплика:
+    тогда БД не пересоздается и не удаляется при выходе
+    """
+    def __init__(self, telegram: FakeTelegram, mongo_url: str | None = None, workers: int = 16,
+                 user_limit: int = USER_LIMIT, chat_limit: int = CHAT_LIMIT, mongo_latency: float = 0.0,
+                 executor: Executor | None = None, state: str = "memory", fsm_storage: BaseStorage | None = None,
+                 client: pymongo.MongoClient | None = None, notify_queue_size: int = NOTIFY_QUEUE_SIZE):
+        self.telegram = telegram
+        self.notify_queue_size = notify_queue_size
+        self.state = state
+        self.fsm_storage = fsm_storage
+        self.client = client
+        self.replica = client is not None
+        self.mongo_latency = mongo_latency
+        self.executor = executor
+        self.user_limit = user_limit
+        self.chat_limit = chat_limit
+        self.mongo_url = mongo_url
+        self.workers = workers
+        self.updates = Updates()
+        self.latencies: list[float] = []
+        self.errors: Counter[str] = Counter()
+
+    async def __aenter__(self) -> "BenchBot":
+        if self.replica:
+            self.commands = None
+        else:
+            self.client, self.commands = mongo_client(self.mongo_url, self.mongo_latency)
+            self.client.drop_database(DB_NAME)
+            admins = self.client["support_admins"]["admins"]
+            for admin in ADMINS:
+                # Существующих админов не трогаем, а созданных бенчмарком потом удаляем по метке bench
+                admins.update_one({"id": admin}, {"$setOnInsert": {"active": True, "bench": True}}, upsert=True)
+
+        self.executor = self.executor or ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="mongo")
+        config = tools.Config(BotName=BOT_NAME, Token=TOKEN, MongodbName=DB_NAME, StartMessage="Бенчмарк")
+        self.app = SupportBot(config, self.client, self.executor, self.state, api_server=self.telegram.url,
+                              user_limit=self.user_limit, chat_limit=self.chat_limit, fsm_storage=self.fsm_storage,
+                              notify_queue_size=self.notify_queue_size)
+        # Как и в start_polling, хендлеры получают бота и диспетчер из контекста
+        Bot.set_current(self.app.bot)
+        Dispatcher.set_current(self.app.dp)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.app.close()
+        self.executor.shutdown(wait=True)
+        if self.replica:
+            return
+        self.client["support_admins"]["admins"].delete_many({"bench": True})
+        self.client.drop_database(DB_NAME)
+        self.client.close()
+
+    async def feed(self, update: dict) -> float:
+        """
+        Обрабатываем одно обновление и запоминаем, сколько это заняло. Вернет время обработки в секундах.\n
+        Как и при polling, каждое обновление обрабатывается в своей задаче: aiogram запоминает состояние FSM в ContextVar,
+        и без отдельного контекста следующее обновление увидело бы состояние предыдущего.
+        В той же задаче бот и диспетчер становятся текущими, поэтому несколько BenchBot могут работать одновременно
+        """
+        async def process():
+            Bot.set_current(self.app.bot)
+            Dispatcher.set_current(self.app.dp)
+            # Как Dispatcher.process_updates при polling: через updates_handler, чтобы сработали middleware уровня update
+            await self.app.dp.updates_handler.notify(types.Update(**update))
+
+        started_at = time.perf_counter()
+        try:
+            await asyncio.create_task(process())
+        except Exception as err:
+            self.errors[type(err).__name__] += 1
+        elapsed = time.perf_counter() - started_at
+        self.latencies.append(elapsed)
+        return elapsed
+
+    def mongo_commands(self) -> int | None:
+        return self.commands.count if self.commands else None
+
+
+def histogram_counts(histogram, label: str) -> Counter[str]:
+    """Количество наблюдений prometheus-гистограммы бенчмарк-бота по значениям метки label"""
+    counts: Counter[str] = Counter()
+    for metric in histogram.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_count") and sample.labels.get("bot") == BOT_NAME:
+                counts[sample.labels[label]] += sample.value
+    return counts
+
+
+def counter_total(counter, **labels) -> float:
+    """Сумма prometheus-счетчика бенчмарк-бота по всем меткам или только по тем, где метки равны labels"""
+    return sum(
+        sample.value
+        for metric in counter.collect()
+        for sample in metric.samples
+        if sample.name.endswith("_total") and sample.labels.get("bot") == BOT_NAME
+        and all(sample.labels.get(name) == value for name, value in labels.items())
+    )
+
+
+def storage_calls() -> Counter[str]:
+    """Сколько раз вызывался каждый метод Storage (из гистограммы metrics.STORAGE_SECONDS)"""
+    return histogram_counts(STORAGE_SECONDS, "method")
+
+
+def handled_updates() -> float:
+    """Сколько обновлений обработал диспетчер бенчмарк-бота"""
+    return histogram_counts(HANDLER_SECONDS, "handler")["process_update"]
+
+
+def handler_errors() -> float:
+    """Сколько обновлений бенчмарк-бота закончились необработанной ошибкой"""
+    return counter_total(HANDLER_ERRORS)
+
+
+def bot_api_calls() -> Counter[str]:
+    """Сколько раз вызывался каждый метод Bot API"""
+    return histogram_counts(BOT_API_SECONDS, "method")
+
+
+def percentiles(values: list[float], points: tuple[float, ...] = (50, 90, 99)) -> dict[str, float]:
+    """Перцентили и максимум (nearest-rank) в тех же единицах, что и values"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {f"p{point:g}": ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))] for point in points}
+    result["max"] = ordered[-1]
+    return result
+
+
+def format_ms(stats: dict[str, float]) -> str:
+    return ", ".join(f"{name} {value * 1000:.1f}" for name, value in stats.items())
@@ -0,0 +1,79 @@
+"""
+Проверка атомарности id обращений: несколько процессов (как несколько реплик бота), в каждом пул потоков,
+одновременно вызывают Storage.save_new_question. Каждый id должен достаться ровно одному обращению.\n
+Нужна локальная mongoDB: скрипт пересоздает свою БД. Завершается с кодом 1, если хоть один id повторился.\n
+Пример: python bench/id_race.py --mongo-url mongodb://localhost:27017/ --processes 4 --threads 32 --questions 5000
+"""
+import argparse
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+import harness
+from db import Storage
+from models import Question
+
+DB_NAME = f"{harness.DB_NAME}_ids"
+
+parser = argparse.ArgumentParser(description="Параллельное создание обращений и проверка уникальности id")
+parser.add_argument("--mongo-url", default="mongodb://localhost:27017/", help="Локальная mongoDB")
+parser.add_argument("--processes", type=int, default=4, help="Сколько процессов создают обращения одновременно")
+parser.add_argument("--threads", type=int, default=32, help="Сколько потоков в каждом процессе")
+parser.add_argument("--questions", type=int, default=5000, help="Сколько обращений создать всего")
+
+
+def create(mongo_url: str, threads: int, first_user: int, count: int) -> list[int]:
+    """Создаем count обращений из threads потоков одного процесса. Вернет выданные id"""
+    storage = Storage(connect_url=mongo_url, db_name=DB_NAME)
+    question = Question(Id=0, UserId=0, UserName="race", FirstName="Race", Question="Проверка id", Category="другое",
+                        Email="race@example.com", Date=datetime.now())
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            return list(pool.map(lambda user: storage.save_new_question(question._replace(UserId=user)),
+                                 range(first_user, first_user + count)))
+    finally:
+        storage.client.close()
+
+
+def main(args: argparse.Namespace) -> int:
+    storage = Storage(connect_url=args.mongo_url, db_name=DB_NAME)
+    storage.client.drop_database(DB_NAME)
+    storage.client.close()
+
+    per_process = args.questions // args.processes
+    started_at = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        futures = [
+            pool.submit(create, args.mongo_url, args.threads, harness.USERS_FROM + i * per_process, per_process)
+            for i in range(args.processes)
+        ]
+        returned = [question_id for future in futures for question_id in future.result()]
+    elapsed = time.perf_counter() - started_at
+
+    storage = Storage(connect_url=args.mongo_url, db_name=DB_NAME)
+    stored = [doc["id"] for doc in storage.questions_cl.find({}, {"id": 1, "_id": 0})]
+    storage.client.drop_database(DB_NAME)
+    storage.client.close()
+
+    print(f"Создано обращений: {len(returned)} за {elapsed:.1f} с ({args.processes} процессов по {args.threads} потоков)")
+    problems = []
+    for name, ids in (("выданные save_new_question", returned), ("сохраненные в requests", stored)):
+        repeated = {question_id: count for question_id, count in Counter(ids).items() if count > 1}
+        if repeated:
+            problems.append(f"{name}: {len(repeated)} повторяющихся id, например {next(iter(repeated))}")
+    if len(stored) != len(returned):
+        problems.append(f"в requests {len(stored)} документов вместо {len(returned)}")
+    elif sorted(stored) != list(range(1, len(stored) + 1)):
+        problems.append("id в requests идут не подряд с 1")
+
+    for problem in problems:
+        print(f"ПРОВАЛ: {problem}")
+    if not problems:
+        print(f"Все {len(returned)} id уникальны и идут подряд")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args()))
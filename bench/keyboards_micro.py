@@ -0,0 +1,60 @@
+"""
+Микробенчмарк сценария "пользователь выбрал категорию": как было (regex-запрос в mongoDB и сборка клавиатуры на каждое сообщение)
+и как стало (PreparedCatalog и KeyboardCache). mongoDB подменена mongomock, поэтому старый вариант здесь даже быстрее,
+чем с настоящей БД, где к каждому запросу добавляется сеть.\n
+Перед замером проверяет, что закэшированные клавиатуры совпадают с собранными заново.\n
+Пример: python bench/keyboards_micro.py --number 2000 --min-speedup 10
+"""
+import argparse
+import timeit
+
+import mongomock
+
+from harness import DB_NAME
+import keyboards as kb
+from catalog import PreparedCatalog
+from db import Storage
+
+parser = argparse.ArgumentParser(description="Микробенчмарк клавиатур категорий")
+parser.add_argument("--number", type=int, default=1000, help="Сколько раз выполнить каждый вариант")
+parser.add_argument("--min-speedup", type=float, help="Упасть, если кэш быстрее старого варианта меньше, чем во столько раз")
+
+
+def main(args: argparse.Namespace) -> int:
+    storage = Storage(db_name=DB_NAME, client=mongomock.MongoClient())
+    storage.prepare(add_prepared_questions=True)
+    catalog = PreparedCatalog(storage)
+    keyboards = kb.KeyboardCache(catalog)
+    categories = [c for c in catalog.categories if c.lower() != "другое"]
+
+    def legacy():
+        for category in categories:
+            kb.get_keyboard_by_category(storage.get_questions_by_category(category))
+
+    def cached():
+        for category in categories:
+            if catalog.is_category(category):
+                keyboards.get_keyboard_by_category(category)
+
+    for category in categories:
+        expected = kb.get_keyboard_by_category(storage.get_questions_by_category(category))
+        actual = keyboards.get_keyboard_by_category(category)
+        if (expected.Text, expected.Keyboard.to_python()) != (actual.Text, actual.Keyboard.to_python()):
+            print(f"ПРОВАЛ: закэшированная клавиатура категории {category} отличается от собранной заново")
+            return 1
+
+    seconds = {}
+    for name, func in (("БД + сборка клавиатуры", legacy), ("каталог + KeyboardCache", cached)):
+        seconds[name] = timeit.timeit(func, number=args.number)
+        print(f"{name}: {seconds[name] / (args.number * len(categories)) * 1_000_000:.1f} мкс на категорию")
+
+    speedup = seconds["БД + сборка клавиатуры"] / seconds["каталог + KeyboardCache"]
+    print(f"Ускорение: в {speedup:.0f} раз")
+    if args.min_speedup is not None and speedup < args.min_speedup:
+        print(f"ПРОВАЛ: ускорение меньше {args.min_speedup}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(parser.parse_args()))
@@ -0,0 +1,192 @@
+"""
+Нагрузочный тест бота: SupportBot из main.py обрабатывает синтетический трафик, а Telegram и mongoDB подменены
+FakeTelegram и mongomock (или локальной mongoDB через --mongo-url).\n
+Сценарии повторяют то, что делают живые пользователи и админы: просмотр категорий, создание обращений,
+ответы админов, статистика и рассылки. Скрипт печатает пропускную способность, перцентили задержки обработки обновления,
+количество вызовов Storage, Bot API и команд mongoDB на одно обновление.\n
+С --max-p99-ms и --min-rps скрипт завершается с кодом 1, если результат хуже порога, - так регрессию видно до деплоя.\n
+Пример: python bench/load.py --mix mixed --scenarios 2000 --concurrency 50 --json bench/results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+import harness
+from harness import ADMINS, USERS_FROM, BenchBot, FakeTelegram
+
+parser = argparse.ArgumentParser(description="Нагрузочный тест бота поддержки")
+parser.add_argument("--mix", default="mixed", help="Набор сценариев: browse, ticket, reply, stats, mailing или mixed")
+parser.add_argument("--scenarios", type=int, default=1000, help="Сколько сценариев выполнить")
+parser.add_argument("--concurrency", type=int, default=50, help="Сколько пользователей работают с ботом одновременно")
+parser.add_argument("--users", type=int, default=5000, help="Сколько разных пользователей пишут боту")
+parser.add_argument("--api-latency-ms", type=float, default=0, help="Задержка ответа фейкового Bot API")
+parser.add_argument("--mongo-url", help="Локальная mongoDB вместо mongomock. Тогда считаются и команды mongoDB")
+parser.add_argument("--mongo-latency-ms", type=float, default=0, help="Задержка каждой операции mongomock, чтобы изобразить медленную БД")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--json", help="Сохранить результат в файл, чтобы сравнивать прогоны")
+parser.add_argument("--max-p99-ms", type=float, help="Упасть, если p99 задержки обновления больше")
+parser.add_argument("--min-rps", type=float, help="Упасть, если обновлений в секунду меньше")
+
+# Доли сценариев в смешанной нагрузке: в основном пользователи листают подготовленные вопросы
+MIXES = {
+    "mixed": {"browse": 60, "ticket": 25, "reply": 10, "stats": 4, "mailing": 1},
+    "browse": {"browse": 1},
+    "ticket": {"ticket": 1},
+    "reply": {"ticket": 1, "reply": 1},
+    "stats": {"stats": 1},
+    "mailing": {"mailing": 1},
+}
+
+
+class Scenarios:
+    """Сценарии одного прогона. Каждый сценарий - это последовательность обновлений от одного пользователя или админа"""
+    def __init__(self, bench: BenchBot, rnd: random.Random):
+        self.bench = bench
+        self.updates = bench.updates
+        self.random = rnd
+        self.categories = [c for c in bench.app.catalog.categories if c.lower() != "другое"]
+        self.with_email: set[int] = set()
+        # id обращений идут подряд с 1, поэтому номер следующего неотвеченного обращения можно не спрашивать у БД
+        self.tickets = 0
+        self.answered = 0
+        # Админ делает что-то одно за раз, иначе текст ответа может попасть в рассылку, которую он начал в другом сценарии
+        self.admin_locks = {admin: asyncio.Lock() for admin in ADMINS}
+
+    async def browse(self, user: int):
+        """Пользователь открывает меню, выбирает категорию и нажимает на подготовленный вопрос"""
+        category = self.random.choice(self.categories)
+        await self.bench.feed(self.updates.message(user, "/start"))
+        await self.bench.feed(self.updates.message(user, category))
+        keyboard = self.bench.app.keyboards.get_keyboard_by_category(category)
+        question = self.random.choice(self.bench.app.catalog.get_questions_by_category(category))
+        await self.bench.feed(self.updates.callback(user, question.CallbackData, message_text=keyboard.Text if keyboard else category))
+
+    async def ticket(self, user: int):
+        """Пользователь пишет в поддержку: при первом обращении вводит почту, потом описывает проблему"""
+        await self.bench.feed(self.updates.message(user, "Другое"))
+        if user not in self.with_email:
+            await self.bench.feed(self.updates.message(user, f"user{user}@example.com"))
+            self.with_email.add(user)
+        await self.bench.feed(self.updates.message(user, f"Не получается оплатить подписку, номер заказа {self.random.randint(1, 10**6)}"))
+        self.tickets += 1
+
+    async def reply(self, admin: int):
+        """Админ открывает непрочитанные сообщения и отвечает реплаем на первое"""
+        await self.bench.feed(self.updates.message(admin, "Непрочитанные сообщения"))
+        if self.answered < self.tickets:
+            self.answered += 1
+            await self.bench.feed(self.updates.message(admin, "Проверьте, пожалуйста, еще раз", reply_to_text=f"#️⃣ id: {self.answered}"))
+
+    async def stats(self, admin: int):
+        await self.bench.feed(self.updates.message(admin, "Статистика"))
+
+    async def mailing(self, admin: int):
+        """Админ создает текстовую рассылку. Сама доставка измеряется в broadcast_429.py"""
+        text = "Новые профессии в подборке уже доступны!"
+        await self.bench.feed(self.updates.message(admin, "Сделать рассылку"))
+        await self.bench.feed(self.updates.message(admin, text))
+        await self.bench.feed(self.updates.callback(admin, "send_mailing", message_text=text))
+
+    async def run(self, name: str, worker: int, concurrency: int, users: int):
+        # Пользователи разбиты между воркерами, чтобы у одного пользователя обновления шли по порядку, как в Telegram
+        if name in ("browse", "ticket"):
+            user = USERS_FROM + worker + concurrency * self.random.randrange(max(1, users // concurrency))
+            await getattr(self, name)(user)
+        else:
+            admin = self.random.choice(ADMINS)
+            async with self.admin_locks[admin]:
+                await getattr(self, name)(admin)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    rnd = random.Random(args.seed)
+    mix = MIXES[args.mix]
+    plan = rnd.choices(list(mix), weights=list(mix.values()), k=args.scenarios)
+
+    telegram = await FakeTelegram(latency=args.api_latency_ms / 1000).start()
+    try:
+        async with BenchBot(telegram, args.mongo_url, mongo_latency=args.mongo_latency_ms / 1000) as bench:
+            scenarios = Scenarios(bench, rnd)
+            # Прогрев: у админов должно быть что открыть и на что ответить
+            for user in range(USERS_FROM, USERS_FROM + 20):
+                await scenarios.ticket(user)
+            bench.latencies.clear()
+            bench.errors.clear()
+
+            storage_before, api_before = harness.storage_calls(), harness.bot_api_calls()
+            commands_before = bench.mongo_commands()
+            queue = iter(plan)
+
+            async def worker(number: int):
+                for name in queue:
+                    await scenarios.run(name, number, args.concurrency, args.users)
+
+            started_at = time.perf_counter()
+            await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+            elapsed = time.perf_counter() - started_at
+            # Уведомления админам отправляются в фоне не чаще раза в секунду на админа. Ждем их, чтобы учесть в запросах к Bot API,
+            # но в пропускную способность бота это время не входит
+            await bench.app.admin_notifier.drain()
+            drain = time.perf_counter() - started_at - elapsed
+
+            updates = len(bench.latencies)
+            storage = harness.storage_calls() - storage_before
+            api = harness.bot_api_calls() - api_before
+            commands = bench.mongo_commands()
+            return {
+                "mix": args.mix,
+                "scenarios": args.scenarios,
+                "concurrency": args.concurrency,
+                "updates": updates,
+                "errors": dict(bench.errors),
+                "seconds": elapsed,
+                "rps": updates / elapsed,
+                "notify_drain_seconds": drain,
+                "latency": harness.percentiles(bench.latencies),
+                "storage_per_update": {method: count / updates for method, count in storage.most_common()},
+                "api_per_update": {method: count / updates for method, count in api.most_common()},
+                "mongo_commands_per_update": (commands - commands_before) / updates if commands is not None else None,
+            }
+    finally:
+        await telegram.close()
+
+
+def report(result: dict) -> None:
+    print(f"Сценарии: {result['mix']}, выполнено {result['scenarios']}, одновременно {result['concurrency']}")
+    print(f"Обновлений: {result['updates']} за {result['seconds']:.2f} с - {result['rps']:.0f} обновлений/с")
+    print(f"Задержка обработки, мс: {harness.format_ms(result['latency'])}")
+    print(f"Отправка уведомлений админам после обработки: {result['notify_drain_seconds']:.2f} с")
+    if result["errors"]:
+        print(f"Ошибки: {result['errors']}")
+    print(f"Вызовов Storage на обновление: {sum(result['storage_per_update'].values()):.2f}")
+    for method, count in result["storage_per_update"].items():
+        print(f"  {method}: {count:.2f}")
+    print(f"Запросов к Bot API на обновление: {sum(result['api_per_update'].values()):.2f}")
+    for method, count in result["api_per_update"].items():
+        print(f"  {method}: {count:.2f}")
+    if result["mongo_commands_per_update"] is not None:
+        print(f"Команд mongoDB на обновление: {result['mongo_commands_per_update']:.2f}")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.mix not in MIXES:
+        parser.error(f"Неизвестный набор сценариев {args.mix}. Есть: {', '.join(MIXES)}")
+
+    result = asyncio.run(run(args))
+    report(result)
+    if args.json:
+        with open(os.path.join(harness.CWD, args.json), mode="w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    failed = []
+    if args.max_p99_ms is not None and result["latency"]["p99"] * 1000 > args.max_p99_ms:
+        failed.append(f"p99 {result['latency']['p99'] * 1000:.1f} мс больше {args.max_p99_ms} мс")
+    if args.min_rps is not None and result["rps"] < args.min_rps:
+        failed.append(f"{result['rps']:.0f} обновлений/с меньше {args.min_rps}")
+    if failed or result["errors"]:
+        print("ПРОВАЛ: " + "; ".join(failed or ["ошибки при обработке обновлений"]))
+        raise SystemExit(1)
@@ -0,0 +1,90 @@
+"""
+Два процесса одного бота (--state mongo): у них общая БД и общее хранилище состояний FSM, а обновления одного пользователя
+попадают то в один процесс, то в другой. Проверяем, что ни один процесс не работает со старым профилем пользователя.\n
+Каждый пользователь по очереди в разных репликах: выбирает категорию, нажимает "другое" под ее вопросами, вводит почту
+и описывает проблему. Почту бот должен спросить один раз, а обращение должно сохраниться с почтой и выбранной категорией.
+Уведомление о каждом обращении должно дойти до каждого админа: скрипт ждет, пока очереди уведомлений обеих реплик опустеют
+(админу уходит не больше уведомления в секунду от каждой реплики, поэтому на 200 пользователей это около 100 секунд).
+Завершается с кодом 1, если хоть у одного пользователя это не так.\n
+Пример: python bench/replicas.py --users 200
+"""
+import argparse
+import asyncio
+from collections import Counter
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+from harness import ADMINS, USERS_FROM, BenchBot, FakeTelegram
+
+parser = argparse.ArgumentParser(description="Два процесса бота с общей БД и поочередной доставкой обновлений")
+parser.add_argument("--users", type=int, default=200, help="Сколько пользователей пишут в поддержку")
+parser.add_argument("--mongo-url", help="Локальная mongoDB вместо mongomock")
+
+EMAIL_PROMPT = "напишите, пожалуйста, почту"
+ALERT = "⚠️ Новый вопрос от" # Начало уведомления админам о новом обращении
+
+
+async def user_flow(replicas: tuple[BenchBot, BenchBot], user: int, category: str, other: str) -> None:
+    """Обновления пользователя уходят в реплики по очереди, как при балансировке без привязки к процессу"""
+    steps = [
+        lambda bench: bench.updates.message(user, category),
+        lambda bench: bench.updates.callback(user, other, message_text=category),
+        lambda bench: bench.updates.message(user, f"user{user}@example.com"),
+        lambda bench: bench.updates.message(user, f"Не приходит письмо с подтверждением, пользователь {user}"),
+    ]
+    for number, update in enumerate(steps):
+        bench = replicas[(user + number) % 2] # У половины пользователей первое обновление попадает во вторую реплику
+        await bench.feed(update(bench))
+
+
+async def main(args: argparse.Namespace) -> int:
+    telegram = await FakeTelegram().start()
+    fsm = MemoryStorage() # Общее хранилище состояний, как MongoStorage у процессов с --state mongo
+    prompts: Counter[int] = Counter()
+    alerts: Counter[int] = Counter()
+    try:
+        async with BenchBot(telegram, args.mongo_url, state="mongo", fsm_storage=fsm, user_limit=0, chat_limit=0) as first:
+            async with BenchBot(telegram, client=first.client, state="mongo", fsm_storage=fsm, user_limit=0, chat_limit=0) as second:
+                # Категория, под вопросами которой есть кнопка "другое"
+                category, other = next(
+                    (category, qst.CallbackData)
+                    for category in first.app.catalog.categories
+                    for qst in first.app.catalog.get_questions_by_category(category)
+                    if category.lower() != "другое" and qst.CallbackData.startswith("other_")
+                )
+                users = range(USERS_FROM, USERS_FROM + args.users)
+                await asyncio.gather(*(user_flow((first, second), user, category, other) for user in users))
+
+                await asyncio.gather(first.app.admin_notifier.drain(), second.app.admin_notifier.drain())
+                prompts.update(chat_id for chat_id, text in telegram.texts if EMAIL_PROMPT in text)
+                alerts.update(chat_id for chat_id, text in telegram.texts if chat_id in ADMINS and text.startswith(ALERT))
+                tickets = {doc["user_id"]: doc for doc in first.app.storage.sync.questions_cl.find({"user_id": {"$gte": USERS_FROM}})}
+                errors = dict(first.errors + second.errors)
+    finally:
+        await telegram.close()
+
+    problems = []
+    asked_twice = [user for user, count in prompts.items() if count > 1]
+    if asked_twice:
+        problems.append(f"почту спросили повторно у {len(asked_twice)} пользователей, например у {asked_twice[0]}")
+    missing = [user for user in users if user not in tickets]
+    if missing:
+        problems.append(f"нет обращения у {len(missing)} пользователей, например у {missing[0]}")
+    wrong = [user for user, doc in tickets.items() if doc["email"] != f"user{user}@example.com" or doc["category"] != category.lower()]
+    if wrong:
+        problems.append(f"у {len(wrong)} обращений неверная почта или категория, например {tickets[wrong[0]]['category']!r}")
+    short = {admin: alerts[admin] for admin in ADMINS if alerts[admin] != len(tickets)}
+    if short:
+        problems.append(f"уведомлений о новых обращениях у админов {short} вместо {len(tickets)}")
+    if errors:
+        problems.append(f"ошибки при обработке обновлений: {errors}")
+
+    print(f"Пользователей: {args.users}, обращений: {len(tickets)}, просьб ввести почту: {sum(prompts.values())}, "
+          f"уведомлений админам: {sum(alerts.values())}")
+    for problem in problems:
+        print(f"ПРОВАЛ: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,81 @@
+"""
+Медленная mongoDB: часть пользователей выбирает категории (каждое такое сообщение - запросы в БД),
+а остальные в это время пишут /start, который в БД не ходит. Каждая операция mongomock отвечает с задержкой --latency-ms.\n
+Прогон делается дважды: с AsyncStorage, как в боте (запросы в пуле потоков), и с блокирующими вызовами
+прямо в event loop, как было до AsyncStorage. Печатает задержку /start у "других" чатов для каждой задержки БД.
+С AsyncStorage она не должна зависеть от задержки БД.\n
+Пример: python bench/slow_mongo.py --latency-ms 0 10 50 --max-p99-ms 50
+"""
+import argparse
+import asyncio
+import itertools
+from concurrent.futures import Executor, Future
+
+import harness
+from harness import USERS_FROM, BenchBot, FakeTelegram
+
+parser = argparse.ArgumentParser(description="Задержка обработки у чатов, которые не ходят в БД, при медленной mongoDB")
+parser.add_argument("--latency-ms", type=float, nargs="+", default=(0, 10, 50), help="Задержки каждой операции mongoDB")
+parser.add_argument("--heavy", type=int, default=20, help="Сколько пользователей одновременно выбирают категории")
+parser.add_argument("--light", type=int, default=20, help="Сколько других пользователей одновременно пишут /start")
+parser.add_argument("--messages", type=int, default=20, help="Сколько сообщений отправляет каждый пользователь")
+parser.add_argument("--max-p99-ms", type=float, help="Упасть, если p99 других чатов с AsyncStorage больше")
+
+
+class InlineExecutor(Executor):
+    """Executor, который выполняет функцию сразу в вызывающем потоке. С ним AsyncStorage блокирует event loop, как обычный Storage"""
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as err:
+            future.set_exception(err)
+        return future
+
+
+async def run(args: argparse.Namespace, latency: float, blocking: bool) -> list[float]:
+    """Вернет задержки обработки /start"""
+    telegram = await FakeTelegram().start()
+    try:
+        async with BenchBot(telegram, mongo_latency=latency, user_limit=0, chat_limit=0,
+                            executor=InlineExecutor() if blocking else None) as bench:
+            categories = itertools.cycle([c for c in bench.app.catalog.categories if c.lower() != "другое"])
+            light: list[float] = []
+
+            async def heavy_user(user: int):
+                for _ in range(args.messages):
+                    await bench.feed(bench.updates.message(user, next(categories)))
+
+            async def light_user(user: int):
+                for _ in range(args.messages):
+                    light.append(await bench.feed(bench.updates.message(user, "/start")))
+                    await asyncio.sleep(0.005) # Живой пользователь не пишет непрерывно
+
+            await asyncio.gather(
+                *(heavy_user(USERS_FROM + i) for i in range(args.heavy)),
+                *(light_user(USERS_FROM + args.heavy + i) for i in range(args.light)),
+            )
+            if bench.errors:
+                raise SystemExit(f"Ошибки при обработке обновлений: {dict(bench.errors)}")
+            return light
+    finally:
+        await telegram.close()
+
+
+async def main(args: argparse.Namespace) -> int:
+    worst = 0.0
+    for latency_ms in args.latency_ms:
+        for blocking in (False, True):
+            stats = harness.percentiles(await run(args, latency_ms / 1000, blocking))
+            name = "блокирующий Storage" if blocking else "AsyncStorage"
+            print(f"БД {latency_ms:g} мс, {name}: /start других чатов, мс: {harness.format_ms(stats)}")
+            if not blocking:
+                worst = max(worst, stats["p99"])
+    if args.max_p99_ms is not None and worst * 1000 > args.max_p99_ms:
+        print(f"ПРОВАЛ: p99 других чатов с AsyncStorage {worst * 1000:.1f} мс больше {args.max_p99_ms} мс")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,107 @@
+"""
+Оценка подсказок готовых ответов (src/suggest.py) на закрытых обращениях из БД бота.\n
+Для каждого порога печатает:
+- покрытие - для какой доли обращений бот предложил бы готовый ответ вместо создания обращения;
+- попадания - в какой доле предложений готовый ответ совпал с тем, что на самом деле ответил админ.
+  Совпадением считаем, что из всех готовых ответов ответ админа больше всего похож именно на предложенный (и похож хоть немного);
+- время оценки одного вопроса.\n
+С --examples вместо истории обращений берутся размеченные вопросы (bench/suggest_examples.json): для каждого известно,
+какой подготовленный вопрос (callback_data) нужно предложить, или null, если подходящего нет. Подготовленные вопросы
+берутся из data/questions.json. Для каждого порога печатаются верные подсказки, неверные (в том числе там, где подсказки
+быть не должно) и пропуски, а для текущего SUGGEST_THRESHOLD - сами неверные подсказки.\n
+Пример: python bench/suggest_eval.py --mongo-url mongodb://localhost:27017/ -b edwica
+Пример: python bench/suggest_eval.py --examples bench/suggest_examples.json
+"""
+import argparse
+import json
+import os
+import time
+
+import harness
+import tools
+from db import DEFAULT_PATH_FOR_PREPARED_QUESTIONS, Storage
+from models import PreparedQuestion
+from suggest import MIN_CONTENT_SHARE, SUGGEST_THRESHOLD, AnswerSuggester
+
+parser = argparse.ArgumentParser(description="Покрытие и точность подсказок готовых ответов на истории обращений")
+parser.add_argument("--mongo-url", default="mongodb://localhost:27017/", help="mongoDB с БД бота")
+parser.add_argument("-b", "--bot", help="Название бота из config.json")
+parser.add_argument("--examples", help="Размеченные вопросы вместо истории обращений, например bench/suggest_examples.json")
+parser.add_argument("--limit", type=int, default=10_000, help="Сколько последних закрытых обращений взять")
+parser.add_argument("--thresholds", type=float, nargs="+", default=(0.3, 0.4, 0.45, SUGGEST_THRESHOLD, 0.55, 0.6, 0.7))
+parser.add_argument("--min-content-share", type=float, default=MIN_CONTENT_SHARE,
+                    help="Доля значимых n-грамм вопроса, которые должны найтись в подготовленном (0 - не проверять)")
+parser.add_argument("--min-answer-similarity", type=float, default=0.2,
+                    help="Насколько ответ админа должен быть похож на готовый ответ, чтобы засчитать попадание")
+
+
+def evaluate_examples(args: argparse.Namespace):
+    with open(os.path.join(harness.CWD, args.examples), mode="r", encoding="utf-8") as f:
+        examples = json.load(f)
+    with open(DEFAULT_PATH_FOR_PREPARED_QUESTIONS, mode="r", encoding="utf-8") as f:
+        questions = [PreparedQuestion(Text=i["question"], Answer=i["answer"], Category=i["category"], CallbackData=i["callback_data"])
+                     for i in json.load(f)]
+    suggester = AnswerSuggester(questions, min_content_share=args.min_content_share)
+
+    results = [] # (оценка, предложенный callback_data, ожидаемый callback_data или None, вопрос)
+    for example in examples:
+        scores = suggester.scores(example["question"])
+        best = int(scores.argmax())
+        results.append((float(scores[best]), suggester.questions[best].CallbackData, example["expected"], example["question"]))
+
+    expected = sum(item[2] is not None for item in results)
+    print(f"Вопросов: {len(results)}, из них с подходящим готовым ответом: {expected}")
+    for threshold in sorted(set(args.thresholds)):
+        offered = [item for item in results if item[0] >= threshold]
+        right = sum(suggested == wanted for _, suggested, wanted, _ in offered)
+        print(f"порог {threshold:.2f}: верных {right:3} из {expected}, неверных {len(offered) - right:3}, пропусков {expected - right:3}")
+    for score, suggested, wanted, question in results:
+        if score >= SUGGEST_THRESHOLD and suggested != wanted:
+            print(f"Неверная подсказка при пороге {SUGGEST_THRESHOLD}: {question!r} -> {suggested} ({score:.2f}), нужно {wanted}")
+
+
+def main(args: argparse.Namespace):
+    if args.examples:
+        return evaluate_examples(args)
+    if not args.bot:
+        parser.error("Нужен --bot или --examples")
+    configs = [config for config in tools.load_config() if config.BotName == args.bot]
+    if not configs:
+        parser.error(f"В config.json нет бота {args.bot}")
+    storage = Storage(connect_url=args.mongo_url, db_name=configs[0].MongodbName)
+    history = list(
+        storage.questions_cl.find({"closed": True, "answer": {"$ne": None}}, {"_id": 0, "question": 1, "answer": 1})
+        .sort("id", -1)
+        .limit(args.limit)
+    )
+    questions = storage.get_questions()
+    storage.client.close()
+    if not history:
+        raise SystemExit("Нет закрытых обращений")
+
+    suggester = AnswerSuggester(questions, min_content_share=args.min_content_share)
+    # Тот же поиск, только по текстам готовых ответов: на какой из них больше всего похож ответ админа
+    answers = AnswerSuggester([qst._replace(Text=qst.Answer) for qst in suggester.questions])
+
+    best, agrees, seconds = [], [], []
+    for item in history:
+        started_at = time.perf_counter()
+        scores = suggester.scores(item["question"])
+        seconds.append(time.perf_counter() - started_at)
+        suggested = int(scores.argmax())
+        best.append(float(scores[suggested]))
+
+        answer_scores = answers.scores(item["answer"])
+        agrees.append(int(answer_scores.argmax()) == suggested and answer_scores[suggested] >= args.min_answer_similarity)
+
+    print(f"Обращений: {len(history)}, готовых ответов: {len(suggester.questions)}")
+    for threshold in sorted(args.thresholds):
+        offered = [agree for score, agree in zip(best, agrees) if score >= threshold]
+        hits = sum(offered)
+        print(f"порог {threshold:.2f}: покрытие {len(offered) / len(history):6.1%}, "
+              f"попаданий {hits / max(1, len(offered)):6.1%} ({hits} из {len(offered)})")
+    print(f"Время оценки вопроса, мс: {harness.format_ms(harness.percentiles(seconds))}")
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -0,0 +1,117 @@
+"""
+Нагрузочный тест webhook-режима: WebhookServer из webhook.py принимает обновления по HTTP, как от Telegram,
+а бот обрабатывает их с FakeTelegram и mongomock (или локальной mongoDB).\n
+Печатает задержку приема обновления, сколько обновлений получили 503 из-за переполненной очереди
+и сколько времени занял плавный останов (дообработка очереди).
+Завершается с кодом 1, если бот обработал не все принятые (200) обновления или какое-то из них закончилось ошибкой.\n
+Пример: python bench/webhook_load.py --updates 5000 --concurrency 200 --queue-size 500
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+
+import aiohttp
+
+import harness
+from harness import USERS_FROM, BenchBot, FakeTelegram
+from webhook import WebhookServer
+
+parser = argparse.ArgumentParser(description="Нагрузочный тест webhook-сервера")
+parser.add_argument("--updates", type=int, default=2000, help="Сколько обновлений отправить")
+parser.add_argument("--concurrency", type=int, default=100, help="Сколько запросов Telegram держит одновременно")
+parser.add_argument("--queue-size", type=int, default=1000, help="Размер очереди обновлений бота")
+parser.add_argument("--workers", type=int, default=8, help="Сколько воркеров обрабатывают очередь")
+parser.add_argument("--put-timeout", type=float, default=5, help="Сколько ждать места в очереди, прежде чем ответить 503")
+parser.add_argument("--port", type=int, default=8181)
+parser.add_argument("--api-latency-ms", type=float, default=20, help="Задержка ответа фейкового Bot API")
+parser.add_argument("--mongo-url", help="Локальная mongoDB вместо mongomock")
+parser.add_argument("--mongo-latency-ms", type=float, default=0, help="Задержка каждой операции mongomock, чтобы изобразить медленную БД")
+parser.add_argument("--seed", type=int, default=0)
+
+SECRET = "bench-secret"
+
+
+async def wait_for_port(host: str, port: int, timeout: float = 10) -> None:
+    """Ждем, пока webhook-сервер начнет принимать соединения"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+async def run(args: argparse.Namespace) -> int:
+    rnd = random.Random(args.seed)
+    telegram = await FakeTelegram(latency=args.api_latency_ms / 1000).start()
+    try:
+        async with BenchBot(telegram, args.mongo_url, mongo_latency=args.mongo_latency_ms / 1000) as bench:
+            server = WebhookServer([bench.app], base_url=f"http://127.0.0.1:{args.port}", host="127.0.0.1", port=args.port,
+                                   queue_size=args.queue_size, workers=args.workers, put_timeout=args.put_timeout, secret=SECRET)
+            task = asyncio.create_task(server.run())
+            await wait_for_port("127.0.0.1", args.port)
+            await asyncio.sleep(0.1) # set_webhook вызывается уже после старта сайта
+
+            # Пользователи листают категории: это самый частый тип обновлений
+            categories = bench.app.catalog.categories
+            updates = [
+                bench.updates.message(USERS_FROM + rnd.randrange(args.updates), rnd.choice(categories))
+                for _ in range(args.updates)
+            ]
+            url = f"http://127.0.0.1:{args.port}/webhook/{harness.BOT_NAME}"
+            headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+            statuses: Counter[int] = Counter()
+            latencies: list[float] = []
+            handled_before, errors_before = harness.handled_updates(), harness.handler_errors()
+            pending = iter(updates)
+
+            async def client(session: aiohttp.ClientSession):
+                for update in pending:
+                    started_at = time.perf_counter()
+                    async with session.post(url, json=update, headers=headers) as response:
+                        statuses[response.status] += 1
+                    latencies.append(time.perf_counter() - started_at)
+
+            started_at = time.perf_counter()
+            async with aiohttp.ClientSession() as session:
+                await asyncio.gather(*(client(session) for _ in range(args.concurrency)))
+            accepted_in = time.perf_counter() - started_at
+
+            # Останавливаем сервер: он дообрабатывает очередь и только потом завершается
+            stop_at = time.perf_counter()
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            drained_in = time.perf_counter() - stop_at
+            handled = harness.handled_updates() - handled_before
+            errors = harness.handler_errors() - errors_before
+    finally:
+        await telegram.close()
+
+    print(f"Отправлено обновлений: {args.updates}, одновременно: {args.concurrency}")
+    print(f"Ответы сервера: {dict(statuses)}")
+    print(f"Прием: {accepted_in:.2f} с - {args.updates / accepted_in:.0f} обновлений/с")
+    print(f"Задержка приема, мс: {harness.format_ms(harness.percentiles(latencies))}")
+    print(f"Дообработка очереди при остановке: {drained_in:.2f} с")
+    print(f"Обработано обновлений: {handled:.0f}, с ошибкой: {errors:.0f}; запросов к Bot API: {sum(telegram.calls.values())}")
+
+    failed = []
+    if handled < statuses[200]:
+        failed.append(f"обработано {handled:.0f} из {statuses[200]} принятых обновлений")
+    if errors:
+        failed.append(f"{errors:.0f} обновлений закончились ошибкой")
+    if failed:
+        print("ПРОВАЛ: " + "; ".join(failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(run(parser.parse_args())))
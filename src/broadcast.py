@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterable, Awaitable, Callable, Iterable
+
+from aiogram.utils.exceptions import RetryAfter, NetworkError, TelegramAPIError
+
+from metrics import ADMIN_NOTIFICATIONS
+from models import BroadcastResult
+
+log = logging.getLogger(__name__)
+
+# Лимиты Telegram Bot API: не больше ~30 сообщений в секунду на бота и не чаще 1 сообщения в секунду в один чат
+GLOBAL_RATE = 25
+PER_CHAT_INTERVAL = 1.0
+# Сколько уведомлений админам может ждать отправки. Админу уходит не больше уведомления в секунду, так что это около 15 минут
+# непрерывного потока новых вопросов: обычный всплеск обращений помещается целиком, а переполняет очередь только настоящий флуд
+NOTIFY_QUEUE_SIZE = 1000
+
+
+class TokenBucket:
+    """
+    Ограничитель скорости "ведро с токенами": в среднем rate запросов в секунду, но не больше capacity подряд.
+    За любую секунду ведро пропускает до capacity + rate запросов, поэтому по умолчанию capacity = 1:
+    запросы идут ровно через 1 / rate секунд, и лимит Telegram не превышается даже после простоя.\n
+    Если Telegram ответил RetryAfter, то ведро ставится на паузу для всех, кто им пользуется
+    """
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Ждем, пока в ведре появится токен, и забираем его"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def refund(self) -> None:
+        """Возвращаем токен, который взяли, но не потратили"""
+        self._tokens = min(self.capacity, self._tokens + 1)
+
+    def pause(self, seconds: float) -> None:
+        """Останавливаем выдачу токенов на seconds секунд"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+class Broadcaster:
+    """
+    Движок рассылок.\n
+    Сообщения отправляются параллельно (не больше concurrency одновременно), общая скорость ограничена TokenBucket,
+    а в один чат пишем не чаще раза в per_chat_interval секунд.
+    На RetryAfter ждем сколько просит Telegram, на сетевых ошибках повторяем с экспоненциальной задержкой.
+    Ошибка одного получателя (заблокировал бота, удалил аккаунт) не останавливает рассылку остальным
+    """
+    def __init__(self, rate: float = GLOBAL_RATE, concurrency: int = 20, max_retries: int = 3,
+                 per_chat_interval: float = PER_CHAT_INTERVAL, backoff: float = 0.5):
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.per_chat_interval = per_chat_interval
+        self.backoff = backoff
+        self._chat_sent_at: dict[int, float] = {}
+
+    async def _acquire(self, chat_id: int) -> None:
+        """
+        Ждем общий токен и паузу между сообщениями в один и тот же чат.\n
+        Время отправки в чат резервируется сразу после получения токена, без await между проверкой и записью,
+        поэтому два воркера с сообщениями в один чат не отправят их одновременно. Если резервировать время до ожидания
+        токена, очередь за токеном сдвигает первое сообщение, а второе уходит вслед за ним раньше паузы.
+        Если чату еще рано, токен возвращаем, чтобы он достался сообщению в другой чат
+        """
+        while True:
+            await self.bucket.acquire()
+            now = time.monotonic()
+            last = self._chat_sent_at.get(chat_id)
+            if last is None or now - last >= self.per_chat_interval:
+                self._chat_sent_at[chat_id] = now
+                break
+            self.bucket.refund()
+            await asyncio.sleep(last + self.per_chat_interval - now)
+
+        # Чистим старые записи, чтобы словарь не рос бесконечно
+        if len(self._chat_sent_at) > 10_000:
+            border = now - self.per_chat_interval
+            self._chat_sent_at = {chat: sent for chat, sent in self._chat_sent_at.items() if sent > border}
+
+    async def send(self, chat_id: int, send: Callable[[int], Awaitable], result: BroadcastResult) -> bool:
+        """Отправляем одно сообщение с повторами. Вернет True, если сообщение доставлено"""
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id)
+            try:
+                await send(chat_id)
+                result.Delivered += 1
+                return True
+            except RetryAfter as err:
+                self.bucket.pause(err.timeout)
+                error = err
+            except (NetworkError, asyncio.TimeoutError) as err:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+                error = err
+            except TelegramAPIError as err:
+                # Пользователь заблокировал бота, удалил аккаунт и т.п. - повторять бессмысленно
+                error = err
+                break
+            result.Retries += 1
+
+        result.Failed += 1
+        result.Errors[chat_id] = type(error).__name__
+        log.info("Сообщение для %s не доставлено: %s", chat_id, error)
+        return False
+
+    async def broadcast(self, recipients: Iterable[int] | AsyncIterable[int], send: Callable[[int], Awaitable],
+                        on_result: Callable[[int, bool], Awaitable] | None = None) -> BroadcastResult:
+        """
+        Рассылаем сообщение всем recipients. send(chat_id) - корутина, которая отправляет сообщение одному получателю.\n
+        on_result(chat_id, delivered) вызывается после каждого получателя - например, чтобы сохранить прогресс рассылки
+        """
+        result = BroadcastResult()
+        queue: asyncio.Queue[int | None] = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while (chat_id := await queue.get()) is not None:
+                try:
+                    delivered = await self.send(chat_id, send, result)
+                    if on_result:
+                        await on_result(chat_id, delivered)
+                except Exception:
+                    # Любая неожиданная ошибка не должна останавливать рассылку остальным
+                    log.exception("Ошибка при рассылке пользователю %s", chat_id)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            if isinstance(recipients, AsyncIterable):
+                async for chat_id in recipients:
+                    await queue.put(chat_id)
+            else:
+                for chat_id in recipients:
+                    await queue.put(chat_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+        return result
+
+
+class AdminNotifier:
+    """
+    Уведомления админам (новый вопрос, ответ другого админа) в фоне, чтобы хендлер не ждал Telegram.\n
+    Уведомления стоят в одной очереди на maxsize штук, и один воркер отправляет их по очереди: каждое - всем админам сразу,
+    через Broadcaster, поэтому ошибка одного админа не мешает остальным. Админу нельзя писать чаще раза в секунду,
+    так что больше уведомления в секунду не уйдет, а всплеск обращений ждет в очереди (см. NOTIFY_QUEUE_SIZE).
+    Только если очередь переполнена (флуд обращений), новые уведомления отбрасываются и заменяются одним сообщением
+    с их количеством. Вопросы при этом не теряются, они есть в непрочитанных сообщениях
+    """
+    def __init__(self, bot_name: str, admins: Iterable[int], send: Callable[[int, str], Awaitable],
+                 broadcaster: Broadcaster, maxsize: int = NOTIFY_QUEUE_SIZE):
+        self.bot_name = bot_name
+        self.admins = admins
+        self.send = send
+        self.broadcaster = broadcaster
+        self.queue: asyncio.Queue[tuple[str, int]] = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0 # Отброшено с момента последнего сообщения о пропущенных уведомлениях
+        self._worker: asyncio.Task | None = None
+
+    def notify(self, text: str, ignore_id: int = 0) -> bool:
+        """Ставим уведомление всем админам, кроме ignore_id, в очередь. Вернет False, если очередь заполнена и уведомление отброшено"""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self.run())
+        try:
+            self.queue.put_nowait((text, ignore_id))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            ADMIN_NOTIFICATIONS.labels(self.bot_name, "dropped").inc()
+            if self.dropped == 1:
+                log.warning("Очередь уведомлений админам бота %s переполнена, новые уведомления отбрасываются", self.bot_name)
+            return False
+        ADMIN_NOTIFICATIONS.labels(self.bot_name, "queued").inc()
+        return True
+
+    async def run(self):
+        while True:
+            text, ignore_id = await self.queue.get()
+            try:
+                await self._send_all(text, ignore_id)
+                if self.dropped and self.queue.empty():
+                    dropped, self.dropped = self.dropped, 0
+                    await self._send_all(f"⚠️ Пропущено уведомлений: {dropped} - их было слишком много за короткое время. "
+                                         f"Все новые вопросы есть в непрочитанных сообщениях")
+            except Exception:
+                log.exception("Ошибка при отправке уведомления админам")
+            finally:
+                self.queue.task_done()
+
+    async def _send_all(self, text: str, ignore_id: int = 0) -> None:
+        result = BroadcastResult()
+        await asyncio.gather(*(
+            self.broadcaster.send(admin, lambda chat_id: self.send(chat_id, text), result)
+            for admin in self.admins if admin != ignore_id
+        ))
+
+    async def drain(self, timeout: float | None = None) -> bool:
+        """Ждем, пока очередь опустеет, но не дольше timeout секунд. Вернет False, если не дождались"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self, timeout: float) -> None:
+        """Даем очереди дослаться за timeout секунд и останавливаем воркер"""
+        if not await self.drain(timeout):
+            log.warning("Бот %s остановлен, не отправив админам %s уведомлений", self.bot_name, self.queue.qsize())
+        if self._worker:
+            self._worker.cancel()
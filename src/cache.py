@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Hashable, TYPE_CHECKING
+
+from pymongo.errors import PyMongoError
+
+from models import CacheStats
+
+if TYPE_CHECKING: # db сам использует LRUCache, поэтому импортируем Storage только для аннотаций
+    from db import Storage, AsyncStorage
+
+log = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    Кэш фиксированного размера: когда в нем больше maxsize записей, удаляется та, к которой дольше всего не обращались.
+    Если задан ttl, то запись живет не больше ttl секунд с момента записи.
+    Нужен, чтобы кэши пользователей не росли бесконечно на долгоживущем боте.\n
+    Счетчики попаданий, промахов и вытеснений доступны через stats().
+    Storage вызывается из пула потоков AsyncStorage, поэтому все операции защищены блокировкой
+    """
+    def __init__(self, maxsize: int = 10_000, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict() # ключ -> (значение, когда протухнет)
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._evictions = self._expired = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[1] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._misses += 1
+                return default
+            if item[1] <= time.monotonic():
+                del self._data[key]
+                self._expired += 1
+                self._misses += 1
+                return default
+            self._data.move_to_end(key)
+            self._hits += 1
+            return item[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, now + self.ttl if self.ttl else float("inf"))
+            self._data.move_to_end(key)
+            # Сначала выкидываем протухшие записи из начала очереди, потом - самые старые, если кэш переполнен
+            while self._data:
+                oldest, (_, expires_at) = next(iter(self._data.items()))
+                if expires_at <= now:
+                    del self._data[oldest]
+                    self._expired += 1
+                elif len(self._data) > self.maxsize:
+                    del self._data[oldest]
+                    self._evictions += 1
+                else:
+                    break
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None or item[1] <= time.monotonic():
+                return default
+            return item[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> CacheStats:
+        """Счетчики кэша с момента запуска"""
+        return CacheStats(Hits=self._hits, Misses=self._misses, Evictions=self._evictions, Expired=self._expired, Size=len(self._data))
+
+
+class AdminRegistry:
+    """
+    Кэш списка администраторов.\n
+    Раньше на каждое сообщение делался distinct по коллекции support_admins.admins,
+    теперь проверка "это админ?" - это обычный поиск по frozenset за O(1).\n
+    Список перечитывается из БД раз в ttl секунд фоновой задачей watch().
+    Один реестр создается на процесс и может использоваться всеми ботами этого процесса, т.к. БД админов общая.
+    """
+    def __init__(self, storage: "Storage", ttl: float = 60):
+        self.storage = storage
+        self.ttl = ttl
+        self._admins: frozenset[int] = frozenset()
+        self.refresh()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._admins
+
+    def __iter__(self):
+        return iter(self._admins)
+
+    def __len__(self) -> int:
+        return len(self._admins)
+
+    @property
+    def admins(self) -> frozenset[int]:
+        return self._admins
+
+    def refresh(self) -> frozenset[int]:
+        """Перечитываем список активных админов из БД"""
+        self._admins = frozenset(self.storage.get_admins())
+        return self._admins
+
+    async def watch(self):
+        """
+        Фоновая задача, которая следит за изменениями в коллекции админов.
+        Если БД недоступна, то продолжаем работать со старым списком админов
+        """
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except PyMongoError as err:
+                log.warning("Не удалось обновить список админов: %s", err)
+
+
+class UserCache(ABC):
+    """
+    Общий интерфейс кэша с данными пользователей (временное сообщение и т.п.).\n
+    У каждой записи есть срок жизни ttl, после которого она считается удаленной.
+    MemoryUserCache хранит данные в памяти процесса, MongoUserCache - в mongoDB,
+    и тогда несколько процессов одного бота видят одни и те же данные.
+    Реализацию без какого-то из методов нельзя создать: ошибка будет сразу, а не при первом вызове
+    """
+    def __init__(self, name: str, ttl: float):
+        self.name = name
+        self.ttl = ttl
+
+    @abstractmethod
+    async def get(self, user_id: int, default: Any = None) -> Any:
+        """Значение для пользователя или default, если его нет или срок жизни истек"""
+
+    @abstractmethod
+    async def set(self, user_id: int, value: Any) -> None:
+        """Сохраняем значение для пользователя на ttl секунд"""
+
+    @abstractmethod
+    async def pop(self, user_id: int, default: Any = None) -> Any:
+        """Удаляем значение пользователя и возвращаем его (или default)"""
+
+
+class MemoryUserCache(UserCache):
+    """Кэш пользователей в памяти процесса. Не больше maxsize записей, лишние и просроченные вытесняются"""
+    def __init__(self, name: str, ttl: float, maxsize: int = 10_000):
+        super().__init__(name, ttl)
+        self._data = LRUCache(maxsize, ttl)
+
+    async def get(self, user_id: int, default: Any = None) -> Any:
+        return self._data.get(user_id, default)
+
+    async def set(self, user_id: int, value: Any) -> None:
+        self._data.set(user_id, value)
+
+    async def pop(self, user_id: int, default: Any = None) -> Any:
+        return self._data.pop(user_id, default)
+
+    def stats(self) -> CacheStats:
+        return self._data.stats()
+
+
+class MongoUserCache(UserCache):
+    """Кэш пользователей в коллекции user_cache. Просроченные записи mongoDB удаляет сама по TTL-индексу"""
+    def __init__(self, name: str, ttl: float, storage: "AsyncStorage"):
+        super().__init__(name, ttl)
+        self.storage = storage
+
+    async def get(self, user_id: int, default: Any = None) -> Any:
+        value = await self.storage.get_cache_value(self.name, user_id)
+        return default if value is None else value
+
+    async def set(self, user_id: int, value: Any) -> None:
+        await self.storage.set_cache_value(self.name, user_id, value, self.ttl)
+
+    async def pop(self, user_id: int, default: Any = None) -> Any:
+        value = await self.storage.pop_cache_value(self.name, user_id)
+        return default if value is None else value
@@ -0,0 +1,76 @@
+from typing import NamedTuple
+
+from db import Storage
+from models import PreparedQuestion
+from suggest import AnswerSuggester
+
+
+class CatalogSnapshot(NamedTuple):
+    """Одна версия каталога целиком. Ее никто не меняет: reload собирает новую и подменяет ссылку на нее"""
+
+    Version: int
+    Categories: list[str]
+    ByCategory: dict[str, list[PreparedQuestion]]
+    ByCallback: dict[str, PreparedQuestion]
+    Suggester: AnswerSuggester
+
+
+class PreparedCatalog:
+    """
+    Каталог подготовленных вопросов, который строится один раз при запуске бота из коллекции questions
+    (или из data/questions.json, если коллекция пустая).\n
+    Поиск категории и ответа по callback_data - это обычный поиск по словарю, поэтому пользовательские сценарии вообще не ходят в БД.\n
+    Если подготовленные вопросы поменялись, достаточно вызвать reload(). При каждой перезагрузке увеличивается version,
+    по которой можно понять, что закэшированные данные (например, клавиатуры) устарели.\n
+    Вместе с каталогом пересобирается AnswerSuggester, который подбирает готовый ответ на вопрос, написанный своими словами.\n
+    Все данные каталога лежат в одном CatalogSnapshot. reload выполняется в отдельном потоке, а хендлеры в event loop
+    читают snapshot один раз за вызов, поэтому всегда видят либо старую версию, либо новую, но не их смесь
+    """
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self.snapshot = CatalogSnapshot(Version=0, Categories=[], ByCategory={}, ByCallback={}, Suggester=AnswerSuggester([]))
+        self.reload()
+
+    @property
+    def version(self) -> int:
+        return self.snapshot.Version
+
+    @property
+    def categories(self) -> list[str]:
+        return self.snapshot.Categories
+
+    def reload(self) -> None:
+        """Перечитываем подготовленные вопросы из БД и собираем новый snapshot"""
+
+        questions = self.storage.get_questions()
+        by_category: dict[str, list[PreparedQuestion]] = {}
+        by_callback: dict[str, PreparedQuestion] = {}
+        for qst in questions:
+            category = qst.Category.lower()
+            by_category.setdefault(category, []).append(qst._replace(Category=category))
+            by_callback[qst.CallbackData] = qst
+
+        # Подменяем одну ссылку: присваивание атомарно, и хендлеры никогда не видят наполовину собранный каталог
+        self.snapshot = CatalogSnapshot(
+            Version=self.snapshot.Version + 1,
+            Categories=self.storage.get_categories(),
+            ByCategory=by_category,
+            ByCallback=by_callback,
+            Suggester=AnswerSuggester(questions),
+        )
+
+    def is_category(self, text: str) -> bool:
+        """Проверяем, является ли текст названием категории (без учета регистра)"""
+        return text.lower() in self.snapshot.ByCategory
+
+    def get_questions_by_category(self, category: str) -> list[PreparedQuestion]:
+        """Вернет все вопросы категории {category} или пустой список, если такой категории нет"""
+        return self.snapshot.ByCategory.get(category.lower(), [])
+
+    def get_question_by_callback(self, callback_data: str) -> PreparedQuestion | None:
+        """Вернет подготовленный вопрос по callback_data кнопки"""
+        return self.snapshot.ByCallback.get(callback_data)
+
+    def suggest(self, text: str) -> tuple[PreparedQuestion, float] | None:
+        """Подготовленный вопрос, похожий на text, и оценка похожести или None, если похожих нет"""
+        return self.snapshot.Suggester.suggest(text)
@@ -0,0 +1,20 @@
+import sys
+from db import Storage
+from tools import load_config
+
+
+def check_indexes() -> int:
+    """Проверяем, что ни один запрос Storage не делает COLLSCAN ни в одной БД ботов. Вернет количество найденных проблем"""
+    problems = 0
+    for config in load_config():
+        storage = Storage(db_name=config.MongodbName)
+        for collection, filter, distinct_key, sort in storage.find_collscans():
+            query = f"distinct({distinct_key!r}, {filter})" if distinct_key else f"find({filter}).sort({sort})"
+            print(f"[{config.BotName}] COLLSCAN: {collection}.{query}")
+            problems += 1
+        storage.client.close()
+    return problems
+
+
+if __name__ == "__main__":
+    sys.exit(1 if check_indexes() else 0)
@@ -1,10 +1,99 @@
 import pymongo
+from bson import ObjectId
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from typing import Callable, Iterable, Iterator
+import asyncio
+import time
+from datetime import datetime, timedelta
 import json
+import logging
 import re
-from models import PreparedQuestion, Question, Answer, Statistic, AdminStat, CategoryStat, Mailing
+from models import PreparedQuestion, Question, Answer, Statistic, AdminStat, CategoryStat, Mailing, MailingJob, User, InboxPage, SearchHit, SearchPage
+from cache import LRUCache
 
 DEFAULT_PATH_FOR_PREPARED_QUESTIONS = "data/questions.json"
+_MISSING = object() # Маркер отсутствия записи в кэше
+
+log = logging.getLogger(__name__)
+
+# Индексы, которые нужны запросам Storage. Ключ - имя атрибута коллекции в Storage, значение - список (ключи индекса, опции).
+# Уникальный индекс по id не делаем: в старых БД могут быть дубли id, оставшиеся от прежнего AUTOINCREMENT
+INDEXES: dict[str, list[tuple[list[tuple[str, int]], dict]]] = {
+    "questions_cl": [
+        ([("id", pymongo.ASCENDING)], {}),
+        ([("closed", pymongo.ASCENDING), ("id", pymongo.ASCENDING)], {}),
+        ([("closed", pymongo.ASCENDING), ("category", pymongo.ASCENDING), ("id", pymongo.ASCENDING)], {}),
+        ([("user_id", pymongo.ASCENDING)], {}),
+        ([("admin_id", pymongo.ASCENDING)], {}),
+        ([("updated_at", pymongo.ASCENDING)], {}),
+        # Полнотекстовый поиск по вопросам и ответам. Русский стеммер приводит слова к основе: "оплатил" найдет "оплата".
+        # Текстовый индекс у коллекции может быть только один, а вопрос важнее ответа, поэтому у него больше вес
+        ([("question", pymongo.TEXT), ("answer", pymongo.TEXT)],
+         {"default_language": "russian", "weights": {"question": 2, "answer": 1}, "name": "requests_text"}),
+    ],
+    "prepared_questions_cl": [
+        ([("category", pymongo.ASCENDING)], {}),
+    ],
+    "users_cl": [
+        ([("updated_at", pymongo.ASCENDING)], {}),
+    ],
+    "admins_cl": [
+        ([("active", pymongo.ASCENDING), ("id", pymongo.ASCENDING)], {}),
+    ],
+    "mailing_cl": [
+        ([("status", pymongo.ASCENDING), ("date", pymongo.ASCENDING)], {}),
+        ([("updated_at", pymongo.ASCENDING)], {}),
+    ],
+    "user_cache_cl": [
+        ([("cache", pymongo.ASCENDING), ("user_id", pymongo.ASCENDING)], {"unique": True}),
+        ([("expires_at", pymongo.ASCENDING)], {"expireAfterSeconds": 0}),
+    ],
+    "stats_cl": [
+        ([("day", pymongo.ASCENDING), ("kind", pymongo.ASCENDING), ("key", pymongo.ASCENDING)], {"unique": True}),
+    ],
+}
+
+# Запросы, которые выполняет Storage: (коллекция, фильтр, поле для distinct или None для find, сортировка или None).
+# Если добавляете новый запрос в Storage, добавьте его и сюда, чтобы check_indexes.py проверил, что он идет по индексу.
+# bench/check_queries.py собирает запросы, которые бот реально выполняет под нагрузкой, и сообщает о тех, которых здесь нет.
+# Полное чтение маленькой коллекции questions (get_questions) и агрегации для пересчета статистики сюда намеренно не входят
+_DATE = datetime(2000, 1, 1)
+QUERIES: list[tuple[str, dict, str | None, list[tuple[str, int]] | None]] = [
+    ("questions_cl", {}, None, [("id", pymongo.DESCENDING)]),
+    ("questions_cl", {"id": 1}, None, None),
+    ("questions_cl", {"id": 1, "closed": True}, None, None),
+    ("questions_cl", {"id": 1, "closed": False}, None, None),
+    ("questions_cl", {"closed": False}, None, None),
+    ("questions_cl", {"closed": False, "id": {"$gt": 0}}, None, [("id", pymongo.ASCENDING)]),
+    ("questions_cl", {"closed": False, "id": {"$lt": 10}}, None, [("id", pymongo.DESCENDING)]),
+    ("questions_cl", {"closed": False, "date": {"$lt": _DATE}, "id": {"$gt": 0}}, None, [("id", pymongo.ASCENDING)]),
+    ("questions_cl", {"closed": False, "category": {"$in": ["другое"]}, "id": {"$gt": 0}}, None, [("id", pymongo.ASCENDING)]),
+    ("questions_cl", {"user_id": 1}, None, None),
+    ("questions_cl", {"user_id": 1}, None, [("id", pymongo.DESCENDING)]),
+    ("questions_cl", {"updated_at": {"$gte": _DATE}}, None, [("updated_at", pymongo.ASCENDING)]),
+    ("questions_cl", {"$text": {"$search": "оплата"}}, None, None),
+    ("users_cl", {"_id": {"$gt": 0}}, None, [("_id", pymongo.ASCENDING)]),
+    ("users_cl", {"updated_at": {"$gte": _DATE}}, None, [("updated_at", pymongo.ASCENDING)]),
+    ("prepared_questions_cl", {"category": re.compile("другое", re.IGNORECASE)}, None, None),
+    ("prepared_questions_cl", {}, "category", None),
+    ("admins_cl", {"active": True}, "id", None),
+    ("mailing_cl", {"$or": [{"status": "pending"}, {"status": "running", "heartbeat": {"$lt": _DATE}}]}, None, [("date", pymongo.ASCENDING)]),
+    ("mailing_cl", {"status": {"$exists": True}}, None, [("date", pymongo.DESCENDING)]),
+    ("mailing_cl", {"updated_at": {"$gte": _DATE}}, None, [("updated_at", pymongo.ASCENDING)]),
+    ("user_cache_cl", {"cache": "timed_messages", "user_id": 1}, None, None),
+    ("user_cache_cl", {"cache": "timed_messages", "user_id": 1, "expires_at": {"$gt": _DATE}}, None, None),
+    ("stats_cl", {"day": "2000-01-01", "kind": "total", "key": None}, None, None),
+    ("stats_cl", {"day": {"$gte": "2000-01-01", "$lt": "2000-02-01"}}, None, None),
+]
+
+# Документ в counters, который появляется после заполнения users и stats по requests (rollups.py rebuild).
+# Пока его нет, статистика и получатели рассылок учитывают только пользователей и вопросы с момента обновления бота
+BACKFILL_MARKER = "users_stats_backfill"
+
+# Коллекции, которые попадают в инкрементальный бэкап: имя коллекции в БД -> имя атрибута в Storage
+BACKUP_COLLECTIONS = {"requests": "questions_cl", "mailing": "mailing_cl", "users": "users_cl"}
 
 class Storage:
     """
@@ -13,18 +102,77 @@ class Storage:
     С помощью этого класса можно получить список подготовленных вопросов, создать новый вопрос, отправить ответ на вопрос,
     создать рассылку и еще многое другое.
     """
-    def __init__(self, connect_url: str = "mongodb://localhost:27017/", db_name: str = "support_bot", add_prepared_questions: bool = False):
-        self.client = pymongo.MongoClient(connect_url)
+    def __init__(self, connect_url: str = "mongodb://localhost:27017/", db_name: str = "support_bot",
+                 users_cache_size: int = 10_000, users_cache_ttl: float = 600, client: pymongo.MongoClient | None = None):
+        # Несколько ботов в одном процессе передают сюда общий client, чтобы у них был один пул соединений
+        self.client = client or pymongo.MongoClient(connect_url)
         self.db = self.client[db_name]
         self.admins_db = self.client["support_admins"] # Общая БД, к которой должны иметь доступ все другие бд
         self.admins_cl = self.admins_db["admins"] # Коллекция, в которой хранится список администраторов
         self.prepared_questions_cl = self.db["questions"] # Коллекция, в которой лежат подготовленые вопросы вместе с ответами
         self.questions_cl = self.db["requests"] # Коллекция, в которой будут лежат вопросы от пользователя
         self.mailing_cl = self.db["mailing"] # Коллекция, в которой будет храниться история рассылок
-
+        self.counters_cl = self.db["counters"] # Коллекция со счетчиками для AUTOINCREMENT id
+        self.stats_cl = self.db["stats"] # Коллекция с предпосчитанной статистикой по дням (см. get_rollup_statistics)
+        self.users_cl = self.db["users"] # Коллекция уникальных пользователей, _id - telegram id пользователя
+        self.user_cache_cl = self.db["user_cache"] # Коллекция для MongoUserCache - общего кэша для нескольких процессов бота
+        # Кэш профилей пользователей, чтобы не ходить в БД на каждое сообщение. Он видит только изменения своего процесса:
+        # если бота обслуживают несколько процессов, почту или категорию, сохраненную другим процессом, он не заметит.
+        # Поэтому в таком режиме кэш выключают (users_cache_size=0), и каждый get_user читает профиль из БД
+        self.users_cache = LRUCache(users_cache_size, users_cache_ttl) if users_cache_size else None
+
+    def prepare(self, add_prepared_questions: bool = False) -> None:
+        """
+        Готовим БД к работе бота: индексы, счетчик id и подготовленные вопросы. Каждый шаг можно безопасно повторять,
+        поэтому метод вызывается при каждом запуске бота. Скрипты, которые только читают БД, его не вызывают.\n
+        Пересчет users и stats по requests сюда не входит: это долгая запись, которую запускают один раз командой rollups.py rebuild.
+        Пока ее не запустили, метод при каждом запуске пишет предупреждение, а рассылки не запускаются
+        """
+        self.ensure_indexes()
+        self.init_counter("requests", self.questions_cl)
         # При первом запуске mongoDB, важно проверить есть ли подготовленные вопросы в выбранной db_name
         if add_prepared_questions:
             self.add_questions()
+        # Коллекции users и stats появились позже самих вопросов, поэтому в старых БД их нужно заполнить
+        if not self.is_backfilled():
+            if self.questions_cl.find_one():
+                log.warning("В БД %s пользователи и статистика не заполнены по старым вопросам: статистика неполная, "
+                            "рассылки не запускаются. Заполните их: python rollups.py rebuild", self.db.name)
+            else: # В новой БД users и stats ведутся с первого вопроса, заполнять нечего
+                self._mark_backfilled()
+
+    def ensure_indexes(self) -> None:
+        """Создаем индексы из INDEXES. create_index ничего не делает, если такой индекс уже есть"""
+        for collection_name, indexes in INDEXES.items():
+            collection: pymongo.collection.Collection = getattr(self, collection_name)
+            for keys, options in indexes:
+                collection.create_index(keys, **options)
+
+    def explain_query(self, collection: pymongo.collection.Collection, filter: dict, distinct_key: str | None = None,
+                      sort: list[tuple[str, int]] | None = None) -> dict:
+        """План выполнения (winningPlan) одного запроса find или distinct"""
+        if distinct_key:
+            explain = collection.database.command("explain", {"distinct": collection.name, "key": distinct_key, "query": filter})
+        else:
+            cursor = collection.find(filter)
+            explain = (cursor.sort(sort) if sort else cursor).explain()
+        return explain["queryPlanner"]["winningPlan"]
+
+    def explain_queries(self) -> list[tuple[str, dict, str | None, list | None, dict]]:
+        """Возвращаем план выполнения (winningPlan) для каждого запроса из QUERIES"""
+        plans = []
+        for collection_name, filter, distinct_key, sort in QUERIES:
+            collection: pymongo.collection.Collection = getattr(self, collection_name)
+            plans.append((collection.name, filter, distinct_key, sort, self.explain_query(collection, filter, distinct_key, sort)))
+        return plans
+
+    def find_collscans(self) -> list[tuple[str, dict, str | None, list | None]]:
+        """Возвращаем запросы из QUERIES, которые выполняются полным сканированием коллекции (COLLSCAN)"""
+        return [
+            (collection, filter, distinct_key, sort)
+            for collection, filter, distinct_key, sort, plan in self.explain_queries()
+            if has_plan_stage(plan, "COLLSCAN")
+        ]
 
     def add_questions(self):
         """
@@ -53,15 +201,29 @@ class Storage:
             return self.get_questions()
         return questions
 
+    def init_counter(self, name: str, collection: pymongo.collection.Collection) -> None:
+        """
+        Подтягиваем счетчик {name} до максимального id в коллекции.
+        $max никогда не уменьшает счетчик, поэтому метод можно безопасно вызывать при каждом запуске
+        """
+        last = collection.find_one({}, {"id": 1, "_id": 0}, sort=[("id", pymongo.DESCENDING)])
+        self.counters_cl.update_one({"_id": name}, {"$max": {"seq": last["id"] if last else 0}}, upsert=True)
+
+    def next_id(self, name: str) -> int:
+        """Атомарно увеличиваем счетчик {name} и возвращаем новое значение. Два одновременных вызова никогда не получат одинаковый id"""
+        counter = self.counters_cl.find_one_and_update(
+            {"_id": name},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        return counter["seq"]
+
     def save_new_question(self, req: Question) -> int:
         """Сохраняем новый запрос от пользователя и возвращаем импровизированный id AUTOINCREMENT"""
 
-        # выбираем максимальное значение id
-        max_qst_id = self.questions_cl.find({}, {"id": 1, "_id": 0}).sort("id", -1).limit(1)
-        try:
-            question_id = next(max_qst_id)["id"] + 1
-        except:
-            question_id = 1
+        question_id = self.next_id("requests")
+        new_user = self.questions_cl.find_one({"user_id": req.UserId}, {"_id": 1}) is None
         doc = {
             "id": question_id,
             "admin_id": None,
@@ -75,15 +237,25 @@ class Storage:
             "answer": None,
             "closed": False,
             "liked": None,
-            "date": req.Date
+            "date": req.Date,
+            "updated_at": req.Date
         }
         self.questions_cl.insert_one(doc)
+        self.update_user(req.UserId, user_name=req.UserName, first_name=req.FirstName, email=req.Email, last_category=doc["category"])
+
+        day = _day(req.Date)
+        self.stats_cl.bulk_write([
+            _rollup(day, "total", None, {"created": 1, "users": int(new_user)}),
+            _rollup(day, "category", doc["category"].lower(), {"count": 1}),
+        ], ordered=False)
         return  question_id
 
-    def get_question_by_id(self, id: int) -> Question:
-        """"Возвращаем вопрос по id"""
+    def get_question_by_id(self, id: int) -> Question | None:
+        """"Возвращаем вопрос по id или None, если его нет в БД"""
 
         req = self.questions_cl.find_one({"id": id})
+        if not req:
+            return None
         return Question(
             Id=req["id"],
             UserId=req["user_id"],
@@ -91,27 +263,76 @@ class Storage:
             Question=req["question"],
             Category=req["category"],
             Email=req["email"],
-            FirstName=req["first_name"],
+            FirstName=req.get("first_name") or "",
             Date=req["date"]
         )
 
-    def get_open_requests(self) -> list[Question]:
-        """Получаем список неотвеченных сообщений"""
-
-        data = self.questions_cl.find({"closed": False})
-        items = []
-        for i in data:
-            items.append(Question(
-                Id=i["id"],
-                UserId=i["user_id"],
-                UserName=i["user_name"],
-                Question=i["question"],
-                Category=i["category"],
-                Email=i["email"],
-                FirstName="",
-                Date=i["date"]
-        ))
-        return items
+    def get_open_requests(self, after_id: int = 0, before_id: int | None = None, limit: int = 5,
+                          categories: list[str] | None = None, older_than: datetime | None = None) -> InboxPage:
+        """
+        Страница неотвеченных сообщений для админа, отсортированная по id.\n
+        Пагинация по ключу: следующая страница - это сообщения с id больше after_id, предыдущая - с id меньше before_id.
+        В отличие от skip, такой запрос всегда идет по индексу (closed, id) и не зависит от номера страницы.
+        categories и older_than - необязательные фильтры по категории и дате обращения
+        """
+
+        query = {"closed": False}
+        if categories:
+            query["category"] = {"$in": categories}
+        if older_than:
+            query["date"] = {"$lt": older_than}
+
+        if before_id is not None:
+            query["id"] = {"$lt": before_id}
+            sort = pymongo.DESCENDING
+        else:
+            query["id"] = {"$gt": after_id}
+            sort = pymongo.ASCENDING
+
+        # Берем на одну запись больше, чтобы без отдельного count понять, есть ли еще страница
+        projection = {"_id": 0, "id": 1, "user_id": 1, "user_name": 1, "first_name": 1, "question": 1, "category": 1, "email": 1, "date": 1}
+        data = list(self.questions_cl.find(query, projection).sort("id", sort).limit(limit + 1))
+        has_more, data = len(data) > limit, data[:limit]
+        items = [Question(
+            Id=i["id"],
+            UserId=i["user_id"],
+            UserName=i["user_name"],
+            Question=i["question"],
+            Category=i["category"],
+            Email=i["email"],
+            FirstName=i.get("first_name") or "",
+            Date=i["date"]
+        ) for i in data]
+
+        if before_id is not None:
+            items.reverse()
+            return InboxPage(Questions=items, HasPrev=has_more, HasNext=True)
+        return InboxPage(Questions=items, HasPrev=after_id > 0, HasNext=has_more)
+
+    def search_requests(self, text: str, page: int = 0, limit: int = 5) -> SearchPage:
+        """
+        Полнотекстовый поиск по вопросам и ответам всех обращений, самые релевантные сверху.\n
+        Текстовый индекс mongoDB обновляется сам при каждой записи в requests (save_new_question, save_answer),
+        поэтому отдельно поддерживать его не нужно
+        """
+
+        projection = {"_id": 0, "id": 1, "question": 1, "answer": 1, "admin_name": 1, "category": 1, "date": 1, "score": {"$meta": "textScore"}}
+        data = list(
+            self.questions_cl.find({"$text": {"$search": text}}, projection)
+            .sort([("score", {"$meta": "textScore"}), ("id", pymongo.DESCENDING)])
+            .skip(page * limit)
+            .limit(limit + 1)
+        )
+        hits = [SearchHit(
+            Id=i["id"],
+            Question=i["question"],
+            Answer=i.get("answer"),
+            AdminName=i.get("admin_name"),
+            Category=i["category"],
+            Date=i["date"],
+            Score=i["score"]
+        ) for i in data[:limit]]
+        return SearchPage(Hits=hits, Page=page, HasNext=len(data) > limit)
 
     def check_question_is_closed(self, question_id: int) -> bool | None:
         """Проверяем закрыт ли вопрос"""
@@ -144,16 +365,26 @@ class Storage:
 
     def save_answer(self, answer: Answer) -> None:
         """"сохраняем ответ админа к конкретному вопросу"""
-        filter = {"id" : answer.Id}
+        answer_date = datetime.now()
+        filter = {"id" : answer.Id, "closed": False}
         update = {
             "$set": {
                 "admin_name": answer.AdminName,
                 "admin_id": answer.AdminId,
                 "answer": answer.Text,
+                "answer_date": answer_date,
+                "updated_at": answer_date,
                 "closed": True
             }
         }
-        self.questions_cl.update_many(filter, update)
+        if not self.questions_cl.find_one_and_update(filter, update, {"_id": 1}):
+            return # На вопрос уже ответили, статистику второй раз не считаем
+
+        day = _day(answer_date)
+        self.stats_cl.bulk_write([
+            _rollup(day, "total", None, {"closed": 1}),
+            _rollup(day, "admin", answer.AdminId, {"answers": 1}, {"name": answer.AdminName}),
+        ], ordered=False)
 
     def mark_answer_as_correct(self, id: int, liked: bool = True):
         """
@@ -164,9 +395,20 @@ class Storage:
         update = {
             "$set": {
                 "liked": liked,
+                "updated_at": datetime.now(),
             }
         }
-        self.questions_cl.update_one(filter, update)
+        prev = self.questions_cl.find_one_and_update(filter, update, {"_id": 0, "liked": 1, "admin_id": 1, "date": 1, "answer_date": 1})
+        if not prev or prev["admin_id"] is None or prev["liked"] == liked:
+            return
+
+        # Пользователь мог переоценить ответ, поэтому снимаем старую оценку
+        inc = {"likes": 0, "dislikes": 0}
+        if prev["liked"] is not None:
+            inc["likes" if prev["liked"] else "dislikes"] -= 1
+        inc["likes" if liked else "dislikes"] += 1
+        day = _day(prev.get("answer_date") or prev["date"])
+        self.stats_cl.bulk_write([_rollup(day, "admin", prev["admin_id"], inc)])
 
     def get_answer(self, id: int) -> Answer | None:
         """Получаем ответ админа по id"""
@@ -190,62 +432,496 @@ class Storage:
         admins: list[int] = self.admins_cl.distinct("id", {"active": True})
         return admins
 
+    def get_user(self, user_id: int) -> User | None:
+        """Возвращаем профиль пользователя. Сначала ищем в кэше, потом в коллекции users"""
+
+        user = self.users_cache.get(user_id, _MISSING) if self.users_cache is not None else _MISSING
+        if user is not _MISSING: # None тоже кэшируем - это пользователь, которого еще нет в БД
+            return user
+
+        doc = self.users_cl.find_one({"_id": user_id})
+        if doc and "email" not in doc:
+            # Пользователь попал в users из старых запросов, где почта хранилась только в requests
+            req = self.questions_cl.find_one({"user_id": user_id}, {"email": 1, "_id": 0}, sort=[("id", pymongo.DESCENDING)])
+            if req:
+                self.users_cl.update_one({"_id": user_id}, {"$set": {"email": req["email"], "updated_at": datetime.now()}})
+                doc["email"] = req["email"]
+
+        user = _user(doc) if doc else None
+        if self.users_cache is not None:
+            self.users_cache.set(user_id, user)
+        return user
+
+    def update_user(self, user_id: int, **fields) -> None:
+        """
+        Обновляем профиль пользователя (user_name, first_name, email, last_category) и время последнего визита.
+        Если пользователя еще нет в коллекции, то он будет создан
+        """
+
+        now = datetime.now()
+        fields["last_seen"] = now
+        fields["updated_at"] = now
+        doc = self.users_cl.find_one_and_update(
+            {"_id": user_id},
+            {"$set": fields, "$setOnInsert": {"first_seen": now}},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        if self.users_cache is not None:
+            self.users_cache.set(user_id, _user(doc))
+
     def get_user_email(self, user_id: int) -> str | None:
         """Метод найдет почту пользователя по его id"""
 
-        email = self.questions_cl.find_one({"user_id": user_id}, {"email": 1, "_id": 0})
-        if email:
-            return email["email"]
-        return None
+        user = self.get_user(user_id)
+        return user.Email if user else None
+
+    def get_cache_value(self, cache: str, user_id: int):
+        """Значение из кэша {cache} для пользователя. Просроченные значения не возвращаем, даже если mongoDB их еще не удалила"""
+
+        doc = self.user_cache_cl.find_one({"cache": cache, "user_id": user_id, "expires_at": {"$gt": datetime.utcnow()}}, {"value": 1})
+        return doc["value"] if doc else None
+
+    def set_cache_value(self, cache: str, user_id: int, value, ttl: float) -> None:
+        """Сохраняем значение в кэш {cache} на ttl секунд. Время храним в UTC, т.к. по нему работает TTL-индекс mongoDB"""
+
+        self.user_cache_cl.update_one(
+            {"cache": cache, "user_id": user_id},
+            {"$set": {"value": value, "expires_at": datetime.utcnow() + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+
+    def pop_cache_value(self, cache: str, user_id: int):
+        """Удаляем значение из кэша {cache} и возвращаем его"""
+
+        doc = self.user_cache_cl.find_one_and_delete({"cache": cache, "user_id": user_id})
+        if not doc or doc["expires_at"] <= datetime.utcnow():
+            return None
+        return doc["value"]
+
+    def is_backfilled(self) -> bool:
+        """Заполнены ли users и stats по всем вопросам из requests (см. BACKFILL_MARKER)"""
+        return self.counters_cl.find_one({"_id": BACKFILL_MARKER}) is not None
 
-    def get_all_users(self) -> list[int]:
-        """Получить список уникальных пользователей"""
-        return self.questions_cl.distinct("user_id")
+    def _mark_backfilled(self) -> None:
+        self.counters_cl.update_one({"_id": BACKFILL_MARKER}, {"$set": {"date": datetime.now()}}, upsert=True)
 
-    def get_statistics(self) -> Statistic:
-        """Возвращаем статистику для админов"""
+    def rebuild_users_and_rollups(self) -> None:
+        """Заполняем users и пересчитываем stats по requests, после чего отмечаем, что БД заполнена"""
+        self.rebuild_users()
+        self.rebuild_rollups()
+        self._mark_backfilled()
+
+    def rebuild_users(self) -> None:
+        """Заполняем коллекцию users уникальными пользователями из requests. Выполняется на стороне mongoDB через $merge"""
+        self.questions_cl.aggregate([
+            {"$group": {"_id": "$user_id", "first_seen": {"$min": "$date"}}},
+            {"$merge": {"into": self.users_cl.name, "whenMatched": "keepExisting", "whenNotMatched": "insert"}}
+        ], allowDiskUse=True)
+
+    def get_statistics(self, date_from: datetime | None = None, date_to: datetime | None = None) -> Statistic:
+        """
+        Возвращаем статистику для админов.\n
+        Вся статистика считается одной агрегацией ($facet) за один проход по коллекции requests.
+        date_from и date_to позволяют посчитать статистику только за выбранный период
+        """
+
+        match = {}
+        if date_from or date_to:
+            match["date"] = {}
+            if date_from:
+                match["date"]["$gte"] = date_from
+            if date_to:
+                match["date"]["$lt"] = date_to
+
+        pipeline = [
+            {"$match": match},
+            {"$facet": {
+                "users": [{"$group": {"_id": "$user_id"}}, {"$count": "count"}],
+                "closed": [{"$match": {"closed": True}}, {"$count": "count"}],
+                "opened": [{"$match": {"closed": False}}, {"$count": "count"}],
+                "categories": [{"$group": {"_id": "$category", "count": {"$sum": 1}}}],
+                "admins": [
+                    {"$match": {"admin_id": {"$ne": None}}},
+                    {"$group": {
+                        "_id": "$admin_id",
+                        "name": {"$first": "$admin_name"},
+                        "total": {"$sum": 1},
+                        "likes": {"$sum": {"$cond": [{"$eq": ["$liked", True]}, 1, 0]}},
+                        "dislikes": {"$sum": {"$cond": [{"$eq": ["$liked", False]}, 1, 0]}},
+                    }}
+                ]
+            }}
+        ]
+        facet = next(self.questions_cl.aggregate(pipeline, allowDiskUse=True))
+
+        # $toLower в mongoDB корректно работает только с ASCII, поэтому категории на кириллице приводим к нижнему регистру здесь
+        categories = Counter()
+        for item in facet["categories"]:
+            categories[(item["_id"] or "другое").lower()] += item["count"]
 
-        count_users = len(self.questions_cl.distinct("user_id"))
-        count_closed = len([0 for _ in self.questions_cl.find({"closed": True})])
-        count_open = len([0 for _ in self.questions_cl.find({"closed": False})])
-        categories = [i["category"].lower() for i in self.questions_cl.find({}, {"category": 1, "_id": 0})]
-        categories_count = [CategoryStat(*i) for i in Counter(categories).items()]
-        admins = self.count_admins_stat()
         return Statistic(
-            UsersCount=count_users,
-            ClosedCount=count_closed,
-            OpenedCount=count_open,
-            CategoryStat=categories_count,
-            AdminStat=admins
+            UsersCount=_facet_count(facet["users"]),
+            ClosedCount=_facet_count(facet["closed"]),
+            OpenedCount=_facet_count(facet["opened"]),
+            CategoryStat=[CategoryStat(*i) for i in categories.most_common()],
+            AdminStat=[AdminStat(
+                UserName=i["name"],
+                Likes=i["likes"],
+                Dislikes=i["dislikes"],
+                WithoutRate=i["total"] - i["likes"] - i["dislikes"]
+            ) for i in facet["admins"]]
         )
 
-    def count_admins_stat(self) -> list[AdminStat]:
-        """Считаем статистику по каждому админу"""
+    def get_rollup_statistics(self, date_from: datetime | None = None, date_to: datetime | None = None) -> Statistic:
+        """
+        Возвращаем статистику для админов из предпосчитанной коллекции stats.\n
+        Коллекция обновляется при каждом новом вопросе, ответе и оценке, поэтому чтение не зависит от размера requests.
+        В отличие от get_statistics, с фильтром по датам UsersCount - это количество новых пользователей за период
+        """
+
+        match = {}
+        if date_from or date_to:
+            match["day"] = {}
+            if date_from:
+                match["day"]["$gte"] = _day(date_from)
+            if date_to:
+                match["day"]["$lt"] = _day(date_to)
+
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": {"kind": "$kind", "key": "$key"},
+                "name": {"$last": "$name"},
+                **{field: {"$sum": f"${field}"} for field in ("created", "closed", "users", "count", "answers", "likes", "dislikes")}
+            }}
+        ]
+        total = {"created": 0, "closed": 0, "users": 0}
+        categories, admins = [], []
+        for item in self.stats_cl.aggregate(pipeline):
+            match item["_id"]["kind"]:
+                case "total":
+                    total = item
+                case "category":
+                    if item["count"]:
+                        categories.append(CategoryStat(Category=item["_id"]["key"], Count=item["count"]))
+                case "admin":
+                    admins.append(AdminStat(
+                        UserName=item["name"],
+                        Likes=item["likes"],
+                        Dislikes=item["dislikes"],
+                        WithoutRate=item["answers"] - item["likes"] - item["dislikes"]
+                    ))
+
+        return Statistic(
+            UsersCount=total["users"],
+            ClosedCount=total["closed"],
+            OpenedCount=total["created"] - total["closed"],
+            CategoryStat=sorted(categories, key=lambda i: i.Count, reverse=True),
+            AdminStat=admins
+        )
 
-        data = self.questions_cl.find({"admin_id": {"$ne": None}}, {"liked": 1, "admin_id": 1, "admin_name": 1, "_id": 0})
-        admins = {}
-        for item in data:
-            if item["admin_id"] not in admins:
-                admins[item["admin_id"]] = AdminStat(UserName=item["admin_name"], Likes=0, Dislikes=0, WithoutRate=0)
+    def rebuild_rollups(self) -> None:
+        """
+        Пересчитываем коллекцию stats с нуля по сырым данным из requests.
+        Нужно, если статистика разошлась (см. check_rollups) или после переноса старых данных.
+        Лучше запускать, когда бот остановлен, иначе изменения, сделанные во время пересчета, могут потеряться
+        """
 
-            match item["liked"]:
-                case True:
-                    admins[item["admin_id"]].Likes += 1
-                case False:
-                    admins[item["admin_id"]].Dislikes += 1
-                case None:
-                    admins[item["admin_id"]].WithoutRate += 1
-        return list(admins.values())
+        day_of = lambda field: {"$dateToString": {"format": "%Y-%m-%d", "date": field}}
+        rollups: dict[tuple, dict] = {}
+
+        def add(day: str, kind: str, key, inc: dict, set: dict | None = None):
+            doc = rollups.setdefault((day, kind, key), {"day": day, "kind": kind, "key": key})
+            for field, value in inc.items():
+                doc[field] = doc.get(field, 0) + value
+            doc.update(set or {})
+
+        created = self.questions_cl.aggregate([
+            {"$group": {"_id": {"day": day_of("$date"), "category": "$category"}, "count": {"$sum": 1}}}
+        ], allowDiskUse=True)
+        for item in created:
+            add(item["_id"]["day"], "total", None, {"created": item["count"]})
+            add(item["_id"]["day"], "category", (item["_id"]["category"] or "другое").lower(), {"count": item["count"]})
+
+        answered = self.questions_cl.aggregate([
+            {"$match": {"closed": True}},
+            {"$group": {
+                "_id": {"day": day_of({"$ifNull": ["$answer_date", "$date"]}), "admin_id": "$admin_id"},
+                "name": {"$last": "$admin_name"},
+                "answers": {"$sum": 1},
+                "likes": {"$sum": {"$cond": [{"$eq": ["$liked", True]}, 1, 0]}},
+                "dislikes": {"$sum": {"$cond": [{"$eq": ["$liked", False]}, 1, 0]}},
+            }}
+        ], allowDiskUse=True)
+        for item in answered:
+            add(item["_id"]["day"], "total", None, {"closed": item["answers"]})
+            if item["_id"]["admin_id"] is not None:
+                inc = {"answers": item["answers"], "likes": item["likes"], "dislikes": item["dislikes"]}
+                add(item["_id"]["day"], "admin", item["_id"]["admin_id"], inc, {"name": item["name"]})
+
+        users = self.questions_cl.aggregate([
+            {"$group": {"_id": "$user_id", "first": {"$min": "$date"}}},
+            {"$group": {"_id": day_of("$first"), "count": {"$sum": 1}}}
+        ], allowDiskUse=True)
+        for item in users:
+            add(item["_id"], "total", None, {"users": item["count"]})
+
+        self.stats_cl.delete_many({})
+        if rollups:
+            self.stats_cl.insert_many(list(rollups.values()))
+
+    def check_rollups(self) -> list[str]:
+        """Сравниваем статистику из stats со статистикой, посчитанной по requests. Вернет список расхождений"""
+
+        raw = self.get_statistics()
+        rollup = self.get_rollup_statistics()
+        problems = [
+            f"{field}: requests={getattr(raw, field)}, stats={getattr(rollup, field)}"
+            for field in ("UsersCount", "ClosedCount", "OpenedCount")
+            if getattr(raw, field) != getattr(rollup, field)
+        ]
+
+        raw_categories, rollup_categories = dict(raw.CategoryStat), dict(rollup.CategoryStat)
+        for category in raw_categories.keys() | rollup_categories.keys():
+            if raw_categories.get(category, 0) != rollup_categories.get(category, 0):
+                problems.append(f"Категория {category}: requests={raw_categories.get(category, 0)}, stats={rollup_categories.get(category, 0)}")
+
+        raw_admins = {i.UserName: i for i in raw.AdminStat}
+        rollup_admins = {i.UserName: i for i in rollup.AdminStat}
+        for name in raw_admins.keys() | rollup_admins.keys():
+            if raw_admins.get(name) != rollup_admins.get(name):
+                problems.append(f"Админ {name}: requests={raw_admins.get(name)}, stats={rollup_admins.get(name)}")
+        return problems
+
+    def create_mailing_job(self, mailing: Mailing, file_id: str = "") -> str | None:
+        """
+        Создаем задачу рассылки. Саму рассылку выполняет фоновый MailingWorker.
+        Документ задачи совместим со старыми записями рассылок без статуса, поэтому история рассылок хранится там же.
+        Вернет id задачи или None, если users еще не заполнены по requests: рассылка дошла бы только до части пользователей
+        """
 
-    def save_mailing(self, mailing: Mailing) -> None:
-        """Сохранить информацию о рассылке"""
+        if not self.is_backfilled():
+            return None
 
         doc = {
             "admin_id": mailing.AdminId,
             "admin_user": mailing.AdminUser,
-            "text": mailing.Text,
-            "views": mailing.Views,
+            "text": mailing.Text or "", # У рассылки с картинкой без подписи текста нет
+            "views": 0,
             "date": mailing.Date,
-            "picture": mailing.Picture
+            "picture": mailing.Picture,
+            "file_id": file_id,
+            "status": "pending",
+            "cursor": 0,
+            "failed": 0,
+            "total": self.count_users(),
+            "owner": None,
+            "heartbeat": None,
+            "started_at": None,
+            "updated_at": datetime.now(),
         }
-        self.mailing_cl.insert_one(doc)
+        return str(self.mailing_cl.insert_one(doc).inserted_id)
+
+    def claim_mailing_job(self, owner: str, lease: float) -> MailingJob | None:
+        """
+        Забираем задачу рассылки в работу. Подходит задача, которая ждет запуска, или задача, которую выполнял процесс,
+        переставший отмечаться дольше lease секунд (например, бот упал посреди рассылки).
+        Пока users не заполнены по requests, задачи не выдаются
+        """
+
+        if not self.is_backfilled():
+            return None
+        now = datetime.now()
+        doc = self.mailing_cl.find_one_and_update(
+            {"$or": [
+                {"status": "pending"},
+                {"status": "running", "heartbeat": {"$lt": now - timedelta(seconds=lease)}},
+            ]},
+            [{"$set": {
+                "status": "running",
+                "owner": owner,
+                "heartbeat": now,
+                "updated_at": now,
+                "started_at": {"$ifNull": ["$started_at", now]} # Если задача продолжается после сбоя, время первого запуска не трогаем
+            }}],
+            sort=[("date", pymongo.ASCENDING)],
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        return _mailing_job(doc) if doc else None
+
+    def checkpoint_mailing_job(self, job_id: str, owner: str, cursor: int, delivered: int, failed: int, done: bool = False) -> str | None:
+        """
+        Сохраняем прогресс рассылки и возвращаем текущий статус задачи - так воркер узнает, что админ поставил ее на паузу или отменил.
+        Вернет None, если задачу забрал другой процесс
+        """
+
+        now = datetime.now()
+        update = {"cursor": cursor, "views": delivered, "failed": failed, "heartbeat": now, "updated_at": now}
+        filter = {"_id": ObjectId(job_id), "owner": owner}
+        if done:
+            update["status"] = "done"
+            filter["status"] = "running" # Не перезаписываем отмену, которая пришла во время последней пачки
+        doc = self.mailing_cl.find_one_and_update(filter, {"$set": update}, {"status": 1}, return_document=pymongo.ReturnDocument.AFTER)
+        if doc is None and done:
+            doc = self.mailing_cl.find_one({"_id": ObjectId(job_id), "owner": owner}, {"status": 1})
+        return doc["status"] if doc else None
+
+    def set_mailing_job_status(self, job_id: str, status: str, from_statuses: tuple[str, ...]) -> bool:
+        """Меняем статус задачи рассылки, если сейчас она в одном из статусов from_statuses"""
+
+        result = self.mailing_cl.update_one(
+            {"_id": ObjectId(job_id), "status": {"$in": list(from_statuses)}},
+            {"$set": {"status": status, "updated_at": datetime.now()}}
+        )
+        return result.modified_count == 1
+
+    def get_mailing_job(self, job_id: str) -> MailingJob | None:
+        """Возвращаем задачу рассылки по id"""
+
+        doc = self.mailing_cl.find_one({"_id": ObjectId(job_id)})
+        return _mailing_job(doc) if doc and "status" in doc else None
+
+    def get_mailing_jobs(self, limit: int = 5) -> list[MailingJob]:
+        """Возвращаем последние задачи рассылок (старые записи без статуса пропускаем)"""
+
+        data = self.mailing_cl.find({"status": {"$exists": True}}).sort("date", pymongo.DESCENDING).limit(limit)
+        return [_mailing_job(i) for i in data]
+
+    def get_users_after(self, user_id: int, limit: int) -> list[int]:
+        """Возвращаем следующую пачку уникальных пользователей с id больше {user_id} (по возрастанию id)"""
+
+        data = self.users_cl.find({"_id": {"$gt": user_id}}, {"_id": 1}).sort("_id", pymongo.ASCENDING).limit(limit)
+        return [i["_id"] for i in data]
+
+    def count_users(self) -> int:
+        """Количество уникальных пользователей"""
+
+        return self.users_cl.estimated_document_count()
+
+    def export_changes(self, since: datetime) -> Iterator[tuple[str, dict]]:
+        """
+        Перебираем документы requests, mailing и users, созданные или измененные начиная с since, в виде (коллекция, документ).
+        Нужно для инкрементального бэкапа: каждая запись в эти коллекции обновляет поле updated_at.
+        Удаления не отслеживаются - бот не удаляет ни вопросы, ни рассылки, ни пользователей
+        """
+        for name, collection in BACKUP_COLLECTIONS.items():
+            for doc in getattr(self, collection).find({"updated_at": {"$gte": since}}).sort("updated_at", pymongo.ASCENDING):
+                yield name, doc
+
+    def apply_changes(self, changes: Iterable[tuple[str, dict]], batch_size: int = 1000) -> int:
+        """Применяем изменения из export_changes: документ заменяется целиком по _id или вставляется, если его нет. Вернет количество документов"""
+        batches: dict[str, list[pymongo.ReplaceOne]] = {name: [] for name in BACKUP_COLLECTIONS}
+        applied = 0
+        for name, doc in changes:
+            batch = batches[name]
+            batch.append(pymongo.ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+            if len(batch) >= batch_size:
+                getattr(self, BACKUP_COLLECTIONS[name]).bulk_write(batch, ordered=False)
+                applied += len(batch)
+                batch.clear()
+        for name, batch in batches.items():
+            if batch:
+                getattr(self, BACKUP_COLLECTIONS[name]).bulk_write(batch, ordered=False)
+                applied += len(batch)
+        return applied
+
+
+def _day(date: datetime) -> str:
+    """Ключ дня для коллекции stats"""
+    return date.strftime("%Y-%m-%d")
+
+
+def _rollup(day: str, kind: str, key, inc: dict, set: dict | None = None) -> pymongo.UpdateOne:
+    """Операция инкремента одной строки статистики в коллекции stats"""
+    update = {"$inc": inc}
+    if set:
+        update["$set"] = set
+    return pymongo.UpdateOne({"day": day, "kind": kind, "key": key}, update, upsert=True)
+
+
+def _user(doc: dict) -> User:
+    """Документ пользователя из mongoDB -> User"""
+    return User(
+        Id=doc["_id"],
+        UserName=doc.get("user_name"),
+        FirstName=doc.get("first_name"),
+        Email=doc.get("email"),
+        LastCategory=doc.get("last_category"),
+        LastSeen=doc.get("last_seen")
+    )
+
+
+def _mailing_job(doc: dict) -> MailingJob:
+    """Документ задачи рассылки из mongoDB -> MailingJob"""
+    return MailingJob(
+        Id=str(doc["_id"]),
+        AdminId=doc["admin_id"],
+        AdminUser=doc["admin_user"],
+        Text=doc["text"],
+        FileId=doc.get("file_id", ""),
+        Status=doc["status"],
+        Cursor=doc["cursor"],
+        Delivered=doc["views"],
+        Failed=doc["failed"],
+        Total=doc["total"],
+        Date=doc["date"],
+        StartedAt=doc["started_at"],
+        UpdatedAt=doc["updated_at"]
+    )
+
+
+def _facet_count(result: list[dict]) -> int:
+    """$count внутри $facet возвращает пустой список, если документов нет"""
+    return result[0]["count"] if result else 0
+
+
+def has_plan_stage(plan: dict, stage: str) -> bool:
+    """Рекурсивно ищем стадию {stage} в дереве плана выполнения запроса"""
+    if plan.get("stage") == stage:
+        return True
+    children = [plan[key] for key in ("inputStage", "queryPlan") if key in plan] + plan.get("inputStages", [])
+    return any(has_plan_stage(child, stage) for child in children)
+
+
+class AsyncStorage:
+    """
+    Асинхронная обертка над Storage.\n
+    pymongo блокирующий, поэтому каждый метод Storage выполняется в отдельном пуле потоков,
+    а хендлеры просто делают await и не останавливают event loop бота, пока ждут ответа от mongoDB.\n
+    Набор методов полностью совпадает с Storage: storage.get_admins() -> await storage.get_admins()\n
+    Несколько ботов в одном процессе могут использовать общий executor.\n
+    Если передан on_call, то после каждого вызова он получает имя метода, время в секундах (вместе с ожиданием свободного потока)
+    и ошибку или None - так подключаются метрики
+    """
+    def __init__(self, storage: Storage, executor: ThreadPoolExecutor | None = None, max_workers: int = 16,
+                 on_call: Callable[[str, float, BaseException | None], None] | None = None):
+        self.sync = storage # Синхронное хранилище, пригодится там, где event loop еще не запущен
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mongo")
+        self._on_call = on_call
+
+    def __getattr__(self, name: str):
+        if name.startswith("_") or name == "sync":
+            raise AttributeError(name)
+        attr = getattr(self.sync, name)
+        if not callable(attr):
+            return attr
+
+        @wraps(attr)
+        async def wrapper(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            if not self._on_call:
+                return await loop.run_in_executor(self._executor, partial(attr, *args, **kwargs))
+
+            started_at, error = time.perf_counter(), None
+            try:
+                return await loop.run_in_executor(self._executor, partial(attr, *args, **kwargs))
+            except BaseException as err:
+                error = err
+                raise
+            finally:
+                self._on_call(name, time.perf_counter() - started_at, error)
+
+        setattr(self, name, wrapper) # Кэшируем обертку, чтобы не создавать ее при каждом вызове
+        return wrapper
+
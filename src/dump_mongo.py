@@ -1,41 +1,209 @@
-import subprocess
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import time
 from datetime import datetime
+from typing import Iterable, Iterator, NamedTuple
+
+from bson import json_util
+from aiogram import Bot, types
+from aiogram.utils.exceptions import TelegramAPIError
+
 from db import Storage
 from tools import load_config
-import requests
-import shutil
-import os
 
-date = datetime.now().strftime("%d_%m_%Y__%H_%M_%S")
-archive_path = f"data/dumps/mongodump_{date}.zip"
-storage = Storage(db_name="support_admins")
-token = [i.Token for i in load_config()][0]
-
-def backup_mongo():
-    os.makedirs("data/dumps", exist_ok=True)
-    dbs = ("support_edwica", "support_admins", "support_profinansy", "support_openedu")
-    folders = " ".join(dbs)
-    backup_path = "."
-
-    [subprocess.run(f"mongodump --db {db} --out {backup_path}", shell=True)  for db in dbs]
-    subprocess.run(f"tar -cvzf {archive_path} {folders}", shell=True)
-    [shutil.rmtree(folder) for folder in dbs]
-
-def send_backup_to_admins():
-    for admin in storage.get_admins_id():
-        url = f"https://api.telegram.org/bot{token}/sendDocument"
-        with open(archive_path, 'rb') as file:
-            files = {
-                'document': file
-            }
-            data = {
-                'chat_id': admin,
-                "caption": f"Дапм данных от: {datetime.now()}"
-            }
-            response = requests.post(url, files=files, data=data)
-            return response.json()
+MONGO_URL = "mongodb://localhost:27017/"
+DUMPS_PATH = "data/dumps"
+FOLDER_FORMAT = "%d_%m_%Y__%H_%M_%S" # Папка data/dumps/{дата} на каждый запуск
+CHECKPOINT_PATH = os.path.join(DUMPS_PATH, "checkpoint.json") # С какого момента делать следующий инкрементальный дамп каждой БД
+DELTA_SUFFIX = ".delta.ndjson.gz"
+ARCHIVE_SUFFIX = ".archive.gz"
+TELEGRAM_FILE_LIMIT = 50 * 1024 * 1024 # Боты не могут отправлять файлы больше 50 МБ
+
+parser = argparse.ArgumentParser(
+                    prog='Бэкап бота поддержки',
+                    description='Делает дамп БД всех ботов из config.json и общей БД админов и отправляет его админам')
+
+parser.add_argument("--uri", default=MONGO_URL, help="Адрес mongoDB")
+parser.add_argument("-j", "--jobs", type=int, default=4, help="Сколько БД дампить одновременно")
+parser.add_argument("--no-send", action="store_true", help="Только сделать дамп, админам не отправлять")
+parser.add_argument("-i", "--incremental", action="store_true",
+                    help="Выгрузить только вопросы, рассылки и профили пользователей, измененные после прошлого дампа. Нужен хотя бы один полный дамп")
+
+
+class Dump(NamedTuple):
+    """Результат дампа одной БД"""
+
+    Db: str
+    Path: str
+    Size: int
+    Seconds: float
+
+
+async def dump_db(db: str, uri: str, folder: str, semaphore: asyncio.Semaphore) -> Dump:
+    """
+    Дампим одну БД через mongodump --archive --gzip. Вывод mongodump пишется сразу в итоговый файл,
+    поэтому не нужны ни временная папка с дампом, ни второй проход для архивации.
+    Пока mongodump работает, файл называется *.part, чтобы недописанный дамп нельзя было принять за готовый
+    """
+    path = os.path.join(folder, f"{db}{ARCHIVE_SUFFIX}")
+    async with semaphore:
+        started_at = time.perf_counter()
+        with open(f"{path}.part", mode="wb") as f:
+            process = await asyncio.create_subprocess_exec(
+                "mongodump", f"--uri={uri}", f"--db={db}", "--archive", "--gzip",
+                stdout=f, stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await process.communicate()
+        if process.returncode != 0:
+            os.remove(f"{path}.part")
+            raise RuntimeError(f"mongodump {db} завершился с кодом {process.returncode}: {stderr.decode(errors='replace').strip()}")
+        os.replace(f"{path}.part", path)
+        return Dump(Db=db, Path=path, Size=os.path.getsize(path), Seconds=time.perf_counter() - started_at)
+
+
+def write_delta(path: str, changes: Iterable[tuple[str, dict]]) -> int:
+    """
+    Пишем изменения в сжатый NDJSON: одна строка - {"collection": ..., "doc": ...}.
+    Extended JSON из bson сохраняет типы mongoDB (ObjectId, даты), поэтому документ восстанавливается без потерь. Вернет количество документов
+    """
+    count = 0
+    with gzip.open(f"{path}.part", mode="wt", encoding="utf-8") as f:
+        for collection, doc in changes:
+            f.write(json_util.dumps({"collection": collection, "doc": doc}, json_options=json_util.CANONICAL_JSON_OPTIONS))
+            f.write("\n")
+            count += 1
+    os.replace(f"{path}.part", path)
+    return count
+
+
+def read_delta(path: str) -> Iterator[tuple[str, dict]]:
+    """Читаем изменения, записанные write_delta"""
+    with gzip.open(path, mode="rt", encoding="utf-8") as f:
+        for line in f:
+            item = json_util.loads(line)
+            yield item["collection"], item["doc"]
+
+
+def export_delta(db: str, uri: str, path: str, since: datetime) -> int:
+    """Выгружаем в файл вопросы, рассылки и профили пользователей БД {db}, измененные начиная с since"""
+    storage = Storage(connect_url=uri, db_name=db)
+    try:
+        return write_delta(path, storage.export_changes(since))
+    finally:
+        storage.client.close()
+
+
+async def dump_delta(db: str, uri: str, folder: str, since: datetime, semaphore: asyncio.Semaphore) -> Dump:
+    """Инкрементальный дамп БД {db}. pymongo блокирующий, поэтому выгрузка идет в отдельном потоке"""
+    path = os.path.join(folder, f"{db}{DELTA_SUFFIX}")
+    async with semaphore:
+        started_at = time.perf_counter()
+        await asyncio.to_thread(export_delta, db, uri, path, since)
+        return Dump(Db=db, Path=path, Size=os.path.getsize(path), Seconds=time.perf_counter() - started_at)
+
+
+def load_checkpoints() -> dict[str, datetime]:
+    if not os.path.exists(CHECKPOINT_PATH):
+        return {}
+    with open(CHECKPOINT_PATH, mode="r", encoding="utf-8") as f:
+        return {db: datetime.fromisoformat(value) for db, value in json.load(f).items()}
+
+
+def save_checkpoints(checkpoints: dict[str, datetime]) -> None:
+    with open(f"{CHECKPOINT_PATH}.part", mode="w", encoding="utf-8") as f:
+        json.dump({db: value.isoformat() for db, value in checkpoints.items()}, f, indent=2)
+    os.replace(f"{CHECKPOINT_PATH}.part", CHECKPOINT_PATH)
+
+
+async def backup_mongo(dbs: list[str], uri: str, jobs: int, incremental: bool = False) -> list[Dump]:
+    """
+    Дампим все БД параллельно, не больше jobs одновременно. Вернет только успешные дампы.\n
+    После каждого успешного дампа запоминаем время его начала - следующий инкрементальный дамп выгрузит все, что изменилось после.
+    Изменения, попавшие в оба дампа, при восстановлении просто перезапишут документ еще раз
+    """
+    started = datetime.now()
+    folder = os.path.join(DUMPS_PATH, started.strftime(FOLDER_FORMAT))
+    os.makedirs(folder, exist_ok=True)
+    checkpoints = load_checkpoints()
+    semaphore = asyncio.Semaphore(jobs)
+    if incremental:
+        for db in dbs:
+            if db not in checkpoints:
+                print(f"[{db}] Нет полного дампа, сначала запустите без --incremental")
+        dbs = [db for db in dbs if db in checkpoints]
+        tasks = [dump_delta(db, uri, folder, checkpoints[db], semaphore) for db in dbs]
+    else:
+        tasks = [dump_db(db, uri, folder, semaphore) for db in dbs]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    dumps = []
+    for db, result in zip(dbs, results):
+        if isinstance(result, BaseException):
+            print(f"[{db}] Ошибка: {result}")
+        else:
+            print(f"[{db}] {result.Size / 1024 / 1024:.1f} МБ за {result.Seconds:.1f} с")
+            dumps.append(result)
+            checkpoints[db] = started
+    save_checkpoints(checkpoints)
+    return dumps
+
+
+async def send_backup_to_admins(bot: Bot, admins: list[int], dumps: list[Dump], incremental: bool = False):
+    """Отправляем дампы каждому админу одним альбомом документов (не больше 10 файлов в альбоме)"""
+    caption = f"{'Изменения в данных' if incremental else 'Дамп данных'} от: {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+    documents = [dump for dump in dumps if dump.Size <= TELEGRAM_FILE_LIMIT]
+    too_big = [dump.Db for dump in dumps if dump.Size > TELEGRAM_FILE_LIMIT]
+    if too_big:
+        caption += f"\nНе отправлены (больше 50 МБ, лежат на сервере): {', '.join(too_big)}"
+
+    for admin in admins:
+        try:
+            await send_documents(bot, admin, documents, caption)
+        except TelegramAPIError as err: # Один админ заблокировал бота - остальные все равно получат дамп
+            print(f"Не удалось отправить дамп админу {admin}: {err}")
+
+
+async def send_documents(bot: Bot, chat_id: int, documents: list[Dump], caption: str):
+    """Отправляем файлы дампа в один чат"""
+    if not documents:
+        await bot.send_message(chat_id=chat_id, text=caption)
+    elif len(documents) == 1: # В альбоме должно быть хотя бы 2 файла
+        await bot.send_document(chat_id=chat_id, document=types.InputFile(documents[0].Path), caption=caption)
+    else:
+        for start in range(0, len(documents), 10):
+            media = types.MediaGroup()
+            for dump in documents[start:start + 10]:
+                media.attach_document(types.InputFile(dump.Path), caption=caption if dump is documents[0] else None)
+            await bot.send_media_group(chat_id=chat_id, media=media)
+
+
+async def main() -> int:
+    args = parser.parse_args()
+    configs = load_config()
+    # БД всех ботов из config.json и общая БД админов. В общей БД нет ни вопросов, ни рассылок, ни пользователей, поэтому инкрементально ее не дампим
+    dbs = list(dict.fromkeys([config.MongodbName for config in configs] + ([] if args.incremental else ["support_admins"])))
+
+    started_at = time.perf_counter()
+    dumps = await backup_mongo(dbs, args.uri, args.jobs, args.incremental)
+    total = sum(dump.Size for dump in dumps)
+    print(f"Готово: {len(dumps)} из {len(dbs)} БД, {total / 1024 / 1024:.1f} МБ за {time.perf_counter() - started_at:.1f} с")
+
+    if not args.no_send and dumps:
+        storage = Storage(connect_url=args.uri, db_name=configs[0].MongodbName)
+        admins = storage.get_admins()
+        storage.client.close()
+
+        bot = Bot(configs[0].Token)
+        try:
+            await send_backup_to_admins(bot, admins, dumps, args.incremental)
+        finally:
+            await (await bot.get_session()).close()
+    return len(dbs) - len(dumps)
 
 
 if __name__ == "__main__":
-    backup_mongo()
-    send_backup_to_admins()
+    sys.exit(1 if asyncio.run(main()) else 0)
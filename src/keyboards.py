@@ -1,6 +1,11 @@
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+from functools import cache
 from tools import  NUMBERS_EMOGIES
-from models import PreparedQuestion, CategoryKeyboard
+from models import PreparedQuestion, CategoryKeyboard, MailingJob, InboxPage, SearchPage
+from catalog import PreparedCatalog
+
+# Фильтр непрочитанных сообщений по возрасту: сколько дней назад задан вопрос (0 - любые)
+INBOX_AGES = (0, 1, 3, 7)
 
 
 def get_users_menu(categories: list[str]) -> ReplyKeyboardMarkup:
@@ -12,6 +17,7 @@ def get_users_menu(categories: list[str]) -> ReplyKeyboardMarkup:
         menu.add(btn)
     return menu
 
+@cache
 def get_admin_menu() -> ReplyKeyboardMarkup:
     """Возвращает админам главное меню - в данном случае функции для рассылок, статистики и просмотра непрочитанных сообщений"""
 
@@ -20,7 +26,9 @@ def get_admin_menu() -> ReplyKeyboardMarkup:
         "Сделать рассылку",
         "Рассылка с картинкой",
         "Статистика",
-        "Непрочитанные сообщения"
+        "Непрочитанные сообщения",
+        "Рассылки",
+        "Поиск по обращениям"
     )
     for i in text_list:
         btn = KeyboardButton(text=i)
@@ -47,6 +55,44 @@ def get_keyboard_by_category(questions: list[PreparedQuestion]) -> CategoryKeybo
         Keyboard=menu
     )
 
+class KeyboardCache:
+    """
+    Заранее собранные клавиатуры пользователей: главное меню и клавиатура (вместе с текстом) для каждой категории.\n
+    Клавиатуры собираются один раз при запуске и пересобираются только тогда, когда поменялась версия каталога
+    подготовленных вопросов (например, после /reload).
+    """
+    def __init__(self, catalog: PreparedCatalog):
+        self.catalog = catalog
+        self._version: int | None = None
+        self._users_menu: ReplyKeyboardMarkup | None = None
+        self._categories: dict[str, CategoryKeyboard | None] = {}
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        """Собираем все клавиатуры для текущей версии каталога"""
+        snapshot = self.catalog.snapshot # Одна версия каталога на всю сборку, даже если в это время идет reload
+        self._users_menu = get_users_menu(snapshot.Categories)
+        self._categories = {
+            category.lower(): get_keyboard_by_category(questions)
+            for category in snapshot.Categories
+            if (questions := snapshot.ByCategory.get(category.lower()))
+        }
+        self._version = snapshot.Version
+
+    def _check_version(self) -> None:
+        if self._version != self.catalog.version:
+            self.rebuild()
+
+    def get_users_menu(self) -> ReplyKeyboardMarkup:
+        """Главное меню пользователя"""
+        self._check_version()
+        return self._users_menu
+
+    def get_keyboard_by_category(self, category: str) -> CategoryKeyboard | None:
+        """Клавиатура с текстом для категории. Вернет None, если категории нет или это категория "другое" """
+        self._check_version()
+        return self._categories.get(category.lower())
+
 def get_rate_answer_keyboard(question_id: int) -> InlineKeyboardMarkup:
     """Возвращаем клавиатуру для оценки ответа"""
 
@@ -59,6 +105,14 @@ def get_rate_answer_keyboard(question_id: int) -> InlineKeyboardMarkup:
     menu.insert(continue_btn)
     return menu
 
+def get_suggest_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура под предложенным готовым ответом: помог ли он или вопрос нужно передать админу"""
+
+    menu = InlineKeyboardMarkup(row_width=1)
+    menu.insert(InlineKeyboardButton(text="✅ Да, это помогло", callback_data="suggest_ok"))
+    menu.insert(InlineKeyboardButton(text="🗣️ Нет, передать администратору", callback_data="suggest_escalate"))
+    return menu
+
 def get_mailing_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для редактирования рассылки"""
 
@@ -78,3 +132,73 @@ def get_mailing_img_keyboard() -> InlineKeyboardMarkup:
     menu.insert(cancel)
     menu.insert(send)
     return menu
+
+def get_mailing_job_keyboard(job: MailingJob) -> InlineKeyboardMarkup | None:
+    """Клавиатура управления рассылкой. Для завершенных и отмененных рассылок кнопок нет"""
+
+    buttons = []
+    match job.Status:
+        case "pending" | "running":
+            buttons.append(InlineKeyboardButton(text="⏸ Пауза", callback_data=f"job_pause_{job.Id}"))
+        case "paused":
+            buttons.append(InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"job_resume_{job.Id}"))
+        case _:
+            return None
+    buttons.append(InlineKeyboardButton(text="⛔ Отменить", callback_data=f"job_cancel_{job.Id}"))
+    buttons.append(InlineKeyboardButton(text="🔄 Обновить", callback_data=f"job_refresh_{job.Id}"))
+
+    menu = InlineKeyboardMarkup(row_width=2)
+    for btn in buttons:
+        menu.insert(btn)
+    return menu
+
+def get_inbox_keyboard(page: InboxPage, categories: list[str], category: int, age: int) -> InlineKeyboardMarkup:
+    """
+    Клавиатура страницы непрочитанных сообщений: кнопки сообщений, листание страниц и фильтры.\n
+    callback_data имеет вид inbox_{действие}_{id}_{номер категории}_{номер возраста}, так фильтры переживают листание,
+    а в 64 байта callback_data помещается даже длинная категория, т.к. передается только ее номер (0 - все категории)
+    """
+
+    menu = InlineKeyboardMarkup(row_width=5)
+    for qst in page.Questions:
+        # Нажатие присылает сообщение отдельно, чтобы на него можно было ответить реплаем
+        menu.insert(InlineKeyboardButton(text=f"№{qst.Id}", callback_data=f"inbox_open_{qst.Id}_{category}_{age}"))
+
+    navigation = []
+    if page.HasPrev and page.Questions:
+        navigation.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"inbox_prev_{page.Questions[0].Id}_{category}_{age}"))
+    if page.HasNext and page.Questions:
+        navigation.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"inbox_next_{page.Questions[-1].Id}_{category}_{age}"))
+    if navigation:
+        menu.row(*navigation)
+
+    # Фильтры переключаются по кругу и открывают первую страницу
+    next_category = (category + 1) % (len(categories) + 1)
+    next_age = (age + 1) % len(INBOX_AGES)
+    category_text = categories[category - 1] if category else "все категории"
+    age_text = f"старше {INBOX_AGES[age]} дн." if INBOX_AGES[age] else "любой давности"
+    menu.row(
+        InlineKeyboardButton(text=f"🏷️ {category_text}", callback_data=f"inbox_next_0_{next_category}_{age}"),
+        InlineKeyboardButton(text=f"📅 {age_text}", callback_data=f"inbox_next_0_{category}_{next_age}"),
+    )
+    return menu
+
+def get_search_keyboard(page: SearchPage) -> InlineKeyboardMarkup:
+    """
+    Клавиатура страницы поиска: кнопки найденных обращений и листание страниц.
+    Сам запрос в callback_data не передается (он может не поместиться в 64 байта), хендлер берет его из текста сообщения
+    """
+
+    menu = InlineKeyboardMarkup(row_width=5)
+    for hit in page.Hits:
+        # Та же кнопка, что и в непрочитанных: присылает обращение целиком, чтобы на него можно было ответить реплаем
+        menu.insert(InlineKeyboardButton(text=f"№{hit.Id}", callback_data=f"inbox_open_{hit.Id}_0_0"))
+
+    navigation = []
+    if page.Page > 0:
+        navigation.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"search_{page.Page - 1}"))
+    if page.HasNext:
+        navigation.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"search_{page.Page + 1}"))
+    if navigation:
+        menu.row(*navigation)
+    return menu
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import uuid
+
+from aiogram import Bot
+
+from broadcast import Broadcaster
+from db import AsyncStorage
+from models import MailingJob
+
+log = logging.getLogger(__name__)
+
+
+class MailingWorker:
+    """
+    Фоновый воркер, который выполняет задачи рассылок из коллекции mailing.\n
+    Получатели берутся пачками по batch_size в порядке возрастания id. После каждой пачки прогресс сохраняется в БД,
+    поэтому после перезапуска бота рассылка продолжится с того места, где остановилась (повторно получит сообщение максимум одна пачка).
+    Между пачками воркер проверяет статус задачи, так админ может поставить рассылку на паузу или отменить ее
+    """
+    def __init__(self, bot: Bot, storage: AsyncStorage, broadcaster: Broadcaster,
+                 batch_size: int = 500, poll_interval: float = 10, lease: float = 120):
+        self.bot = bot
+        self.storage = storage
+        self.broadcaster = broadcaster
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease # Через сколько секунд без отметок задачу может забрать другой процесс
+        self.owner = uuid.uuid4().hex
+        self._wake = asyncio.Event()
+
+    def notify(self) -> None:
+        """Будим воркер, чтобы новая рассылка началась сразу, а не через poll_interval"""
+        self._wake.set()
+
+    async def run(self):
+        """Основной цикл: забираем задачи из БД и выполняем их по одной"""
+        while True:
+            try:
+                while job := await self.storage.claim_mailing_job(self.owner, self.lease):
+                    await self.process(job)
+            except Exception:
+                log.exception("Ошибка в воркере рассылок")
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _sender(self, job: MailingJob):
+        """Корутина отправки одного сообщения рассылки"""
+        if job.FileId:
+            return lambda user: self.bot.send_photo(chat_id=user, photo=job.FileId, caption=job.Text)
+        return lambda user: self.bot.send_message(chat_id=user, text=job.Text)
+
+    async def process(self, job: MailingJob):
+        """Выполняем рассылку пачками, начиная с сохраненного курсора"""
+        send = self._sender(job)
+        cursor, delivered, failed = job.Cursor, job.Delivered, job.Failed
+        status = "running"
+        while status == "running":
+            users = await self.storage.get_users_after(cursor, self.batch_size)
+            if users:
+                result = await self.broadcaster.broadcast(users, send)
+                cursor, delivered, failed = users[-1], delivered + result.Delivered, failed + result.Failed
+
+            status = await self.storage.checkpoint_mailing_job(job.Id, self.owner, cursor, delivered, failed, done=not users)
+            if status == "done":
+                await self.bot.send_message(chat_id=job.AdminId, text=f"Рассылка завершена! Доставлено: {delivered}, не доставлено: {failed}")
@@ -1,37 +1,162 @@
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.contrib.fsm_storage.mongo import MongoStorage
+from aiogram.dispatcher.storage import BaseStorage
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.dispatcher import FSMContext
-from aiogram import Bot, executor, Dispatcher, types
-from datetime import datetime
+from aiogram import Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+from aiogram.utils.exceptions import MessageNotModified
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from motor.motor_asyncio import AsyncIOMotorClient
 import keyboards as kb
 import argparse
+import asyncio
+import logging
+import pymongo
 import re
 import os
 
-from db import Storage
-from models import Question, Answer, Mailing
+from db import Storage, AsyncStorage
+from cache import AdminRegistry, LRUCache, MemoryUserCache, MongoUserCache
+from catalog import PreparedCatalog
+from broadcast import NOTIFY_QUEUE_SIZE, AdminNotifier, Broadcaster
+from mailing import MailingWorker
+from webhook import WebhookServer
+from metrics import InstrumentedBot, MetricsMiddleware, StorageMetrics, DUPLICATE_QUESTIONS, SUGGESTIONS, serve as serve_metrics
+from throttle import ThrottlingMiddleware, CHAT_LIMIT, DUPLICATE_WINDOW, THROTTLE_WINDOW, USER_LIMIT
+import signal
+from models import Question, Answer, Mailing, MailingJob, User
 import tools
 import locale
 
+MONGO_URL = "mongodb://localhost:27017/"
+NOTIFY_DRAIN_TIMEOUT = 10 # Сколько при остановке ждать отправки уведомлений админам, секунды
+UPDATES_DRAIN_TIMEOUT = 30 # Сколько при остановке webhook-сервера ждать обработки уже принятых обновлений, секунды
+
+log = logging.getLogger(__name__)
+
 parser = argparse.ArgumentParser(
                     prog='Бот поддержки Edwica.ru',
                     description='Нужен для того, чтобы отвечать на вопросы пользователей в телеграм',
                     epilog='Text at the bottom of help')
 
-parser.add_argument("-b", "--bot", required=True, help="Выбери название бота: edwica, openedu, profinansy")
-args = parser.parse_args()
-config = [cfg for cfg in tools.load_config() if cfg.BotName == args.bot][0]
-
-locale.setlocale(locale.LC_ALL, "ru_RU") # Отображение даты на русском языке
-os.makedirs("data", exist_ok=True) # Создаем папку для хранения картинок/дампов
-
-bot = Bot(config.Token)
-dp = Dispatcher(bot, storage=MemoryStorage())
-mongoStorage = Storage(db_name=config.MongodbName, add_prepared_questions=True)
-preparedQuestions = mongoStorage.get_questions()
-UserCacheCategories = {} # Кэш для запоминания какую категорию в последний раз выбирал пользователь
-UserCacheEmails = {} # Кэш для запоминания почты пользователя, чтобы в лишний раз не лезть в БД
-UserTimedMessageCache = {} # Кэш для временных сообщений
+parser.add_argument("-b", "--bot", action="append",
+                    help="Название бота: edwica, openedu, profinansy. Можно указать несколько раз. Если не указано, то запускаются все боты из config.json")
+parser.add_argument("-m", "--mode", choices=("polling", "webhook"), default="polling",
+                    help="Как получать обновления от Telegram: long polling или webhook (нужен --webhook-url)")
+parser.add_argument("--webhook-url", help="Публичный адрес, на который Telegram будет присылать обновления, например https://bot.edwica.ru")
+parser.add_argument("--webhook-secret", help="Секрет webhook. Обязателен, если ботов обслуживают несколько процессов")
+parser.add_argument("--host", default="0.0.0.0", help="Адрес webhook-сервера")
+parser.add_argument("--port", type=int, default=8080, help="Порт webhook-сервера")
+parser.add_argument("-s", "--state", choices=("mongo", "memory"), default="mongo",
+                    help="Где хранить состояния и кэш пользователей. mongo - общий для нескольких процессов бота, memory - только в этом процессе")
+parser.add_argument("--skip-updates", action="store_true",
+                    help="В режиме polling пропустить обновления, которые пришли, пока бот был остановлен. По умолчанию они обрабатываются")
+parser.add_argument("--api-server", help="Адрес своего Bot API сервера (telegram-bot-api), например http://localhost:8081. По умолчанию api.telegram.org")
+parser.add_argument("--user-limit", type=int, default=USER_LIMIT,
+                    help=f"Сколько сообщений и нажатий на кнопки пользователь может отправить за {THROTTLE_WINDOW} секунд. 0 - без ограничения")
+parser.add_argument("--chat-limit", type=int, default=CHAT_LIMIT, help="То же для одного чата. 0 - без ограничения")
+parser.add_argument("--metrics-port", type=int, default=9108, help="Порт, на котором отдаются метрики в формате Prometheus. 0 - не отдавать")
+parser.add_argument("--metrics-host", default="127.0.0.1", help="Адрес сервера метрик")
+
+
+class SharedMongoStorage(MongoStorage):
+    """
+    Хранилище состояний FSM в БД бота на общем клиенте motor.
+    Обычный MongoStorage создает свой клиент со своим пулом соединений на каждого бота, хотя все боты процесса ходят в одну mongoDB
+    """
+    def __init__(self, client: AsyncIOMotorClient, db_name: str):
+        super().__init__(db_name=db_name)
+        self._mongo = client
+
+    async def close(self):
+        pass # Общий клиент закрывает run() после остановки всех ботов
+
+
+class SupportBot:
+    """
+    Все, что нужно для работы одного бота: свои Bot и Dispatcher, хранилище в своей БД, каталог вопросов, клавиатуры, кэши и рассылки.\n
+    Несколько SupportBot работают в одном процессе и одном event loop: у них общий клиент mongoDB, общий пул потоков
+    и общий список админов. Хендлеры общие для всех ботов, а нужный SupportBot они получают через current()
+    """
+    def __init__(self, config: tools.Config, client: pymongo.MongoClient, executor: ThreadPoolExecutor, state: str,
+                 admins: AdminRegistry | None = None, api_server: str | None = None, user_limit: int = USER_LIMIT, chat_limit: int = CHAT_LIMIT,
+                 fsm_storage: BaseStorage | None = None, notify_queue_size: int = NOTIFY_QUEUE_SIZE):
+        self.config = config
+        server = TelegramAPIServer.from_base(api_server) if api_server else TELEGRAM_PRODUCTION
+        self.bot = InstrumentedBot(config.Token, name=config.BotName, server=server) # Замеряет время запросов к Bot API
+        if fsm_storage is None:
+            fsm_storage = MongoStorage(uri=MONGO_URL, db_name=config.MongodbName) if state == "mongo" else MemoryStorage()
+        self.dp = Dispatcher(self.bot, storage=fsm_storage)
+        self.dp["app"] = self
+        self.dp.middleware.setup(MetricsMiddleware(config.BotName)) # Время работы хендлеров
+        # С --state mongo бота обслуживают несколько процессов, и профиль, закэшированный в одном, устарел бы после записи в другом
+        users_cache_size = 0 if state == "mongo" else 10_000
+        self.storage = AsyncStorage(Storage(db_name=config.MongodbName, client=client, users_cache_size=users_cache_size),
+                                    executor=executor, on_call=StorageMetrics(config.BotName))
+        self.storage.sync.prepare(add_prepared_questions=True)
+        self.catalog = PreparedCatalog(self.storage.sync) # event loop еще не обрабатывает сообщения, поэтому читаем синхронно
+        self.keyboards = kb.KeyboardCache(self.catalog) # Клавиатуры пересобираются только при изменении каталога
+        self.admins = admins or AdminRegistry(self.storage.sync) # Кэш админов, чтобы не ходить в БД на каждое сообщение
+        self.broadcaster = Broadcaster() # Рассылки с учетом лимитов Telegram
+        # Уведомления админам. Вместе с рассылками укладываемся в 30 сообщений в секунду
+        self.admin_notifier = AdminNotifier(config.BotName, self.admins, lambda admin, text: self.bot.send_message(chat_id=admin, text=text),
+                                            Broadcaster(rate=5), notify_queue_size)
+        self._worker: asyncio.Task | None = None
+        self.mailing_worker = MailingWorker(self.bot, self.storage, self.broadcaster) # Фоновое выполнение рассылок
+        if state == "mongo":
+            self.timed_messages_cache = MongoUserCache("timed_messages", ttl=48 * 3600, storage=self.storage)
+        else:
+            self.timed_messages_cache = MemoryUserCache("timed_messages", ttl=48 * 3600) # Кэш для временных сообщений (Telegram дает удалить сообщение только в течение 48 часов)
+        # Ограничение частоты подключаем после метрик: отброшенные обновления тоже учитываются во времени обработки update
+        self.dp.middleware.setup(ThrottlingMiddleware(config.BotName, self.admins, user_limit, chat_limit))
+        self.recent_questions = LRUCache(maxsize=10_000, ttl=DUPLICATE_WINDOW) # Недавние обращения, чтобы не создавать одинаковые дважды
+        register_handlers(self.dp)
+
+    async def start(self):
+        """Запускаем воркер рассылок. Он подхватит и рассылки, которые не успели закончиться до перезапуска"""
+        self._worker = asyncio.create_task(self.mailing_worker.run())
+
+    async def run_polling(self, skip_updates: bool = False):
+        """Получаем обновления через long polling. С skip_updates сообщения, пришедшие, пока бот был остановлен, пропускаются"""
+        await self.bot.delete_webhook() # Если раньше бот работал через webhook, Telegram не отдаст обновления в polling
+        if skip_updates:
+            await self.dp.skip_updates()
+        await self.dp.start_polling()
+
+    def notify_admins(self, text: str, ignore_id: int = 0) -> bool:
+        """Отправляем сообщение всем админам, кроме ignore_id, в фоне (см. AdminNotifier). Вернет False, если уведомление отброшено"""
+        return self.admin_notifier.notify(text, ignore_id)
+
+    async def close(self, timeout: float = NOTIFY_DRAIN_TIMEOUT):
+        """Даем уведомлениям дослаться за timeout секунд, останавливаем воркер рассылок и закрываем соединения бота"""
+        await self.admin_notifier.close(timeout)
+        if self._worker:
+            self._worker.cancel()
+        await self.dp.storage.close()
+        await self.dp.storage.wait_closed()
+        await (await self.bot.get_session()).close()
+
+
+def current() -> SupportBot:
+    """SupportBot, который сейчас обрабатывает обновление"""
+    return Dispatcher.get_current()["app"]
+
+
+INBOX_PAGE_SIZE = 5 # Сколько непрочитанных сообщений показывать на одной странице
+INBOX_QUESTION_LENGTH = 300 # До скольких символов обрезать вопрос на странице, чтобы страница поместилась в одно сообщение
+
+SEARCH_PAGE_SIZE = 5 # Сколько найденных обращений показывать на одной странице
+SEARCH_HEADER = "🔎 Поиск: " # Первая строка страницы поиска. По ней при листании восстанавливается запрос
+
+MAILING_STATUSES = {
+    "pending": "⏳ ожидает запуска",
+    "running": "▶️ идет",
+    "paused": "⏸ на паузе",
+    "cancelled": "⛔ отменена",
+    "done": "✅ завершена",
+}
 
 
 class UserQuestion(StatesGroup):
@@ -44,24 +169,36 @@ class AdminMailing(StatesGroup):
     New = State()
     Image = State()
 
+class AdminSearch(StatesGroup):
+    """Машина состояний для поиска по обращениям"""
+    Query = State()
+
 
-@dp.message_handler(commands=["start"])
 async def start_command(msg: types.Message):
     """Админу показываем одни кнопки, а пользователю другие"""
-    user_text = f"""Привет, {msg.from_user.first_name}!👋\n{config.StartMessage}"""
+    app = current()
+    user_text = f"""Привет, {msg.from_user.first_name}!👋\n{app.config.StartMessage}"""
 
     user_id = msg.from_user.id
-    if user_id in mongoStorage.get_admins():
+    if user_id in app.admins:
         await msg.answer(text="Приветственное сообщение для админа", reply_markup=kb.get_admin_menu())
     else:
-        categories = mongoStorage.get_categories()
-        await msg.answer(text=user_text, reply_markup=kb.get_users_menu(categories))
+        await msg.answer(text=user_text, reply_markup=app.keyboards.get_users_menu())
+
+
+async def reload_catalog(msg: types.Message):
+    """Админ может перечитать подготовленные вопросы из БД без перезапуска бота"""
+    app = current()
+    if msg.from_user.id not in app.admins:
+        return
+    await asyncio.to_thread(app.catalog.reload)
+    await msg.answer(f"Подготовленные вопросы обновлены. Категорий: {len(app.catalog.categories)}")
 
 
-@dp.message_handler()
 async def text_message_filter(msg: types.Message):
     """Фильтр текстовых сообщений. В зависимости от того прислал сообщение админ или пользователь, будут применяться разные фильтры"""
-    if msg.from_user.id in mongoStorage.get_admins():
+    app = current()
+    if msg.from_user.id in app.admins:
         await admin_message_filter(msg)
     else:
         await user_message_filter(msg)
@@ -80,61 +217,63 @@ async def user_message_filter(msg: types.Message):
 
 async def check_message_is_category(msg: types.Message) -> bool:
     """Проверяем, что введеное сообщение - это категория"""
-    if msg.text.lower() in (i.lower() for i in mongoStorage.get_categories()):
-        # Кидаем в кэш, выбранную категорию - это нам пригодится, если пользователь
+    app = current()
+    if app.catalog.is_category(msg.text):
+        # Запоминаем в профиле выбранную категорию - это нам пригодится, если пользователь
         # часто будет задавать вопрос, нажимая на кнопку "задать вопрос", т.е продолжить разговор после ответа админа
-        UserCacheCategories[msg.from_user.id] = msg.text.lower()
+        await app.storage.update_user(msg.from_user.id, last_category=msg.text.lower())
         return True
     return False
 
 async def show_questions_by_category(msg: types.Message):
     """Показываем клавиатуру с вопросами по выбранной категории"""
-    category = UserCacheCategories[msg.from_user.id]
+    app = current()
+    category = msg.text.lower() # Категорию только что проверили в check_message_is_category
     if category == "другое":
         await detect_user_email(msg.from_user.id, msg.chat.id)
         return
 
-    questions = mongoStorage.get_questions_by_category(category)
-    category_keyboard = kb.get_keyboard_by_category(questions)
+    category_keyboard = app.keyboards.get_keyboard_by_category(category)
     if not category_keyboard: # Делаем на всякий случай проверку, нашлась ли клавиатура
         return
     await msg.answer(text=category_keyboard.Text, reply_markup=category_keyboard.Keyboard)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("question_"))
 async def callback_question(call: types.CallbackQuery):
     """Реакция на inline-кнопку с названием подготовленного вопроса:
     по callback_data нужный вопрос и отправим его ответ"""
+    app = current()
     if call.message.text.lower() == "другое":
         await detect_user_email(call.from_user.id, call.message.chat.id)
         return
 
-    for qst in preparedQuestions:
-        if qst.CallbackData == call.data:
-            await bot.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
-            await bot.send_message(chat_id=call.message.chat.id, text=qst.Answer)
-            break
+    qst = app.catalog.get_question_by_callback(call.data)
+    if qst:
+        await app.bot.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
+        await app.bot.send_message(chat_id=call.message.chat.id, text=qst.Answer)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("other_"))
 async def callback_other(call: types.CallbackQuery):
     """Реакция на кнопки с текстом "другое" """
-    await bot.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
+    app = current()
+    await app.bot.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
     await detect_user_email(call.from_user.id, call.message.chat.id)
 
 async def detect_user_email(user_id: int, chat_id: int):
     """Если пользователь хочет написать хоть что-то, что не является категорий подготовленных вопросов,
     то мы должны проверить вводил ли он свою почту раньше. Если нет, то просим ввести. Почта должна пройти валидацию регуляркой
     Если пользователь уже вводил почту, то включаем режим прослушивания вопроса"""
+    app = current()
 
-    if not mongoStorage.get_user_email(user_id):
-        await bot.send_message(chat_id=chat_id, text="Для быстрой помощи, напишите, пожалуйста, почту, использованную при регистрации 📧👍")
+    if not await app.storage.get_user_email(user_id):
+        await app.bot.send_message(chat_id=chat_id, text="Для быстрой помощи, напишите, пожалуйста, почту, использованную при регистрации 📧👍")
         await UserQuestion.Email.set()
     else:
-        await bot.send_message(chat_id=chat_id, text="Опишите вашу проблему:")
+        await app.bot.send_message(chat_id=chat_id, text="Опишите вашу проблему:")
         await UserQuestion.New.set()
 
-@dp.message_handler(state=UserQuestion.New)
 async def process_new_user_question(msg: types.Message, state: FSMContext):
-    """Здесь мы обрабатываем вопрос пользователя, которого нет среди подготовленных"""
+    """Здесь мы обрабатываем вопрос пользователя, которого нет среди подготовленных.
+    Если вопрос похож на подготовленный, сначала предлагаем готовый ответ, а обращение создаем, только если он не помог"""
+    app = current()
     await state.finish()
 
     # Если пользователь ввел категорию, то выключаем машину состояний и показываем ему вопросы по категории
@@ -144,88 +283,131 @@ async def process_new_user_question(msg: types.Message, state: FSMContext):
 
     # Проверяем все ли хорошо с почтой
     user_id = msg.from_user.id
-    if user_id in UserCacheEmails:
-        email = UserCacheEmails[user_id]
-    else:
-        email = mongoStorage.get_user_email(user_id)
-        if not email:
-            await detect_user_email(user_id, msg.chat.id)
-            return
+    user = await app.storage.get_user(user_id)
+    if not user or not user.Email:
+        await detect_user_email(user_id, msg.chat.id)
+        return
+
+    suggestion = app.catalog.suggest(msg.text)
+    if suggestion:
+        qst, _ = suggestion
+        SUGGESTIONS.labels(app.config.BotName, "offered").inc()
+        # Отвечаем реплаем на вопрос пользователя: если ответ не поможет, текст вопроса возьмем из reply_to_message
+        await msg.reply(f"Возможно, вот ответ на ваш вопрос:\n\n{qst.Answer}\n\nЭто помогло?", reply_markup=kb.get_suggest_keyboard())
+        return
+
+    await create_user_question(msg.from_user, msg.chat.id, msg.text, user)
 
+async def create_user_question(from_user: types.User, chat_id: int, text: str, user: User):
+    """Сохраняем вопрос пользователя и оповещаем админов. user - профиль пользователя с уже проверенной почтой.
+    Если пользователь недавно уже отправил такой же вопрос (например, несколько раз нажал Enter), новое обращение не создаем"""
+    app = current()
+    key = (from_user.id, " ".join(text.lower().split()))
+    if key in app.recent_questions:
+        DUPLICATE_QUESTIONS.labels(app.config.BotName).inc()
+        await app.bot.send_message(chat_id=chat_id, text="Этот вопрос уже отправлен администратору. Ответ придет в чат")
+        return
+    app.recent_questions.set(key, True) # Запоминаем до сохранения, чтобы одновременные дубли тоже не прошли
     question = Question(
         Id=0,
-        FirstName=msg.from_user.first_name,
-        UserId=user_id,
-        UserName=msg.from_user.username,
-        Question=msg.text,
-        Category=UserCacheCategories[user_id] if user_id in UserCacheCategories else "другое",
-        Email=email,
+        FirstName=from_user.first_name,
+        UserId=from_user.id,
+        UserName=from_user.username,
+        Question=text,
+        Category=user.LastCategory or "другое",
+        Email=user.Email,
         Date=datetime.now()
 
     )
-    question_id = mongoStorage.save_new_question(question)
+    try:
+        question_id = await app.storage.save_new_question(question)
+    except Exception:
+        app.recent_questions.pop(key) # Вопрос не сохранился - пользователь должен иметь возможность отправить его снова
+        raise
     # timed_message - нужен для того, чтобы удалить сообщение после ответа администратора.
-    timed_message = await msg.answer("Ваш запрос отправлен администратору и будет рассмотрен в ближайшее время. Ответ придет в чат. Спасибо за обращение!")
-    UserTimedMessageCache[msg.from_user.id] = timed_message.message_id
+    timed_message = await app.bot.send_message(chat_id=chat_id, text="Ваш запрос отправлен администратору и будет рассмотрен в ближайшее время. Ответ придет в чат. Спасибо за обращение!")
+    await app.timed_messages_cache.set(from_user.id, timed_message.message_id)
 
     # Отправляем всем админам оповещение о новом вопросе
     await send_new_question_to_admins(question_id, question)
 
-@dp.message_handler(state=UserQuestion.Email)
+async def suggest_callback(call: types.CallbackQuery):
+    """Пользователь ответил, помог ли предложенный готовый ответ. Если нет - создаем обращение из вопроса, на который был дан ответ"""
+    app = current()
+    await app.bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
+    if call.data == "suggest_ok":
+        SUGGESTIONS.labels(app.config.BotName, "helped").inc()
+        await app.bot.send_message(chat_id=call.message.chat.id, text="Рады, что смогли помочь! 🎉")
+        return
+
+    question = call.message.reply_to_message
+    if not question or not question.text: # Сообщение пользователя удалено - просим написать вопрос еще раз
+        await app.bot.send_message(chat_id=call.message.chat.id, text="Опишите вашу проблему:")
+        await UserQuestion.New.set()
+        return
+    user = await app.storage.get_user(call.from_user.id)
+    if not user or not user.Email:
+        await detect_user_email(call.from_user.id, call.message.chat.id)
+        return
+    SUGGESTIONS.labels(app.config.BotName, "escalated").inc()
+    await create_user_question(call.from_user, call.message.chat.id, question.text, user)
+
 async def get_new_email_from_user(msg: types.Message, state: FSMContext):
     """Если пользователь ввел неправильную почту, то программа попросит ввести почту заново.
     И НЕ ОСТАНОВИТСЯ ПОКА НЕ ПОЛУЧИТ НОРМ ПОЧТУ"""
+    app = current()
     if not tools.validate_email(msg.text):
-        await bot.send_message(chat_id=msg.chat.id, text=f"Почта [{msg.text}] не прошла валидацию. Попробуйте снова внимательно ввести вашу почту без ничего лишнего")
+        await app.bot.send_message(chat_id=msg.chat.id, text=f"Почта [{msg.text}] не прошла валидацию. Попробуйте снова внимательно ввести вашу почту без ничего лишнего")
         await UserQuestion.Email.set()
         return
 
-    UserCacheEmails[msg.from_user.id] = msg.text
-    await bot.send_message(chat_id=msg.chat.id, text="Опишите вашу проблему:")
+    await app.storage.update_user(msg.from_user.id, email=msg.text, user_name=msg.from_user.username, first_name=msg.from_user.first_name)
+    await app.bot.send_message(chat_id=msg.chat.id, text="Опишите вашу проблему:")
     # Теперь, после того, как мы получили сообщение, можно узнать о проблеме пользователя
     await UserQuestion.New.set()
 
 async def send_answer_to_user(question_id: int):
     """Отправляем ответ пользователю"""
+    app = current()
 
     # Проверяем, что вопрос закрыт
-    answer = mongoStorage.get_answer(question_id)
+    answer = await app.storage.get_answer(question_id)
     if not answer:
         return
 
     # Если мы ранее сохраняли в кэш сообщение типа: "админ скоро вам ответит", то удаляем его из чата
-    if answer.UserId in UserTimedMessageCache:
-        await bot.delete_message(chat_id=answer.UserId, message_id=UserTimedMessageCache[answer.UserId])
-        del UserTimedMessageCache[answer.UserId] # В кэше сообщение нам тоже больше не нужно
+    timed_message_id = await app.timed_messages_cache.pop(answer.UserId) # В кэше сообщение нам тоже больше не нужно
+    if timed_message_id:
+        await app.bot.delete_message(chat_id=answer.UserId, message_id=timed_message_id)
 
     msg = f"{answer.UserName}, мы обработали ваш запрос: {answer.Question}\nГотовы предоставить ответ: {answer.Text}."
-    await bot.send_message(chat_id=answer.UserId, text=msg, reply_markup=kb.get_rate_answer_keyboard(question_id))
+    await app.bot.send_message(chat_id=answer.UserId, text=msg, reply_markup=kb.get_rate_answer_keyboard(question_id))
 
 
-@dp.callback_query_handler(lambda c: "like" in c.data)
 async def rate_answer(call: types.CallbackQuery):
     """Решаем че нам делать с оценкой пользователя. Если она хорошая, то ставим лайк админу,
     если плохая, то спрашиваем че случилось и ставим админу дизлайк"""
+    app = current()
     rate, question_id = call.data.split("_") # делим по символу '_' тк нам придет такая строка 'dislike_1' или 'like_1214'
     if rate == "like":
-        mongoStorage.mark_answer_as_correct(int(question_id))
-        await bot.send_message(chat_id=call.message.chat.id, text="Ваша поддержка мотивирует нас становиться лучше! Спасибо! 🎉")
+        await app.storage.mark_answer_as_correct(int(question_id))
+        await app.bot.send_message(chat_id=call.message.chat.id, text="Ваша поддержка мотивирует нас становиться лучше! Спасибо! 🎉")
     else:
-        mongoStorage.mark_answer_as_correct(int(question_id), liked=False)
-        await bot.send_message(chat_id=call.message.chat.id, text="Нам жаль, что вы не довольны. Можете ли вы задать свой вопрос еще раз или уточнить, что именно вам не понравилось? 😓")
+        await app.storage.mark_answer_as_correct(int(question_id), liked=False)
+        await app.bot.send_message(chat_id=call.message.chat.id, text="Нам жаль, что вы не довольны. Можете ли вы задать свой вопрос еще раз или уточнить, что именно вам не понравилось? 😓")
         await UserQuestion.New.set() # Слушаем че не так
 
     # Удаляем клавиатуру с оценкой
-    await bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
+    await app.bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
 
 
-@dp.callback_query_handler(lambda c: c.data == "continue_chating")
 async def continue_chating(call: types.CallbackQuery):
     """Продолжение чаттинга, если ответ не понравился"""
+    app = current()
 
     # Удаляем клавиатуру с оценкой
-    await bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
-    await bot.send_message(chat_id=call.message.chat.id, text="Опишите вашу проблему:")
+    await app.bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
+    await app.bot.send_message(chat_id=call.message.chat.id, text="Опишите вашу проблему:")
     await UserQuestion.New.set()
 
 # ------------------------------------------------------admin------------------------------------------------------------------
@@ -239,6 +421,7 @@ async def admin_message_filter(msg: types.Message):
 
 async def send_new_question_to_admins(question_id: int, question: Question):
     """Отправляем новое сообщение от пользователя всем админам"""
+    app = current()
     message = "\n".join((
         f"⚠️ Новый вопрос от: @{question.UserName}",
         f"id: {question_id}",
@@ -247,19 +430,19 @@ async def send_new_question_to_admins(question_id: int, question: Question):
         f"Категория: {question.Category}",
         f"❓Вопрос: {question.Question}",
     ))
-    for admin in mongoStorage.get_admins():
-        await bot.send_message(chat_id=admin, text=message)
+    app.notify_admins(message)
 
 
 async def admin_reply_message(msg: types.Message):
     """Когда админ тегает сообщение бота, нужно получить id из этого сообщения и ответить на него"""
+    app = current()
     question_text = msg.reply_to_message.text
     try:
         question_id = int(re.findall(r"id: \d+", question_text)[0].replace("id: ", ""))
     except:
         return
 
-    closed = mongoStorage.check_question_is_closed(question_id)
+    closed = await app.storage.check_question_is_closed(question_id)
     if closed is None:
         # Проверяем был ли такой вопрос в БД
         await msg.answer("Вопрос был удален из БД")
@@ -267,13 +450,13 @@ async def admin_reply_message(msg: types.Message):
 
     if closed:
         # Проверяем отвечали ли раньше админы на это сообщение
-        answer = mongoStorage.get_answer(question_id)
+        answer = await app.storage.get_answer(question_id)
         if answer:
             await msg.answer(f"На это сообщение уже ответил: @{answer.AdminName}\nВот ответ:{answer.Text}")
         return
 
     # Отправляем наш ответ
-    mongoStorage.save_answer(Answer(
+    await app.storage.save_answer(Answer(
         Id=question_id,
         Text=msg.text,
         AdminId=msg.from_user.id,
@@ -290,8 +473,9 @@ async def admin_reply_message(msg: types.Message):
 async def send_notification_to_admins(question_id: int, ignore_id: int = 0):
     """Пишем всем админам, что другой админ ответил на какое-то сообщение
     ignore_id = это id того админа, который и придумал ответ. Ему уведомление отправлять смысла нет"""
+    app = current()
 
-    answer = mongoStorage.get_answer(question_id)
+    answer = await app.storage.get_answer(question_id)
     if not answer:
         return
 
@@ -300,9 +484,7 @@ async def send_notification_to_admins(question_id: int, ignore_id: int = 0):
         f"❔ Вопрос: {answer.Question}",
         f"📝 Ответ: {answer.Text}"
     ))
-    for admin in mongoStorage.get_admins():
-        if admin == ignore_id: continue
-        await bot.send_message(chat_id=admin, text=message)
+    app.notify_admins(message, ignore_id=ignore_id)
 
 
 async def check_message_is_admin_actions(msg: types.Message):
@@ -319,13 +501,19 @@ async def check_message_is_admin_actions(msg: types.Message):
         case "рассылка с картинкой":
             await msg.answer("Отправь картинку сразу вместе с текстом")
             await AdminMailing.Image.set()
+        case "рассылки":
+            await show_mailing_jobs(msg.chat.id)
+        case "поиск по обращениям":
+            await msg.answer("Что ищем? Например: не проходит оплата")
+            await AdminSearch.Query.set()
 
 
 
 async def show_statistic(msg: types.Message):
     """Отправляем админу запрошенную статистику"""
+    app = current()
 
-    stat = mongoStorage.get_statistics()
+    stat = await app.storage.get_rollup_statistics()
     categories_stat = "\n".join((f"{i.Category}: {i.Count}" for i in stat.CategoryStat))
     admins_stat = "\n\n".join((f"Админ: {i.UserName}\nЛайков: {i.Likes}\nДизлайков: {i.Dislikes}\nБез оценки: {i.WithoutRate}" for i in stat.AdminStat))
     message = "\n".join((
@@ -338,119 +526,355 @@ async def show_statistic(msg: types.Message):
     ))
     await msg.answer(message)
 
+def format_open_question(qst: Question) -> str:
+    """Полный текст непрочитанного сообщения. Строка "id: ..." нужна, чтобы админ мог ответить на сообщение реплаем"""
+    return "\n".join((
+        f"#️⃣ id: {qst.Id}",
+        f"👤 Имя пользователя: {qst.FirstName if qst.FirstName else qst.UserName}",
+        f"💌 Почта: {qst.Email}",
+        f"🏷️ Категория: {qst.Category}",
+        f"❓ Вопрос: {qst.Question}\n",
+        f"📅 Дата: {qst.Date.strftime('%d %B, %Y г. %H:%M')}"
+    ))
+
+async def render_inbox(after_id: int = 0, before_id: int | None = None, category: int = 0, age: int = 0) -> tuple[str, types.InlineKeyboardMarkup]:
+    """
+    Собираем страницу непрочитанных сообщений: несколько сообщений в одном тексте и клавиатуру для листания и фильтров.
+    category - номер категории в каталоге (0 - все), age - номер фильтра по возрасту из kb.INBOX_AGES
+    """
+    app = current()
+    categories = app.catalog.categories
+    if category > len(categories) or age >= len(kb.INBOX_AGES): # Каталог мог обновиться после того, как админ открыл страницу
+        category = age = 0
+    # В старых обращениях категория может быть записана не в нижнем регистре
+    category_filter = [categories[category - 1], categories[category - 1].lower()] if category else None
+    older_than = datetime.now() - timedelta(days=kb.INBOX_AGES[age]) if kb.INBOX_AGES[age] else None
+
+    page = await app.storage.get_open_requests(after_id, before_id, INBOX_PAGE_SIZE, category_filter, older_than)
+    if page.Questions:
+        items = (
+            "\n".join((
+                f"№ {qst.Id} · {qst.Date.strftime('%d %B, %Y г. %H:%M')}",
+                f"👤 {qst.FirstName if qst.FirstName else qst.UserName} · 💌 {qst.Email}",
+                f"🏷️ {qst.Category}",
+                f"❓ {qst.Question[:INBOX_QUESTION_LENGTH]}{'…' if len(qst.Question) > INBOX_QUESTION_LENGTH else ''}",
+            ))
+            for qst in page.Questions
+        )
+        text = "📥 Непрочитанные сообщения\n\n" + "\n\n".join(items) + "\n\nЧтобы ответить, откройте сообщение кнопкой с его номером"
+    else:
+        text = "Нет непрочитанных сообщений"
+    return text, kb.get_inbox_keyboard(page, categories, category, age)
+
 async def send_open_question_to_admin(chat_id: int):
-    """Отправляем непрочитанные сообщения для админа, который попросил список этих сообщений"""
+    """
+    Отправляем непрочитанные сообщения для админа, который попросил список этих сообщений.
+    Раньше каждое сообщение отправлялось отдельно, теперь это одна страница на INBOX_PAGE_SIZE сообщений с кнопками листания
+    """
+    app = current()
+    text, keyboard = await render_inbox()
+    await app.bot.send_message(chat_id=chat_id, text=text, reply_markup=keyboard)
+
+async def inbox_callback(call: types.CallbackQuery):
+    """Листание и фильтры страницы непрочитанных сообщений, а также открытие одного сообщения для ответа"""
+    app = current()
+    _, action, question_id, category, age = call.data.split("_")
+    question_id, category, age = int(question_id), int(category), int(age)
+
+    if action == "open":
+        qst = await app.storage.get_question_by_id(question_id)
+        if qst:
+            await app.bot.send_message(chat_id=call.message.chat.id, text=format_open_question(qst))
+        else:
+            await app.bot.send_message(chat_id=call.message.chat.id, text="Вопрос был удален из БД")
+        await call.answer()
+        return
 
-    questions = mongoStorage.get_open_requests()
-    if not questions:
-        await bot.send_message(chat_id=chat_id, text="Нет непрочитанных сообщений")
+    if action == "prev":
+        text, keyboard = await render_inbox(before_id=question_id, category=category, age=age)
+    else:
+        text, keyboard = await render_inbox(after_id=question_id, category=category, age=age)
+    try:
+        await app.bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id, text=text, reply_markup=keyboard)
+    except MessageNotModified: # Страница не изменилась
+        pass
+    await call.answer()
+
+async def render_search(query: str, page: int = 0) -> tuple[str, types.InlineKeyboardMarkup]:
+    """Собираем страницу результатов поиска по вопросам и ответам: самые похожие обращения сверху"""
+    app = current()
+    result = await app.storage.search_requests(query, page, SEARCH_PAGE_SIZE)
+    if not result.Hits:
+        return f"{SEARCH_HEADER}{query}\n\nНичего не найдено", kb.get_search_keyboard(result)
+
+    items = (
+        "\n".join((
+            f"№ {hit.Id} · {hit.Date.strftime('%d %B, %Y г.')} · {hit.Category}",
+            f"❓ {hit.Question[:INBOX_QUESTION_LENGTH]}",
+            f"📝 {hit.Answer[:INBOX_QUESTION_LENGTH]} (@{hit.AdminName})" if hit.Answer else "⏳ Еще без ответа",
+        ))
+        for hit in result.Hits
+    )
+    text = f"{SEARCH_HEADER}{query}\nСтраница {page + 1}\n\n" + "\n\n".join(items)
+    return text, kb.get_search_keyboard(result)
+
+async def send_search_results(msg: types.Message, query: str):
+    """Отправляем админу первую страницу результатов поиска"""
+    query = " ".join(query.split())[:200] # Запрос должен поместиться в первую строку сообщения
+    if not query:
+        await msg.answer("Напишите, что искать, например: /search не проходит оплата")
         return
+    text, keyboard = await render_search(query)
+    await msg.answer(text, reply_markup=keyboard)
 
-    for qst in questions:
-        text = "\n".join((
-                f"#️⃣ id: {qst.Id}",
-                f"👤 Имя пользователя: {qst.FirstName if qst.FirstName else qst.UserName}",
-                f"💌 Почта: {qst.Email}",
-                f"🏷️ Категория: {qst.Category}",
-                f"❓ Вопрос: {qst.Question}\n",
-                f"📅 Дата: {qst.Date.strftime('%d %B, %Y г. %H:%M')}"
-            ))
-        await bot.send_message(chat_id, text)
+async def search_command(msg: types.Message):
+    """Команда /search текст - поиск по вопросам и ответам всех обращений"""
+    app = current()
+    if msg.from_user.id not in app.admins:
+        return
+    if not msg.get_args():
+        await msg.answer("Что ищем? Например: не проходит оплата")
+        await AdminSearch.Query.set()
+        return
+    await send_search_results(msg, msg.get_args())
+
+async def process_search_query(msg: types.Message, state: FSMContext):
+    """Админ прислал текст для поиска"""
+    await state.finish()
+    await send_search_results(msg, msg.text)
+
+async def search_callback(call: types.CallbackQuery):
+    """Листание результатов поиска"""
+    app = current()
+    page = int(call.data.split("_")[1])
+    query = call.message.text.split("\n", 1)[0].removeprefix(SEARCH_HEADER)
+    text, keyboard = await render_search(query, page)
+    try:
+        await app.bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id, text=text, reply_markup=keyboard)
+    except MessageNotModified:
+        pass
+    await call.answer()
+
+def format_mailing_job(job: MailingJob) -> str:
+    """Текст с прогрессом рассылки"""
+    sent = job.Delivered + job.Failed
+    speed = ""
+    if job.StartedAt and job.UpdatedAt and job.UpdatedAt > job.StartedAt:
+        speed = f"\n⚡ Скорость: {sent / (job.UpdatedAt - job.StartedAt).total_seconds():.1f} сообщ./сек"
+    return "\n".join((
+        f"📨 Рассылка от {job.Date.strftime('%d %B, %Y г. %H:%M')} (@{job.AdminUser})",
+        f"Статус: {MAILING_STATUSES.get(job.Status, job.Status)}",
+        f"Прогресс: {sent} из {job.Total}",
+        f"✅ Доставлено: {job.Delivered}, ❌ не доставлено: {job.Failed}{speed}",
+        f"📝 {(job.Text or '')[:100]}" # В старых рассылках с картинкой без подписи текст равен None
+    ))
+
+async def show_mailing_jobs(chat_id: int):
+    """Показываем админу последние рассылки с кнопками управления"""
+    app = current()
+    jobs = await app.storage.get_mailing_jobs()
+    if not jobs:
+        await app.bot.send_message(chat_id=chat_id, text="Рассылок пока не было")
+        return
+
+    for job in jobs:
+        await app.bot.send_message(chat_id=chat_id, text=format_mailing_job(job), reply_markup=kb.get_mailing_job_keyboard(job))
+
+async def control_mailing_job(call: types.CallbackQuery):
+    """Пауза, продолжение и отмена рассылки"""
+    app = current()
+    _, action, job_id = call.data.split("_")
+    match action:
+        case "pause":
+            await app.storage.set_mailing_job_status(job_id, "paused", ("pending", "running"))
+        case "resume":
+            if await app.storage.set_mailing_job_status(job_id, "pending", ("paused",)):
+                app.mailing_worker.notify()
+        case "cancel":
+            await app.storage.set_mailing_job_status(job_id, "cancelled", ("pending", "running", "paused"))
+
+    job = await app.storage.get_mailing_job(job_id)
+    if job:
+        try:
+            await app.bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id,
+                                        text=format_mailing_job(job), reply_markup=kb.get_mailing_job_keyboard(job))
+        except MessageNotModified: # Прогресс не изменился с прошлого обновления
+            pass
+    await call.answer()
 
-@dp.message_handler(state=AdminMailing.New)
 async def new_mailing(msg: types.Message, state: FSMContext):
     """Создаем новую текстовую рассылку"""
+    app = current()
     timed_message = await msg.answer(text=msg.text, reply_markup=kb.get_mailing_keyboard())
-    UserTimedMessageCache[msg.from_user.id] = timed_message.message_id # Удалим потом это сообщение из чата
+    await app.timed_messages_cache.set(msg.from_user.id, timed_message.message_id) # Удалим потом это сообщение из чата
     await state.finish()
 
-@dp.callback_query_handler(lambda c: "mailing" in c.data)
+async def mailing_started(admin_id: int, job_id: str | None):
+    """Будим воркер рассылок и сообщаем админу, запущена ли рассылка"""
+    app = current()
+    if job_id is None:
+        await app.bot.send_message(chat_id=admin_id, text="Рассылка не запущена: пользователи из старых обращений еще не перенесены "
+                                                          "в новую БД и не получили бы ее. Нужно один раз выполнить на сервере: python rollups.py rebuild")
+        return
+    app.mailing_worker.notify()
+    await app.bot.send_message(chat_id=admin_id, text="Рассылка запущена! Прогресс можно посмотреть в меню \"Рассылки\"")
+
 async def process_mailing(call: types.CallbackQuery):
     """Реакция на кнопки под рассылкой"""
+    app = current()
     if call.data == "send_mailing":
-        for user in mongoStorage.get_all_users():
-            await bot.send_message(chat_id=user, text=call.message.text)
-
         # Удаляем клавиатуру у админа
-        await bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
-        await bot.send_message(chat_id=call.from_user.id, text="Отправлено!")
-        mongoStorage.save_mailing(Mailing(
+        await app.bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
+        job_id = await app.storage.create_mailing_job(Mailing(
             AdminId=call.from_user.id,
             AdminUser=call.from_user.username,
             Text=call.message.text,
             Date=datetime.now(),
-            Views=len(mongoStorage.get_all_users()),
+            Views=0,
             Picture=""
         ))
+        await mailing_started(call.from_user.id, job_id)
 
     # Реакция на кнопку отмены
     else:
-        await bot.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
-        await bot.send_message(chat_id=call.from_user.id, text="Рассылки не будет")
+        await app.bot.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
+        await app.bot.send_message(chat_id=call.from_user.id, text="Рассылки не будет")
 
-@dp.edited_message_handler(lambda msg: True)
 async def edit_mailing(msg: types.Message):
     """Реакция на редактирование сообщения без картинки (будет активироваться рассылка)"""
+    app = current()
+    timed_message_id = await app.timed_messages_cache.pop(msg.from_user.id)
+    if not timed_message_id:
+        return
     try:
-        await bot.delete_message(chat_id=msg.chat.id, message_id=UserTimedMessageCache[msg.from_user.id])
-        del UserTimedMessageCache[msg.from_user.id]
-    except BaseException as err:
-        # Хз че делать
-        print(err)
+        await app.bot.delete_message(chat_id=msg.chat.id, message_id=timed_message_id)
+    except Exception as err:
+        # Сообщение могли уже удалить руками или оно старше 48 часов
+        log.warning("Не удалось удалить старое сообщение рассылки %s: %s", timed_message_id, err)
         return
 
     timed_message = await msg.answer(text=msg.text, reply_markup=kb.get_mailing_keyboard())
-    UserTimedMessageCache[msg.from_user.id] = timed_message.message_id
+    await app.timed_messages_cache.set(msg.from_user.id, timed_message.message_id)
 
 
-@dp.message_handler(state=AdminMailing.Image, content_types=["photo"])
 async def img_mailing(msg: types.Message, state: FSMContext):
     """Создание рассылки с картинкой"""
+    app = current()
     timed_message = await msg.reply_photo(photo=msg.photo[-1].file_id, caption=msg.caption, reply_markup=kb.get_mailing_img_keyboard())
-    UserTimedMessageCache[msg.from_user.id] = timed_message.message_id
+    await app.timed_messages_cache.set(msg.from_user.id, timed_message.message_id)
     await state.finish()
 
-@dp.callback_query_handler(lambda c: "img" in c.data)
 async def process_img_mailing(call: types.CallbackQuery):
     """Реакция на кнопки под рассылкой с картинкой"""
+    app = current()
     if call.data == "send_img":
         # Сохраняем переданную фотку
         os.makedirs("data/imgs", exist_ok=True)
         img_path = f"data/imgs/{datetime.now()}.jpg"
         await call.message.photo[-1].download(destination_file=img_path)
 
-        for user in mongoStorage.get_all_users():
-            await bot.send_photo(chat_id=user, photo=call.message.photo[-1].file_id,  caption=call.message.caption)
-
         # Удаляем клавиатуру под рассылкой
-        await bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
-        await bot.send_message(chat_id=call.from_user.id, text="Отправлено!")
-        mongoStorage.save_mailing(Mailing(
+        await app.bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
+        job_id = await app.storage.create_mailing_job(Mailing(
             AdminId=call.from_user.id,
             AdminUser=call.from_user.username,
             Text=call.message.caption,
             Date=datetime.now(),
-            Views=len(mongoStorage.get_all_users()),
+            Views=0,
             Picture=img_path
-        ))
+        ), file_id=call.message.photo[-1].file_id)
+        await mailing_started(call.from_user.id, job_id)
     # Реакция на отмену
     else:
-        await bot.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
-        await bot.send_message(chat_id=call.from_user.id, text="Рассылки не будет")
+        await app.bot.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
+        await app.bot.send_message(chat_id=call.from_user.id, text="Рассылки не будет")
 
-@dp.edited_message_handler(lambda msg: True, content_types=["photo"])
 async def edit_img_mailing(msg: types.Message):
     """Реакция на редактирование сообщения c картинкой (будет активироваться рассылка)"""
+    app = current()
+    timed_message_id = await app.timed_messages_cache.pop(msg.from_user.id)
+    if not timed_message_id:
+        return
     try:
-        await bot.delete_message(chat_id=msg.chat.id, message_id=UserTimedMessageCache[msg.from_user.id])
-        del UserTimedMessageCache[msg.from_user.id]
-    except BaseException as err:
-        print(err)
+        await app.bot.delete_message(chat_id=msg.chat.id, message_id=timed_message_id)
+    except Exception as err:
+        log.warning("Не удалось удалить старое сообщение рассылки %s: %s", timed_message_id, err)
         return
 
     timed_message = await msg.answer_photo(photo=msg.photo[-1].file_id, caption=msg.caption, reply_markup=kb.get_mailing_img_keyboard())
-    UserTimedMessageCache[msg.from_user.id] = timed_message.message_id
+    await app.timed_messages_cache.set(msg.from_user.id, timed_message.message_id)
+
+
+def register_handlers(dp: Dispatcher):
+    """Регистрируем хендлеры в диспетчере бота. Порядок важен: aiogram проверяет хендлеры в порядке регистрации"""
+    dp.register_message_handler(start_command, commands=["start"])
+    dp.register_message_handler(reload_catalog, commands=["reload"])
+    dp.register_message_handler(search_command, commands=["search"])
+    dp.register_message_handler(process_search_query, state=AdminSearch.Query)
+    dp.register_message_handler(text_message_filter)
+    dp.register_callback_query_handler(callback_question, lambda c: c.data.startswith("question_"))
+    dp.register_callback_query_handler(callback_other, lambda c: c.data.startswith("other_"))
+    dp.register_message_handler(process_new_user_question, state=UserQuestion.New)
+    dp.register_message_handler(get_new_email_from_user, state=UserQuestion.Email)
+    dp.register_callback_query_handler(suggest_callback, lambda c: c.data.startswith("suggest_"))
+    dp.register_callback_query_handler(rate_answer, lambda c: "like" in c.data)
+    dp.register_callback_query_handler(continue_chating, lambda c: c.data == "continue_chating")
+    dp.register_callback_query_handler(control_mailing_job, lambda c: c.data.startswith("job_"))
+    dp.register_callback_query_handler(inbox_callback, lambda c: c.data.startswith("inbox_"))
+    dp.register_callback_query_handler(search_callback, lambda c: c.data.startswith("search_"))
+    dp.register_message_handler(new_mailing, state=AdminMailing.New)
+    dp.register_callback_query_handler(process_mailing, lambda c: "mailing" in c.data)
+    dp.register_edited_message_handler(edit_mailing, lambda msg: True)
+    dp.register_message_handler(img_mailing, state=AdminMailing.Image, content_types=["photo"])
+    dp.register_callback_query_handler(process_img_mailing, lambda c: "img" in c.data)
+    dp.register_edited_message_handler(edit_img_mailing, lambda msg: True, content_types=["photo"])
+
+
+async def run(configs: list[tools.Config], args: argparse.Namespace):
+    """Запускаем всех ботов из configs в одном event loop"""
+    # По SIGTERM (например, при остановке контейнера) завершаемся так же аккуратно, как по Ctrl+C
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    client = pymongo.MongoClient(MONGO_URL)
+    fsm_client = AsyncIOMotorClient(MONGO_URL) if args.state == "mongo" else None # Состояния FSM всех ботов
+    executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="mongo")
+    apps: list[SupportBot] = []
+    for config in configs:
+        fsm_storage = SharedMongoStorage(fsm_client, config.MongodbName) if fsm_client else None
+        apps.append(SupportBot(config, client, executor, args.state, admins=apps[0].admins if apps else None,
+                               api_server=args.api_server, user_limit=args.user_limit, chat_limit=args.chat_limit,
+                               fsm_storage=fsm_storage))
+
+    if args.metrics_port:
+        serve_metrics(args.metrics_port, args.metrics_host) # GET /metrics для Prometheus
+    watcher = asyncio.create_task(apps[0].admins.watch()) # Фоновое обновление общего списка админов
+    try:
+        for app in apps:
+            await app.start()
+        if args.mode == "webhook":
+            await WebhookServer(apps, args.webhook_url, args.host, args.port, secret=args.webhook_secret,
+                                drain_timeout=UPDATES_DRAIN_TIMEOUT).run()
+        else:
+            await asyncio.gather(*(app.run_polling(args.skip_updates) for app in apps))
+    finally:
+        watcher.cancel()
+        for app in apps:
+            await app.close()
+        executor.shutdown(wait=True)
+        client.close()
+        if fsm_client:
+            fsm_client.close()
 
 
 if __name__ == "__main__":
-    executor.start_polling(dp, skip_updates=True)
+    args = parser.parse_args()
+    configs = [cfg for cfg in tools.load_config() if not args.bot or cfg.BotName in args.bot]
+    if not configs:
+        parser.error(f"В config.json нет ботов: {', '.join(args.bot)}" if args.bot else "В config.json нет ни одного бота")
+    if args.mode == "webhook" and not args.webhook_url:
+        parser.error("Для режима webhook нужен --webhook-url")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    locale.setlocale(locale.LC_ALL, "ru_RU") # Отображение даты на русском языке
+    os.makedirs("data", exist_ok=True) # Создаем папку для хранения картинок/дампов
+    asyncio.run(run(configs, args))
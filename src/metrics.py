@@ -0,0 +1,80 @@
+import time
+
+from aiogram import Bot
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from prometheus_client import Counter, Histogram, start_http_server
+
+# Границы корзин в секундах: от быстрых ответов из кэша до медленных запросов к Telegram
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HANDLER_SECONDS = Histogram("support_bot_handler_seconds", "Время работы хендлера", ("bot", "handler"), buckets=BUCKETS)
+HANDLER_ERRORS = Counter("support_bot_handler_errors_total", "Необработанные ошибки при обработке обновлений", ("bot", "error"))
+STORAGE_SECONDS = Histogram("support_bot_storage_seconds", "Время вызова метода Storage вместе с ожиданием в пуле потоков",
+                            ("bot", "method"), buckets=BUCKETS)
+STORAGE_ERRORS = Counter("support_bot_storage_errors_total", "Ошибки методов Storage", ("bot", "method", "error"))
+BOT_API_SECONDS = Histogram("support_bot_api_seconds", "Время запроса к Telegram Bot API", ("bot", "method"), buckets=BUCKETS)
+BOT_API_ERRORS = Counter("support_bot_api_errors_total", "Ошибки запросов к Telegram Bot API", ("bot", "method", "error"))
+SUGGESTIONS = Counter("support_bot_suggestions_total", "Предложенные готовые ответы: offered, helped, escalated", ("bot", "result"))
+THROTTLED = Counter("support_bot_throttled_total", "Обновления, отброшенные из-за превышения лимита частоты", ("bot", "scope"))
+ADMIN_NOTIFICATIONS = Counter("support_bot_admin_notifications_total", "Уведомления админам: queued - поставлены в очередь, "
+                              "dropped - отброшены из-за переполненной очереди", ("bot", "result"))
+DUPLICATE_QUESTIONS = Counter("support_bot_duplicate_questions_total", "Повторные одинаковые обращения, которые не стали новыми вопросами", ("bot",))
+
+
+def serve(port: int, host: str = "127.0.0.1") -> None:
+    """Запускаем HTTP-сервер с метриками в формате Prometheus (GET /metrics) в отдельном потоке"""
+    start_http_server(port, addr=host)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Middleware, которая замеряет время работы каждого хендлера.\n
+    aiogram вызывает process_* после того, как фильтры пропустили хендлер (current_handler уже известен),
+    и post_process_* после его завершения, в том числе с ошибкой. Для update хендлер - это сам Dispatcher.process_update,
+    так что метрика с handler="process_update" - это полное время обработки обновления
+    """
+    def __init__(self, bot_name: str):
+        super().__init__()
+        self.bot_name = bot_name
+
+    async def trigger(self, action: str, args):
+        data = args[-1]
+        if action.startswith("process_"):
+            handler = current_handler.get(None)
+            data["metrics_handler"] = getattr(handler, "__name__", "unknown")
+            data["metrics_started_at"] = time.perf_counter()
+        elif action.startswith("post_process_") and "metrics_started_at" in data:
+            elapsed = time.perf_counter() - data["metrics_started_at"]
+            HANDLER_SECONDS.labels(self.bot_name, data["metrics_handler"]).observe(elapsed)
+        elif action == "pre_process_error":
+            # args = (update, exception, data)
+            HANDLER_ERRORS.labels(self.bot_name, type(args[1]).__name__).inc()
+
+
+class StorageMetrics:
+    """Колбэк для AsyncStorage, который записывает время и ошибки каждого вызова Storage"""
+    def __init__(self, bot_name: str):
+        self.bot_name = bot_name
+
+    def __call__(self, method: str, seconds: float, error: BaseException | None) -> None:
+        STORAGE_SECONDS.labels(self.bot_name, method).observe(seconds)
+        if error is not None:
+            STORAGE_ERRORS.labels(self.bot_name, method, type(error).__name__).inc()
+
+
+class InstrumentedBot(Bot):
+    """Bot, который замеряет время каждого запроса к Bot API. Все методы Bot (send_message и т.д.) проходят через request"""
+    def __init__(self, token: str, name: str, **kwargs):
+        super().__init__(token, **kwargs)
+        self.metrics_name = name
+
+    async def request(self, method: str, data: dict | None = None, files: dict | None = None, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except Exception as err:
+            BOT_API_ERRORS.labels(self.metrics_name, method, type(err).__name__).inc()
+            raise
+        finally:
+            BOT_API_SECONDS.labels(self.metrics_name, method).observe(time.perf_counter() - started_at)
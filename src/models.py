@@ -1,6 +1,6 @@
 from typing import NamedTuple
 from aiogram.types import InlineKeyboardMarkup
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 
 
@@ -36,6 +36,41 @@ class Question(NamedTuple):
     Email: str
     Date: datetime
 
+class InboxPage(NamedTuple):
+    """Страница непрочитанных сообщений для админа. HasPrev и HasNext - есть ли страницы до и после этой"""
+
+    Questions: list[Question]
+    HasPrev: bool
+    HasNext: bool
+
+class SearchHit(NamedTuple):
+    """Найденное обращение. Score - релевантность из текстового индекса mongoDB"""
+
+    Id: int
+    Question: str
+    Answer: str | None
+    AdminName: str | None
+    Category: str
+    Date: datetime
+    Score: float
+
+class SearchPage(NamedTuple):
+    """Страница результатов поиска по обращениям. Page начинается с 0"""
+
+    Hits: list[SearchHit]
+    Page: int
+    HasNext: bool
+
+class User(NamedTuple):
+    """Профиль пользователя из коллекции users. Поля, которые пользователь еще не заполнил, равны None"""
+
+    Id: int
+    UserName: str | None
+    FirstName: str | None
+    Email: str | None
+    LastCategory: str | None
+    LastSeen: datetime | None
+
 class Mailing(NamedTuple):
     """Структура рассылки. Поле picture может быть опущено. """
 
@@ -46,6 +81,27 @@ class Mailing(NamedTuple):
     Views: int
     Picture: str
 
+class MailingJob(NamedTuple):
+    """
+    Структура задачи рассылки, которая хранится в коллекции mailing.\n
+    Cursor - id последнего пользователя, которому рассылка уже ушла. С него рассылка продолжится после перезапуска бота.
+    Status: pending, running, paused, cancelled, done
+    """
+
+    Id: str
+    AdminId: int
+    AdminUser: str
+    Text: str
+    FileId: str
+    Status: str
+    Cursor: int
+    Delivered: int
+    Failed: int
+    Total: int
+    Date: datetime
+    StartedAt: datetime | None
+    UpdatedAt: datetime | None
+
 
 class Answer(NamedTuple):
     """Структура ответа администратора"""
@@ -81,3 +137,22 @@ class Statistic(NamedTuple):
     OpenedCount: int
     CategoryStat: list[CategoryStat]
     AdminStat: list[AdminStat]
+
+@dataclass(slots=True)
+class BroadcastResult:
+    """Итог рассылки: сколько сообщений доставлено, сколько нет и почему"""
+
+    Delivered: int = 0
+    Failed: int = 0
+    Retries: int = 0
+    Errors: dict[int, str] = field(default_factory=dict) # chat_id -> название ошибки, из-за которой сообщение не доставлено
+
+@dataclass(slots=True)
+class CacheStats:
+    """Счетчики кэша: попадания, промахи, вытеснения из-за переполнения и удаления по сроку жизни"""
+
+    Hits: int
+    Misses: int
+    Evictions: int
+    Expired: int
+    Size: int
@@ -0,0 +1,106 @@
+import argparse
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+from db import Storage, BACKUP_COLLECTIONS
+from dump_mongo import ARCHIVE_SUFFIX, DELTA_SUFFIX, DUMPS_PATH, FOLDER_FORMAT, MONGO_URL, read_delta
+from tools import load_config
+
+parser = argparse.ArgumentParser(
+                    prog='Восстановление бота поддержки',
+                    description='Восстанавливает БД бота из полного дампа dump_mongo.py и всех инкрементальных дампов после него')
+
+parser.add_argument("-b", "--bot", required=True, help="Название бота из config.json")
+parser.add_argument("--uri", default=MONGO_URL, help="Адрес mongoDB")
+parser.add_argument("--full", help="Папка полного дампа в data/dumps. По умолчанию - последний полный дамп")
+parser.add_argument("--target-db", help="В какую БД восстанавливать. По умолчанию - в БД бота (она будет перезаписана!)")
+parser.add_argument("--verify", action="store_true",
+                    help="После восстановления сравнить вопросы, рассылки и пользователей с БД бота. Имеет смысл вместе с --target-db")
+
+
+def list_dumps(db: str) -> list[tuple[datetime, str, str]]:
+    """Все дампы БД {db} по возрастанию даты: (дата, папка, файл). Файл - полный архив или файл с изменениями"""
+    dumps = []
+    if not os.path.isdir(DUMPS_PATH):
+        return dumps
+    for folder in os.listdir(DUMPS_PATH):
+        try:
+            date = datetime.strptime(folder, FOLDER_FORMAT)
+        except ValueError:
+            continue
+        for suffix in (ARCHIVE_SUFFIX, DELTA_SUFFIX):
+            path = os.path.join(DUMPS_PATH, folder, f"{db}{suffix}")
+            if os.path.exists(path):
+                dumps.append((date, folder, path))
+    return sorted(dumps)
+
+
+def restore(db: str, target: str, uri: str, full: str | None) -> Storage:
+    """Восстанавливаем полный дамп через mongorestore и по порядку применяем все изменения, записанные после него"""
+    dumps = list_dumps(db)
+    fulls = [dump for dump in dumps if dump[2].endswith(ARCHIVE_SUFFIX) and (full is None or dump[1] == full)]
+    if not fulls:
+        raise SystemExit(f"Не найден полный дамп БД {db} в {DUMPS_PATH}")
+    full_date, full_folder, full_path = fulls[-1]
+
+    print(f"[{target}] Полный дамп {full_folder}")
+    subprocess.run([
+        "mongorestore", f"--uri={uri}", f"--archive={full_path}", "--gzip", "--drop",
+        f"--nsInclude={db}.*", f"--nsFrom={db}.*", f"--nsTo={target}.*"
+    ], check=True)
+
+    storage = Storage(connect_url=uri, db_name=target)
+    for date, folder, path in dumps:
+        if date > full_date and path.endswith(DELTA_SUFFIX):
+            print(f"[{target}] Изменения {folder}: {storage.apply_changes(read_delta(path))} документов")
+
+    # Профили пользователей восстановлены из дампов. rebuild_users не трогает их и только добавляет тех, кто есть лишь в requests.
+    # Статистика и счетчик id выводятся из requests, поэтому пересчитываем их после изменений
+    storage.rebuild_users_and_rollups()
+    storage.init_counter("requests", storage.questions_cl)
+    return storage
+
+
+def verify(source: Storage, restored: Storage) -> list[str]:
+    """Сравниваем вопросы, рассылки и пользователей восстановленной БД с исходной. Вернет список расхождений"""
+    problems = []
+    for name, collection in BACKUP_COLLECTIONS.items():
+        source_docs = {doc["_id"]: doc for doc in getattr(source, collection).find()}
+        restored_docs = {doc["_id"]: doc for doc in getattr(restored, collection).find()}
+        missing = source_docs.keys() - restored_docs.keys()
+        extra = restored_docs.keys() - source_docs.keys()
+        changed = [key for key in source_docs.keys() & restored_docs.keys() if source_docs[key] != restored_docs[key]]
+        if missing:
+            problems.append(f"{name}: нет {len(missing)} документов, например {next(iter(missing))}")
+        if extra:
+            problems.append(f"{name}: лишние {len(extra)} документов, например {next(iter(extra))}")
+        if changed:
+            problems.append(f"{name}: отличаются {len(changed)} документов, например {changed[0]}")
+    return problems
+
+
+def main() -> int:
+    args = parser.parse_args()
+    configs = [config for config in load_config() if config.BotName == args.bot]
+    if not configs:
+        parser.error(f"В config.json нет бота {args.bot}")
+    db = configs[0].MongodbName
+    target = args.target_db or db
+
+    restored = restore(db, target, args.uri, args.full)
+    problems = []
+    if args.verify:
+        source = Storage(connect_url=args.uri, db_name=db)
+        problems = verify(source, restored)
+        for problem in problems:
+            print(f"[{target}] {problem}")
+        if not problems:
+            print(f"[{target}] Вопросы, рассылки и пользователи совпадают с {db}")
+    restored.client.close()
+    return len(problems)
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,34 @@
+import argparse
+import sys
+from db import Storage
+from tools import load_config
+
+parser = argparse.ArgumentParser(
+                    prog='Статистика бота поддержки',
+                    description='Заполняет пользователей (users) и статистику (stats) по requests и проверяет, что статистика сходится с requests')
+
+parser.add_argument("action", choices=("rebuild", "check"), help="rebuild - заполнить пользователей и пересчитать статистику, check - найти расхождения")
+parser.add_argument("-b", "--bot", help="Название бота. Если не указано, то для всех ботов из config.json")
+
+
+def main() -> int:
+    args = parser.parse_args()
+    problems = 0
+    for config in load_config():
+        if args.bot and config.BotName != args.bot:
+            continue
+        storage = Storage(db_name=config.MongodbName)
+        if args.action == "rebuild":
+            storage.ensure_indexes()
+            storage.rebuild_users_and_rollups()
+            print(f"[{config.BotName}] Пользователи и статистика пересчитаны")
+        else:
+            for problem in storage.check_rollups():
+                print(f"[{config.BotName}] {problem}")
+                problems += 1
+        storage.client.close()
+    return problems
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,123 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+from models import PreparedQuestion
+
+# Пороги подбираются bench/suggest_eval.py --examples на размеченных вопросах bench/suggest_examples.json
+SUGGEST_THRESHOLD = 0.5 # Минимальная косинусная близость, при которой предлагаем готовый ответ
+MIN_CONTENT_SHARE = 0.6 # Какая доля веса n-грамм значимых слов вопроса должна найтись в подготовленном вопросе
+NGRAM_SIZES = (3, 4)
+
+# Служебные слова и слова-обертки вопроса. Они совпадают у вопросов о разном ("Что такое подписка?" и "Что такое траектория?"),
+# поэтому в доле совпавших n-грамм не учитываются. В косинусной близости они остаются
+STOP_WORDS = frozenset("""
+    а без бы был была было в вам вас ваш ваша во вы где да для до добрый если есть еще же за зачем здравствуйте и из или как
+    какая какие какой когда ко ли мне меня можете можно мое мои мой моя на не нет ни но о об от по под подскажите пожалуйста
+    получается получилось почему при про с свои свой своей свою со спасибо так такое у уже хочу чем что это эта этот эти я
+""".split())
+
+_WORD = re.compile(r"\w+")
+
+
+def ngrams(text: str, sizes: tuple[int, ...] = NGRAM_SIZES, skip: frozenset[str] = frozenset()) -> Counter[str]:
+    """
+    Символьные n-граммы каждого слова вместе с пробелами по краям: "оплата" -> " оп", "опл", ..., "та ".
+    В отличие от целых слов, n-граммы совпадают у разных форм одного слова (оплата, оплатил, оплаты) и терпят опечатки.
+    Слова из skip пропускаются
+    """
+    grams: Counter[str] = Counter()
+    for word in _WORD.findall(text.lower().replace("ё", "е")):
+        if word in skip:
+            continue
+        word = f" {word} "
+        for n in sizes:
+            for i in range(len(word) - n + 1):
+                grams[word[i:i + n]] += 1
+    return grams
+
+
+class AnswerSuggester:
+    """
+    Поиск подготовленного вопроса, похожего на вопрос пользователя.\n
+    Каждый подготовленный вопрос - строка TF-IDF матрицы по символьным n-граммам, нормированная по длине.
+    Близость вопроса пользователя ко всем подготовленным - это одно умножение вектора на матрицу NumPy,
+    причем берутся только столбцы n-грамм, которые есть в вопросе, поэтому оценка занимает доли миллисекунды.\n
+    Одной близости мало: короткие вопросы с одинаковой оберткой ("Не получается найти чек" и "Не получается найти свою профессию")
+    похожи по n-граммам, хотя спрашивают о разном. Поэтому подготовленный вопрос должен еще и содержать
+    не меньше min_content_share веса n-грамм значимых слов (не из STOP_WORDS) вопроса пользователя
+    """
+    def __init__(self, questions: list[PreparedQuestion], threshold: float = SUGGEST_THRESHOLD,
+                 min_content_share: float = MIN_CONTENT_SHARE, sizes: tuple[int, ...] = NGRAM_SIZES):
+        self.questions = [qst for qst in questions if qst.Answer]
+        self.threshold = threshold
+        self.min_content_share = min_content_share
+        self.sizes = sizes
+
+        docs = [ngrams(qst.Text, sizes) for qst in self.questions]
+        self.vocab: dict[str, int] = {}
+        for doc in docs:
+            for gram in doc:
+                self.vocab.setdefault(gram, len(self.vocab))
+
+        matrix = np.zeros((len(docs), len(self.vocab)), dtype=np.float32)
+        for row, doc in enumerate(docs):
+            for gram, count in doc.items():
+                matrix[row, self.vocab[gram]] = 1 + math.log(count)
+        # Редкие n-граммы важнее частых: "опл" говорит о вопросе больше, чем " не"
+        df = np.count_nonzero(matrix, axis=0)
+        self.idf = (np.log((1 + len(docs)) / (1 + df)) + 1).astype(np.float32)
+        self.unknown_idf = math.log(1 + len(docs)) + 1 # Вес n-граммы, которой нет ни в одном подготовленном вопросе
+        matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        # Храним матрицу транспонированной: строка - n-грамма, так выборка нужных n-грамм читает память подряд
+        self._by_gram = np.ascontiguousarray((matrix / norms).T)
+
+    def scores(self, text: str) -> np.ndarray:
+        """
+        Косинусная близость text к каждому подготовленному вопросу.
+        У вопросов, в которых нашлось меньше min_content_share значимых n-грамм text, близость равна 0
+        """
+        columns, weights, unknown = [], [], 0.0
+        for gram, count in ngrams(text, self.sizes).items():
+            tf = 1 + math.log(count)
+            column = self.vocab.get(gram)
+            if column is None:
+                unknown += (tf * self.unknown_idf) ** 2
+            else:
+                columns.append(column)
+                weights.append(tf)
+        if not columns:
+            return np.zeros(len(self.questions), dtype=np.float32)
+
+        vector = np.array(weights, dtype=np.float32) * self.idf[columns]
+        # Незнакомые n-граммы не совпадают ни с одним вопросом, но учитываются в длине вектора: длинный вопрос "не о том" получит низкую оценку
+        norm = math.sqrt(float(vector @ vector) + unknown)
+        return vector @ self._by_gram[columns] / norm * (self.content_shares(text) >= self.min_content_share)
+
+    def content_shares(self, text: str) -> np.ndarray:
+        """Доля веса n-грамм значимых слов text, которые есть в каждом подготовленном вопросе. Если значимых слов нет, доля 0"""
+        columns, weights, total = [], [], 0.0
+        for gram, count in ngrams(text, self.sizes, STOP_WORDS).items():
+            column = self.vocab.get(gram)
+            weight = (1 + math.log(count)) * (self.unknown_idf if column is None else float(self.idf[column]))
+            total += weight
+            if column is not None:
+                columns.append(column)
+                weights.append(weight)
+        if not columns:
+            return np.zeros(len(self.questions), dtype=np.float32)
+        return np.array(weights, dtype=np.float32) @ (self._by_gram[columns] > 0) / total
+
+    def suggest(self, text: str) -> tuple[PreparedQuestion, float] | None:
+        """Самый похожий подготовленный вопрос и его оценка или None, если ни один не набрал threshold"""
+        if not self.questions:
+            return None
+        scores = self.scores(text)
+        best = int(scores.argmax())
+        if scores[best] < self.threshold:
+            return None
+        return self.questions[best], float(scores[best])
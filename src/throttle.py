@@ -0,0 +1,91 @@
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from cache import AdminRegistry, LRUCache
+from metrics import THROTTLED
+
+THROTTLE_WINDOW = 10 # Окно ограничения частоты, секунды
+USER_LIMIT = 20 # Сколько сообщений и нажатий на кнопки один пользователь может отправить за окно
+CHAT_LIMIT = 60 # То же для чата: в группе пишут несколько пользователей, но бот отвечает в один чат
+DUPLICATE_WINDOW = 10 * 60 # Одинаковые обращения от одного пользователя за это время считаются одним
+
+
+class SlidingWindowCounter:
+    """
+    Ограничение частоты по скользящему окну для большого числа ключей (пользователей, чатов).\n
+    Вместо времени каждого события храним на ключ всего три числа: номер текущего окна фиксированной длины,
+    количество событий в нем и в предыдущем окне. Количество событий за последние window секунд оценивается как
+    события текущего окна плюс часть предыдущего, пропорциональная тому, насколько скользящее окно еще его захватывает.
+    Ключи, по которым давно не было событий, вытесняются, поэтому память ограничена maxsize.\n
+    Вызывается только из event loop, поэтому блокировки не нужны
+    """
+    def __init__(self, limit: int, window: float = THROTTLE_WINDOW, maxsize: int = 100_000):
+        self.limit = limit
+        self.window = window
+        self.maxsize = maxsize
+        self._data: OrderedDict[Hashable, tuple[int, int, int]] = OrderedDict() # ключ -> (номер окна, в прошлом окне, в текущем)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def hit(self, key: Hashable) -> bool:
+        """Учитываем событие. Вернет False, если лимит уже исчерпан - тогда событие не учитывается"""
+        now = time.monotonic() / self.window
+        current = int(now)
+        number, previous, count = self._data.pop(key, (current, 0, 0))
+        if number != current:
+            # Прошлое окно - это текущее, если оно только что закончилось. Если с тех пор прошло больше окна, событий в нем не было
+            previous, count = (count if number == current - 1 else 0), 0
+
+        allowed = previous * (1 - (now - current)) + count < self.limit
+        if allowed:
+            count += 1
+        self._data[key] = (current, previous, count) # Свежие ключи в конце, вытесняем с начала
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        return allowed
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Middleware, которая отбрасывает сообщения и нажатия на кнопки сверх USER_LIMIT от пользователя и CHAT_LIMIT в чат за окно.
+    Отброшенное обновление не доходит до хендлеров, поэтому не стоит ни запросов в БД, ни уведомлений админам.
+    При первом превышении в окне пользователь получает одно предупреждение. Админов не ограничиваем.
+    Лимит 0 отключает соответствующее ограничение
+    """
+    def __init__(self, bot_name: str, admins: AdminRegistry, user_limit: int = USER_LIMIT, chat_limit: int = CHAT_LIMIT,
+                 window: float = THROTTLE_WINDOW):
+        super().__init__()
+        self.bot_name = bot_name
+        self.admins = admins
+        self.users = SlidingWindowCounter(user_limit, window) if user_limit else None
+        self.chats = SlidingWindowCounter(chat_limit, window) if chat_limit else None
+        self._warned = LRUCache(maxsize=10_000, ttl=window) # Кого уже предупредили в этом окне
+
+    async def on_pre_process_message(self, msg: types.Message, data: dict):
+        await self.throttle(msg.from_user.id if msg.from_user else 0, msg.chat.id, msg)
+
+    async def on_pre_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        await self.throttle(call.from_user.id, call.message.chat.id if call.message else call.from_user.id, call)
+
+    async def throttle(self, user_id: int, chat_id: int, event: types.Message | types.CallbackQuery):
+        if user_id in self.admins:
+            return
+        if self.users is not None and not self.users.hit(user_id):
+            scope = "user"
+        elif self.chats is not None and not self.chats.hit(chat_id):
+            scope = "chat"
+        else:
+            return
+
+        THROTTLED.labels(self.bot_name, scope).inc()
+        if user_id not in self._warned:
+            self._warned.set(user_id, True)
+            # Для кнопки это всплывающее уведомление, для сообщения - ответ в чат
+            await event.answer("Слишком много сообщений. Подождите немного и попробуйте снова ⏳")
+        raise CancelHandler()
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import secrets
+from typing import TYPE_CHECKING
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+if TYPE_CHECKING: # main импортирует webhook, поэтому SupportBot нужен только для аннотаций
+    from main import SupportBot
+
+log = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    """
+    aiohttp-сервер, который принимает обновления Telegram по webhook для всех ботов процесса (альтернатива long polling).\n
+    Каждый бот получает обновления на свой адрес /webhook/{имя бота}. Обновления складываются в ограниченную очередь,
+    а воркеры забирают их пачками до batch_size штук и обрабатывают диспетчером бота, каждое в своей задаче.
+    Обновление считается обработанным (task_done) только после того, как закончились все обновления его пачки.
+    Если очередь заполнена дольше put_timeout секунд, то отвечаем Telegram 503 - он повторит доставку позже, и обновление не потеряется.\n
+    При остановке сервер перестает принимать обновления и дожидается обработки всех, что уже в очереди, но не дольше
+    drain_timeout секунд: хендлер, зависший на Telegram или mongoDB, не должен навсегда блокировать остановку
+    """
+    def __init__(self, apps: list["SupportBot"], base_url: str, host: str = "0.0.0.0", port: int = 8080,
+                 queue_size: int = 1000, workers: int = 8, batch_size: int = 20, put_timeout: float = 5, secret: str | None = None,
+                 drain_timeout: float = 30):
+        self.apps = {app.config.BotName: app for app in apps}
+        self.base_url = base_url.rstrip("/")
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self.drain_timeout = drain_timeout
+        # Telegram присылает секрет в заголовке, так мы отличаем настоящие запросы от чужих.
+        # Если процессов несколько, у всех должен быть один и тот же секрет
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.queues = {name: asyncio.Queue(maxsize=queue_size) for name in self.apps}
+        self.processing = {name: 0 for name in self.apps} # Сколько обновлений воркеры забрали из очереди, но еще не обработали
+        self._accepting = False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Принимаем обновление от Telegram и кладем его в очередь бота"""
+        name = request.match_info["bot"]
+        if name not in self.apps:
+            return web.Response(status=404)
+        if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret:
+            return web.Response(status=403)
+        if not self._accepting:
+            return web.Response(status=503)
+
+        update = types.Update(**await request.json())
+        try:
+            await asyncio.wait_for(self.queues[name].put(update), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            log.warning("Очередь обновлений бота %s переполнена", name)
+            return web.Response(status=503)
+        return web.Response()
+
+    async def worker(self, name: str):
+        """Обрабатываем обновления бота {name} пачками"""
+        app, queue = self.apps[name], self.queues[name]
+        # Хендлеры получают бота через Dispatcher.get_current(), поэтому выставляем контекст для этой задачи
+        Bot.set_current(app.bot)
+        Dispatcher.set_current(app.dp)
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            self.processing[name] += len(batch)
+            try:
+                # Ошибка в одном обновлении не отменяет остальные, и мы дожидаемся их всех, прежде чем отметить пачку.
+                # Как и Dispatcher.process_updates, идем через updates_handler, чтобы сработали middleware уровня update
+                results = await asyncio.gather(*(app.dp.updates_handler.notify(update) for update in batch), return_exceptions=True)
+                for update, result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        log.error("Ошибка при обработке обновления %s бота %s", update.update_id, name, exc_info=result)
+            finally:
+                self.processing[name] -= len(batch)
+                for _ in batch:
+                    queue.task_done()
+
+    async def run(self):
+        """Запускаем сервер и регистрируем webhook у всех ботов. Работает, пока задачу не отменят"""
+        server = web.Application()
+        server.router.add_post("/webhook/{bot}", self.handle)
+        runner = web.AppRunner(server)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+
+        workers = [asyncio.create_task(self.worker(name)) for name in self.apps for _ in range(self.workers)]
+        self._accepting = True
+        for name, app in self.apps.items():
+            await app.bot.set_webhook(f"{self.base_url}/webhook/{name}", secret_token=self.secret)
+        log.info("Webhook-сервер запущен на %s:%s", self.host, self.port)
+
+        try:
+            await asyncio.Event().wait()
+        finally:
+            # Плавная остановка: новые обновления не принимаем (Telegram их придержит), а уже принятые дорабатываем
+            self._accepting = False
+            try:
+                await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self.queues.values())), self.drain_timeout)
+            except asyncio.TimeoutError:
+                for name, queue in self.queues.items():
+                    if queue.qsize() or self.processing[name]:
+                        log.warning("Бот %s остановлен, не обработав %s обновлений: %s в очереди и %s в обработке",
+                                    name, queue.qsize() + self.processing[name], queue.qsize(), self.processing[name])
+            for task in workers:
+                task.cancel()
+            await runner.cleanup()